@@ -0,0 +1,250 @@
+"""
+Benchmarks of the pipeline: the hot spots (stem search), every stage of both pipelines, and
+end-to-end runs, on synthetic workloads (see `synthetic.py`) of increasing scale. Throughput and
+peak memory are written to a JSON report.
+Run with: python -m splash_structure_py.src.benchmark --scales 1000 10000 100000 --report bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.process_targets import find_stem_ind_bruteforce, process_df
+from splash_structure_py.src.stem_search import find_stem_ind, rc, segment_hairpins, HAIRPIN_COLUMNS
+from splash_structure_py.src.process_compactors import process_compactors
+from splash_structure_py.src.result_cache import ResultCache
+from splash_structure_py.src.synthetic import write_synthetic
+from splash_structure_py.src.table_io import read_table
+import splash_structure_py.src.get_pval as get_pval
+import splash_structure_py.structure_target_mode as target_mode
+import splash_structure_py.structure_compactor_mode as compactor_mode
+
+MODES = {"target": ("splash", "splash_structure_py.structure_target_mode", ["--no_cache", "--no_stem_index"]),
+         "compactor": ("compactor", "splash_structure_py.structure_compactor_mode", ["--no_stem_index"])}
+
+def random_hairpin_seqs(n_seq, seq_len, hairpin_rate=0.5, seed=0):
+    """
+    Return `n_seq` random sequences of length `seq_len`; a fraction `hairpin_rate` of 
+    them carries an inverted repeat of 5 to seq_len//4 bases.
+    """
+    rng = random.Random(seed)
+    seqs = []
+    for _ in range(n_seq):
+        seq = ''.join(rng.choice('ACGT') for _ in range(seq_len))
+        if rng.random() < hairpin_rate:
+            stem_len = rng.randint(5, max(5, seq_len // 4))
+            start = rng.randint(0, seq_len - 2 * stem_len)
+            rc_start = rng.randint(start + stem_len, seq_len - stem_len)
+            stem = seq[start:start + stem_len]
+            seq = seq[:rc_start] + rc(stem) + seq[rc_start + stem_len:]
+        seqs.append(seq)
+    return seqs
+
+def time_func(func, seqs, repeat=3):
+    """
+    Return the best wall time (seconds) of calling `func` on every sequence.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for seq in seqs:
+            func(seq, 5)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_find_stem_ind(seq_lens=(27, 80, 150), n_seq=200, seed=0):
+    """
+    Compare the indexed stem search with the brute-force search, and with the enumeration of all
+    hairpins of the sequences at once. Also checks that all three return the same stem for every 
+    sequence (the first hairpin of the enumeration).
+
+    Output:
+    A list of dicts with seq_len, n_seq, bruteforce_s, indexed_s, speedup, enumerate_s and 
+    num_hairpin (hairpins enumerated).
+    """
+    results = []
+    for seq_len in seq_lens:
+        seqs = random_hairpin_seqs(n_seq, seq_len, seed=seed)
+        hairpins = segment_hairpins(seqs, [np.arange(seq_len)], 5)
+        first = hairpins.drop_duplicates("sequence").set_index("sequence")[HAIRPIN_COLUMNS[:5]]
+        for i, seq in enumerate(seqs):
+            enumerated = first.loc[i].tolist() if i in first.index else [0, 0, 0, 0, 0]
+            if not list(find_stem_ind(seq, 5)) == list(find_stem_ind_bruteforce(seq, 5)) == enumerated:
+                raise AssertionError(f"stem search mismatch on {seq}")
+        t_brute = time_func(find_stem_ind_bruteforce, seqs)
+        t_index = time_func(find_stem_ind, seqs)
+        start = time.perf_counter()
+        segment_hairpins(seqs, [np.arange(seq_len)], 5)
+        t_enum = time.perf_counter() - start
+        results.append({"seq_len": seq_len, "n_seq": n_seq, "bruteforce_s": t_brute, 
+                        "indexed_s": t_index, "speedup": t_brute / t_index, 
+                        "enumerate_s": t_enum, "num_hairpin": len(hairpins)})
+    return results
+
+def measure(func, df, trace_memory=True):
+    """
+    Run `func(df)` and return (result, wall seconds, peak traced memory in MB). The peak is taken 
+    from a second run under tracemalloc, which would distort the timing of the first one.
+    """
+    start = time.perf_counter()
+    result = func(df.copy())
+    seconds = time.perf_counter() - start
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        func(df.copy())
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, seconds, peak_mb
+
+# stages of each pipeline as functions dataframe -> dataframe, in pipeline order: the step 
+# functions the pipelines themselves call
+STAGES = {"target": [("process_targets", process_df),
+                     ("mutations", target_mode.target_mutations),
+                     ("target_p", target_mode.add_target_p),
+                     ("anchor_score", target_mode.add_anchor_score),
+                     ("anchor_p", get_pval.wrap_anchor_p_target),
+                     ("notation", target_mode.add_notations)],
+          "compactor": [("preprocess", lambda df: process_compactors(df, segments=False)),
+                        ("stem_search", compactor_mode.compactor_stems),
+                        ("mutations", compactor_mode.compactor_mutations),
+                        ("compactor_p", compactor_mode.add_compactor_p),
+                        ("anchor_score", compactor_mode.add_anchor_score_per_split),
+                        ("anchor_p", get_pval.wrap_anchor_p_compactor),
+                        ("notation", compactor_mode.add_compactor_notations)]}
+
+def bench_stages(mode, input_file, n_anchors, trace_memory=True):
+    """
+    Time every stage of a pipeline on `input_file`, each stage on the output of the previous one.
+
+    Output:
+    A list of dicts with mode, stage, n_anchors, rows_in, rows_out, seconds, rows_per_s and peak_mb.
+    """
+    results = []
+    start = time.perf_counter()
+    df = read_table(input_file)
+    results.append({"mode": mode, "stage": "read", "n_anchors": n_anchors, "rows_in": len(df), 
+                    "rows_out": len(df), "seconds": time.perf_counter() - start})
+    for stage, func in STAGES[mode]:
+        if len(df) == 0:
+            break
+        get_pval.clear_caches()
+        out, seconds, peak_mb = measure(func, df, trace_memory)
+        results.append({"mode": mode, "stage": stage, "n_anchors": n_anchors, "rows_in": len(df), 
+                        "rows_out": len(out), "seconds": seconds, "peak_mb": peak_mb})
+        df = out
+    if mode == "target":
+        # Steps 1 to 5 through the result cache, as the pipeline runs them: a first run fills 
+        # the cache, a rerun on the same input reads every anchor back
+        df = read_table(input_file)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir)
+            for stage in ("stats_cold_cache", "stats_warm_cache"):
+                get_pval.clear_caches()
+                out, seconds, _ = measure(lambda d: target_mode.target_stats_cached(d, cache=cache), df, False)
+                results.append({"mode": mode, "stage": stage, "n_anchors": n_anchors, "rows_in": len(df), 
+                                "rows_out": len(out), "seconds": seconds, "peak_mb": None})
+            cache.close()
+    for res in results:
+        res["rows_per_s"] = res["rows_in"] / res["seconds"] if res["seconds"] > 0 else None
+    return results
+
+# Runs a command and prints its peak RSS and exit code. The pipeline is started from this small
+# process rather than from the benchmark, whose memory would count towards the peak RSS of a fork.
+_LAUNCHER = ("import os, sys, subprocess; proc = subprocess.Popen(sys.argv[1:], stdout=subprocess.DEVNULL); "
+             "_, status, usage = os.wait4(proc.pid, 0); print(usage.ru_maxrss, os.waitstatus_to_exitcode(status))")
+
+def bench_end_to_end(mode, input_file, n_anchors, workdir, pipeline_args=()):
+    """
+    Run a pipeline on `input_file` in a subprocess and measure its wall time and peak RSS.
+    Raises RuntimeError if the pipeline exits with a non-zero status.
+
+    Output:
+    A dict with mode, n_anchors, seconds, anchors_per_s, peak_rss_mb and returncode.
+    """
+    _, module, default_args = MODES[mode]
+    output_prefix = os.path.join(workdir, f"{mode}_{n_anchors}")
+    cmd = [sys.executable, "-m", module, output_prefix, input_file] + default_args + list(pipeline_args)
+    start = time.perf_counter()
+    launched = subprocess.run([sys.executable, "-c", _LAUNCHER] + cmd, stdout=subprocess.PIPE, text=True, check=True)
+    seconds = time.perf_counter() - start
+    maxrss, returncode = map(int, launched.stdout.split())
+    if returncode != 0:
+        raise RuntimeError(f"{mode} pipeline on {n_anchors} anchors exited with status {returncode}: {' '.join(cmd)}")
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak_rss_mb = maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    return {"mode": mode, "n_anchors": n_anchors, "seconds": seconds, "anchors_per_s": n_anchors / seconds, 
+            "peak_rss_mb": peak_rss_mb, "returncode": returncode}
+
+def environment():
+    """
+    Machine and library versions, recorded with the results.
+    """
+    return {"python": platform.python_version(), "platform": platform.platform(), 
+            "cpus": os.cpu_count(), "numpy": np.__version__, "pandas": pd.__version__, 
+            "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+def run_benchmarks(scales=(1000, 10000), modes=("target", "compactor"), suites=("stages", "end_to_end"), 
+                   workdir=None, seed=0, trace_memory=True, pipeline_args=(), log=print):
+    """
+    Generate a synthetic input of every scale and mode and run the benchmark suites on it.
+
+    Output:
+    The report: a dict with environment, scales and one list of results per suite.
+    """
+    report = {"environment": environment(), "scales": list(scales), "seed": seed}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        if "stem_search" in suites:
+            report["stem_search"] = bench_find_stem_ind(seed=seed)
+        for mode in modes:
+            kind = MODES[mode][0]
+            for n_anchors in scales:
+                input_file = write_synthetic(os.path.join(tmp, f"{kind}_{n_anchors}.tsv"), kind, n_anchors, seed=seed)
+                if "stages" in suites:
+                    for res in bench_stages(mode, input_file, n_anchors, trace_memory):
+                        report.setdefault("stages", []).append(res)
+                        log(f"{mode:>9} {n_anchors:>8} {res['stage']:>15}: {res['seconds']:8.3f}s "
+                            f"{res['rows_in']:>9} rows")
+                if "end_to_end" in suites:
+                    res = bench_end_to_end(mode, input_file, n_anchors, tmp, pipeline_args)
+                    report.setdefault("end_to_end", []).append(res)
+                    log(f"{mode:>9} {n_anchors:>8} {'end_to_end':>15}: {res['seconds']:8.3f}s "
+                        f"peak RSS {res['peak_rss_mb']:.0f} MB")
+    return report
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the SPLASH-structure pipelines on synthetic data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000],
+                        help="Numbers of anchors to benchmark, e.g. 1000 10000 100000 1000000. Default: 1000 10000.")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES),
+                        help="Pipelines to benchmark. Default: both.")
+    parser.add_argument("--suites", nargs="+", choices=["stem_search", "stages", "end_to_end"], 
+                        default=["stem_search", "stages", "end_to_end"], help="Benchmarks to run. Default: all.")
+    parser.add_argument("--report", default="benchmark_report.json", help="Path of the JSON report.")
+    parser.add_argument("--workdir", default=None, help="Folder for the generated inputs and pipeline outputs.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic workloads. Default: 0.")
+    parser.add_argument("--no_memory", action="store_true",
+                        help="Do not measure the peak memory of the stages (saves a second run of each stage).")
+    parser.add_argument("--pipeline_args", default="",
+                        help="Extra options of the end-to-end runs, e.g. \"--executor process --workers 8\".")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    report = run_benchmarks(args.scales, args.modes, args.suites, args.workdir, args.seed, 
+                            not args.no_memory, args.pipeline_args.split())
+    for res in report.get("stem_search", []):
+        print(f"find_stem_ind len={res['seq_len']:>4} n={res['n_seq']}: bruteforce {res['bruteforce_s']:.3f}s, "
+              f"indexed {res['indexed_s']:.3f}s, speedup {res['speedup']:.1f}x, "
+              f"all {res['num_hairpin']} hairpins {res['enumerate_s']:.3f}s")
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
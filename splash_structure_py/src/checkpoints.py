@@ -0,0 +1,166 @@
+"""
+Stage checkpoints for the pipelines. With checkpoints on (--checkpoint, or any of the options
+below), the intermediate dataframe is pickled after each stage to
+`{outfolder}/checkpoints/{stage}.pkl` and recorded in `checkpoints/manifest.json` together with
+a hash of the input file and the run options the stage depends on. A later run can then
+- resume: skip every stage that completed with the same input and options,
+- start at a stage: load the checkpoint of the stage before it and rerun from there,
+- stop after a stage: e.g. to rerun only the statistics.
+Without checkpoints, nothing is hashed or written.
+"""
+import os
+import json
+import time
+import hashlib
+import pandas as pd
+
+MANIFEST = "manifest.json"
+TARGET_STAGES = ["stats", "bh", "notation", "save", "annotation"]
+COMPACTOR_STAGES = ["preprocess", "stems", "stats", "bh", "notation", "save", "annotation"]
+# first stage whose results depend on a run option; other options apply from the first stage on
+TARGET_PARAM_STAGES = {"anchor_p_method": "stats", "notation": "stats", "notation_threshold": "notation", 
+                       "output_format": "save"}
+COMPACTOR_PARAM_STAGES = {"preprocess_backend": "preprocess", "notation": "stems", "anchor_p_method": "stats", 
+                          "notation_threshold": "notation", "output_format": "save"}
+
+def file_hash(path, block_size=2**20):
+    """
+    blake2b hash of the content of a file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Checkpoints:
+    """
+    Checkpoint manager of one pipeline run.
+
+    stages: ordered stage names of the pipeline
+    params: run options that change the results (JSON-serializable)
+    resume: skip stages that completed with the same input hash and options
+    start_at: first stage to run; the stages before it are loaded from their checkpoints
+    stop_after: last stage to run
+    enabled: write checkpoints even without resume, start_at and stop_after (which turn them on)
+    param_stages: {option: first stage that depends on it}; a checkpoint only records the options 
+    of its stage and the stages before it
+    """
+    def __init__(self, outfolder, stages, input_file, params, resume=False, start_at=None, stop_after=None,
+                 enabled=False, param_stages=None):
+        for stage in (start_at, stop_after):
+            if stage is not None and stage not in stages:
+                raise ValueError(f"Unknown stage '{stage}', choose from {stages}.")
+        self.folder = f'{outfolder}/checkpoints'
+        self.stages = stages
+        self.params = json.loads(json.dumps(params))
+        self.param_stages = param_stages or {}
+        self.resume = resume
+        self.start_at = start_at
+        self.stop_after = stop_after
+        self.current = None
+        self.enabled = enabled or resume or start_at is not None or stop_after is not None
+        if not self.enabled:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        self.input_hash = file_hash(input_file)
+        self.manifest = self._read_manifest()
+        if self.manifest.get("input_hash") != self.input_hash:
+            # another input: none of the previous checkpoints can be used
+            self.manifest = {"input_hash": self.input_hash, "stages": {}}
+
+        if start_at is not None and self.stages.index(start_at) > 0:
+            previous = self._previous_stage(start_at)
+            if previous not in self.manifest["stages"]:
+                raise ValueError(f"Cannot start at '{start_at}': no checkpoint of stage '{previous}' "
+                                 f"for this input in {self.folder}.")
+            if not self._completed(previous):
+                recorded = self.manifest["stages"][previous]["params"]
+                changed = sorted(name for name, value in self._stage_params(previous).items() 
+                                 if recorded.get(name) != value)
+                raise ValueError(f"Cannot start at '{start_at}': the checkpoint of stage '{previous}' was "
+                                 f"written with other options ({', '.join(changed)}); start at an earlier stage.")
+
+    def _read_manifest(self):
+        path = f'{self.folder}/{MANIFEST}'
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        path = f'{self.folder}/{MANIFEST}'
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _previous_stage(self, stage):
+        i = self.stages.index(stage)
+        return self.stages[i - 1] if i > 0 else None
+
+    def _stage_params(self, stage):
+        """
+        The run options the results of `stage` depend on.
+        """
+        i = self.stages.index(stage)
+        return {name: value for name, value in self.params.items() 
+                if self.stages.index(self.param_stages.get(name, self.stages[0])) <= i}
+
+    def _completed(self, stage):
+        entry = self.manifest["stages"].get(stage)
+        return entry is not None and entry["params"] == self._stage_params(stage)
+
+    def runs(self, stage):
+        """
+        Return True if `stage` will run in this invocation, without starting it (see `run`).
+        """
+        i = self.stages.index(stage)
+        if self.stop_after is not None and i > self.stages.index(self.stop_after):
+            return False
+        if self.start_at is not None:
+            return i >= self.stages.index(self.start_at)
+        return not (self.resume and self._completed(stage))
+
+    def run(self, stage):
+        """
+        Return True if `stage` has to run in this invocation, and make it the current stage.
+        """
+        if self.stop_after is not None and self.stages.index(stage) > self.stages.index(self.stop_after):
+            return False
+        if not self.runs(stage):
+            if self.start_at is None:
+                print(f"Resuming: stage '{stage}' is already completed, skipping.")
+            return False
+        self.current = stage
+        return True
+
+    def latest(self, df=None):
+        """
+        Input of the current stage: `df` if the previous stage ran in this invocation,
+        otherwise the checkpoint of the previous stage.
+        """
+        if df is not None:
+            return df
+        previous = self._previous_stage(self.current)
+        while previous is not None and self.manifest["stages"].get(previous, {}).get("file") is None:
+            previous = self._previous_stage(previous)
+        if previous is None:
+            raise ValueError(f"No checkpoint to start stage '{self.current}' from.")
+        return pd.read_pickle(f'{self.folder}/{self.manifest["stages"][previous]["file"]}')
+
+    def done(self, stage, df=None):
+        """
+        Record `stage` as completed, with `df` as its checkpoint. Checkpoints of the later stages
+        are dropped since they depend on this one.
+        """
+        if not self.enabled:
+            return
+        file = None
+        if df is not None:
+            file = f'{stage}.pkl'
+            df.to_pickle(f'{self.folder}/{file}')
+        for later in self.stages[self.stages.index(stage) + 1:]:
+            self.manifest["stages"].pop(later, None)
+        self.manifest["stages"][stage] = {"file": file, "rows": None if df is None else len(df),
+                                          "params": self._stage_params(stage), "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self._write_manifest()
@@ -9,50 +9,99 @@ import pandas as pd
 import numpy as np
 import sys
 import os
-import subprocess
-import time
-import multiprocessing
-
-def process_chunk(chunk):
-    results = {}
-    for index, row in chunk.iterrows():
-        anchor = row['anchor']
-        hit_info = {}
-
-        for col in chunk.columns:
-            if 'hits' in col and '_pos' not in col:
-                if row[col] != '*':
-                    pos_col = col.replace('hits', 'hits_pos')
-                    hit_info[col] = row[pos_col]
-
-        results[anchor] = hit_info
-
-    return results
-
-def parallel_process(df, num_partitions, num_cores):
-    df_split = np.array_split(df, num_partitions)
-    pool = multiprocessing.Pool(num_cores)
-    results = pool.map(process_chunk, df_split)
-    pool.close()
-    pool.join()
-    return {k: v for d in results for k, v in d.items()}
-
-def helper_creat_anchor_list(outfolder: str, seq_type: str, seq_len: int = None):
-    # create anchor list for annotations
+
+from splash_structure_py.src.table_io import iter_table
+from splash_structure_py.src.job_runner import get_job_runner, JobError
+
+# element annotation pipeline (nextflow wrapper), called as: <script> <sequence list> <outfolder> <name>;
+# it is not part of the package, see --annotation_script
+ELEM_ANNS_SCRIPT_ENV = "SS_ELEM_ANNS_SCRIPT"
+ANCHOR_LIST_CHUNK_SIZE = 1000000   # rows of the structure results read at a time for the sequence list
+
+def hit_columns(df_anns):
+    """
+    (hits column, hits_pos column) pairs of an annotation table, e.g. ('Rfam_hits', 'Rfam_hits_pos').
+    """
+    return [(col, col.replace('hits', 'hits_pos')) for col in df_anns.columns if 'hits' in col and '_pos' not in col]
+
+def read_annotations(anns_file):
+    """
+    Read an element annotation table with every column as text, as written ('*' for no hit).
+    """
+    return pd.read_csv(anns_file, sep='\t', dtype=str, keep_default_na=False)
+
+def annotation_hits(df_anns):
+    """
+    Reshape the hits / hits_pos column pairs of an annotation table to a long table with one row 
+    per hit ('*' is no hit): anchor (the annotated sequence), database (the hits column), hit and 
+    hits_pos. Hits of a sequence are in column order; for duplicated sequences the last row is used.
+    """
+    df_anns = df_anns.drop_duplicates('anchor', keep='last')
+    anchors = df_anns['anchor'].to_numpy(dtype=object)
+    parts = []
+    for hit_col, pos_col in hit_columns(df_anns):
+        hits = df_anns[hit_col].to_numpy(dtype=object)
+        found = hits != '*'
+        pos = df_anns[pos_col].to_numpy(dtype=object)[found] if pos_col in df_anns.columns else None
+        parts.append(pd.DataFrame({"anchor": anchors[found], "database": hit_col, "hit": hits[found], 
+                                   "hits_pos": pos}))
+    if not parts:
+        return pd.DataFrame(columns=["anchor", "database", "hit", "hits_pos"])
+    hits = pd.concat(parts, ignore_index=True)
+    # group the hits of a sequence, keeping the column order
+    order = np.argsort(pd.factorize(hits['anchor'])[0], kind='stable')
+    return hits.iloc[order].reset_index(drop=True)
+
+def annotation_script(script: str = None):
+    """
+    Path of the element annotation script: `script`, or $SS_ELEM_ANNS_SCRIPT. Raises if neither 
+    is set or the script does not exist, so the pipelines check it before their first step.
+    """
+    script = script or os.environ.get(ELEM_ANNS_SCRIPT_ENV)
+    if not script:
+        raise ValueError(f"No element annotation script: pass --annotation_script or set ${ELEM_ANNS_SCRIPT_ENV}.")
+    if not os.path.exists(script):
+        raise FileNotFoundError(f"Element annotation script {script} not found, see --annotation_script.")
+    return script
+
+def helper_creat_anchor_list(outfolder: str, seq_type: str, seq_len: int = None, structure_file: str = None, 
+                             chunks=None):
+    # create anchor list for annotations, reading only the sequence columns of the structure results
+    # (or taking the sequences from the dataframes of `chunks`)
     if seq_type == "compactor":
-        input_file = f'{outfolder}/structure_on_compactors_{seq_len}mers.tsv'
+        input_file = structure_file or f'{outfolder}/structure_on_compactors_{seq_len}mers.tsv'
         output_file = f'{outfolder}/elem_anns/compactors_{seq_len}.txt'
-        command = f"awk -F'\t' 'NR==1 {{print $1}} NR>1 {{print $2}}' {input_file} > {output_file}"
+        columns = ['compactor']
     else:
-        input_file = f'{outfolder}/structure_on_targets.tsv'
+        input_file = structure_file or f'{outfolder}/structure_on_targets.tsv'
         output_file = f'{outfolder}/elem_anns/extendors.txt'
-        command = f"awk -F'\t' 'NR==1 {{print $1}} NR>1 {{print $1 $8}}' {input_file} > {output_file}"
+        columns = ['anchor', 'base_target']
 
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    with open(output_file, 'w') as f:
+        f.write('anchor\n')
+        if chunks is None:
+            chunks = iter_table(input_file, ANCHOR_LIST_CHUNK_SIZE, columns)
+        for df in chunks:
+            seqs = df['compactor'] if seq_type == "compactor" else df['anchor'].astype(str) + df['base_target'].astype(str)
+            f.writelines(f'{seq}\n' for seq in seqs)
 
     return os.path.abspath(output_file)
 
-def run_anns(outfolder: str, seq_type: str = "extendor", seq_len: int = None):
+def annotation_file(outfolder: str, elem_ann_folder: str):
+    """
+    Path of the anchor annotations written by the element annotation pipeline.
+    """
+    return (f"{outfolder}/elem_anns/{elem_ann_folder}_work/{elem_ann_folder}/element_annotations/"
+            "element_annotations_anchors.tsv")
+
+def submit_anns(outfolder: str, seq_type: str = "extendor", seq_len: int = None, structure_file: str = None, 
+                script: str = None, runner=None, chunks=None):
+    """
+    Write the sequence list and start the element annotation job without waiting for it.
+    The sequences are read from `structure_file`, or taken from the structure results in `chunks` 
+    (dataframes), so the job can start before the results are saved.
+    Returns the Job and the name of the annotation folder, see `finish_anns`.
+    """
     os.makedirs(f"{outfolder}/elem_anns/", exist_ok=True)
     
     if seq_type == "compactor":
@@ -63,31 +112,79 @@ def run_anns(outfolder: str, seq_type: str = "extendor", seq_len: int = None):
         elem_ann_folder = f"nf_anns_{seq_type}"
 
     # create anchor list for annotations
-    anchor_list = helper_creat_anchor_list(outfolder, seq_type, seq_len)
-
-    # run element annotations and capture its ID
-    command = f"sbatch /oak/stanford/groups/horence/juliew/structure/scripts/elem_anns.sh {anchor_list} {outfolder} {elem_ann_folder}"
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
-    job_id = result.stdout.strip().split()[-1]
-
-    # Poll the job status
-    while True:
-        status_command = f"squeue -j {job_id}"
-        status_result = subprocess.run(status_command, shell=True, capture_output=True, text=True)
-
-        if job_id not in status_result.stdout:
-            break  # Job is no longer in the queue
-
-        time.sleep(10)  # Wait for some time before checking again
-
+    anchor_list = helper_creat_anchor_list(outfolder, seq_type, seq_len, structure_file, chunks)
+
+    # run element annotations as a job of the shared runner (local subprocess or SLURM)
+    script = annotation_script(script)
+    runner = runner or get_job_runner()
+    job = runner.submit(elem_ann_folder, script, [anchor_list, outfolder, elem_ann_folder], 
+                        log_file=os.path.abspath(f"{outfolder}/elem_anns/{elem_ann_folder}.log"))
+    return job, elem_ann_folder
+
+def finish_anns(job, outfolder: str, elem_ann_folder: str):
+    """
+    Wait for an element annotation job and check that it wrote its annotations. Returns the path 
+    of the annotation file.
+    """
+    job.wait()
+    anns_file = annotation_file(outfolder, elem_ann_folder)
+    if not os.path.exists(anns_file):
+        raise JobError(f"Element annotation job {job.job_id} finished without writing {anns_file}.")
+    return anns_file
+
+def run_anns(outfolder: str, seq_type: str = "extendor", seq_len: int = None, structure_file: str = None, 
+             script: str = None, runner=None):
+    """
+    Run element annotations and wait for them. Returns the name of the annotation folder.
+    """
+    job, elem_ann_folder = submit_anns(outfolder, seq_type, seq_len, structure_file, script, runner)
+    finish_anns(job, outfolder, elem_ann_folder)
     return elem_ann_folder
 
-def merge_anns_struc(df_anns, df_struc, seq_type: str = "extendor"):
-    num_partitions = 20                                     # number of partitions to split dataframe
-    num_cores = multiprocessing.cpu_count()                 # number of cores on your machine
-    hits_results = parallel_process(df_anns, num_partitions, num_cores)
+def merge_anns_struc(df_anns, df_struc, seq_type: str = "extendor", nested: bool = False):
+    """
+    Add the element annotations of every row as column EA: {hits column: hits_pos} of the hits 
+    of its sequence, the compactor (compactor mode) or anchor + base_target (target mode). 
+    EA is the text of the dict (as written to TSV before, readable with ast.literal_eval), or the 
+    dict itself with nested=True. Sequences without annotation get {}.
+    """
+    return merge_hits_struc(annotation_hits(df_anns), df_struc, seq_type, nested)
+
+def merge_anns_struc_chunks(anns_file, structure_file, output_file, chunksize, seq_type: str = "extendor"):
+    """
+    `merge_anns_struc` on a TSV structure results file, `chunksize` rows at a time, written to the 
+    TSV `output_file`. The structure results are copied as text. Returns the number of rows.
+    """
+    hits = annotation_hits(read_annotations(anns_file))
+    num_rows = 0
+    chunks = pd.read_csv(structure_file, sep='\t', dtype=str, keep_default_na=False, chunksize=chunksize)
+    for i, chunk in enumerate(chunks):
+        chunk = merge_hits_struc(hits, chunk, seq_type)
+        chunk.to_csv(output_file, mode='a' if i else 'w', header=i == 0, index=False, sep='\t')
+        num_rows += len(chunk)
+    return num_rows
+
+def merge_hits_struc(hits, df_struc, seq_type: str = "extendor", nested: bool = False):
+    """
+    `merge_anns_struc` with the long hit table of `annotation_hits`.
+    """
     if seq_type == "compactor":
-        df_struc['EA'] = df_struc.apply(lambda x: hits_results[x['compactor']], axis=1)
+        keys = df_struc['compactor'].astype(str)
     else:
-        df_struc['EA'] = df_struc.apply(lambda x: hits_results[x['anchor'] + x['base_target']], axis=1)
+        keys = df_struc['anchor'].astype(str) + df_struc['base_target'].astype(str)
+    # hits of a sequence are contiguous rows of the long table
+    anchor, database, pos = (hits[col].to_numpy(dtype=object) for col in ("anchor", "database", "hits_pos"))
+    starts = np.flatnonzero(np.r_[True, anchor[1:] != anchor[:-1]]) if len(hits) else np.zeros(0, dtype=np.int64)
+    row = pd.Index(anchor[starts]).get_indexer(keys.to_numpy(dtype=object))
+    if nested:
+        ends = np.r_[starts[1:], len(hits)]
+        ea = [dict(zip(database[i:j], pos[i:j])) for i, j in zip(starts, ends)]
+        df_struc['EA'] = [ea[i] if i >= 0 else {} for i in row]
+        return df_struc
+    entries = np.array([f"{db!r}: {p!r}" for db, p in zip(database, pos)], dtype=object)
+    joined = np.ones(len(entries), dtype=bool)
+    joined[starts] = False
+    entries[joined] = ", " + entries[joined]
+    ea = "{" + np.add.reduceat(entries, starts) + "}" if len(entries) else entries
+    df_struc['EA'] = np.where(row >= 0, ea[row] if len(ea) else "{}", "{}").astype(object)
     return df_struc
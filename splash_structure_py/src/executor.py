@@ -0,0 +1,116 @@
+"""
+Execution backend for the per-anchor work of both pipelines (anchor_p convolutions, stem search).
+Work items are cut into batches and run serially, on a thread pool, or on a process pool.
+One pool is created for the whole pipeline and reused by every step. Inputs below
+`serial_threshold` items run serially, where dispatching to workers would cost more than it saves.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+EXECUTOR_KINDS = ["auto", "serial", "thread", "process"]
+SERIAL_THRESHOLD = 2000       # work items; smaller inputs always run serially
+BATCHES_PER_WORKER = 4        # default batch size: about this many batches per worker
+
+def available_cpus():
+    """
+    Number of CPUs this process may run on (respects taskset / SLURM CPU binding).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _run_batch(func, batch, args):
+    return [func(item, *args) for item in batch]
+
+class Executor:
+    """
+    Map a function over work items in batches.
+
+    kind: 'serial', 'thread', 'process', or 'auto' (process pool above `serial_threshold` items)
+    workers: number of workers (default: available CPUs)
+    batch_size: items per batch sent to a worker (default: about 4 batches per worker)
+    start_method: how process pool workers are started ('fork', 'spawn' or 'forkserver'; default:
+    the platform default). A pool used from several threads needs 'spawn' or 'forkserver', since
+    forking while another thread holds a lock can deadlock the workers.
+    """
+    def __init__(self, kind="auto", workers=None, batch_size=None, serial_threshold=SERIAL_THRESHOLD, 
+                 start_method=None):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor '{kind}', choose from {EXECUTOR_KINDS}.")
+        self.kind = kind
+        self.workers = workers or available_cpus()
+        self.batch_size = batch_size
+        self.serial_threshold = serial_threshold
+        self.start_method = start_method
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # created on first use and kept until `shutdown`, so workers (and their caches) persist
+        with self._lock:
+            if self._pool is None:
+                if self.kind == "thread":
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    context = None if self.start_method is None else multiprocessing.get_context(self.start_method)
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def runs_serially(self, num_items):
+        if self.kind == "serial" or self.workers <= 1:
+            return True
+        return self.kind == "auto" and num_items < self.serial_threshold
+
+    def map(self, func, items, *args):
+        """
+        Return [func(item, *args) for item in items], in order. With a process pool, `func`
+        and `args` must be picklable (module-level functions).
+        """
+        items = list(items)
+        if self.runs_serially(len(items)):
+            return _run_batch(func, items, args)
+        batch_size = self.batch_size or max(1, -(-len(items) // (self.workers * BATCHES_PER_WORKER)))
+        batches = [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+        futures = [self._get_pool().submit(_run_batch, func, batch, args) for batch in batches]
+        return [result for future in futures for result in future.result()]
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+# executor shared by the pipeline steps; serial until `configure_executor` is called
+_executor = Executor("serial")
+_configure_lock = threading.Lock()
+
+def configure_executor(kind="auto", workers=None, batch_size=None, serial_threshold=SERIAL_THRESHOLD, 
+                       start_method=None):
+    """
+    Replace the shared executor (the pool of the previous one is shut down) and return it. An 
+    executor with the same settings is kept with its pool. `kind` may also be an Executor, which 
+    becomes the shared one, e.g. the executor a batch sets up for all its datasets.
+    """
+    global _executor
+    with _configure_lock:
+        if isinstance(kind, Executor):
+            if kind is not _executor:
+                _executor.shutdown()
+                _executor = kind
+            return _executor
+        settings = (kind, workers or available_cpus(), batch_size, serial_threshold, start_method)
+        if settings == (_executor.kind, _executor.workers, _executor.batch_size, _executor.serial_threshold, 
+                        _executor.start_method):
+            return _executor
+        _executor.shutdown()
+        _executor = Executor(kind, workers, batch_size, serial_threshold, start_method)
+        return _executor
+
+def get_executor():
+    return _executor
+
+def shutdown_executor():
+    _executor.shutdown()
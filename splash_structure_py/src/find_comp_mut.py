@@ -6,6 +6,8 @@ The script also provides three ways for strucutre notation.
 import numpy as np
 import pandas as pd
 
+from splash_structure_py.src.seq_array import SeqArray, packed_positions, read_packed
+
 def rc(seq):
     """
     Take in sequence and return the reverse complement of the given sequence.
@@ -69,6 +71,242 @@ def find_mutation(base, target, stem_start_idx, stem_end_idx, rc_start_idx, rc_e
 
     return (totaMut, stemMut, compMut, struc)
 
+### Batch version of find_mutation on uint8-encoded sequences ###
+COMPLEMENT_CODE = np.arange(256, dtype=np.uint8)
+COMPLEMENT_CODE[list(b'ACGT')] = list(b'TGCA')
+LOWER_CODE = np.frombuffer(bytes(range(256)).lower(), dtype=np.uint8)
+
+def encode_seqs(seqs):
+    """
+    Encode equal-length sequences as a (num_seq, seq_len) uint8 matrix of ASCII codes.
+    """
+    seqs = list(seqs)
+    seq_len = len(seqs[0]) if seqs else 0
+    return np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8).reshape(len(seqs), seq_len)
+
+def mutation_masks(base, target, stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx):
+    """
+    Compute the position masks used by `find_mutation` for encoded sequences.
+
+    Input:
+    base, target: (n, L) uint8 matrices from `encode_seqs`
+    stem indices: arrays of length n
+
+    Output (all (n, L) arrays):
+    mut: position is mutated
+    left, right: position is in the left / right stem (left takes precedence)
+    comp: position is in the left stem and forms a compensatory pair with its mirror position
+    mirror: index of the paired position in the other stem
+    """
+    idx = np.arange(base.shape[1])[None, :]
+    s, e, rs, re = [np.asarray(x, dtype=np.int64)[:, None] for x in 
+                    (stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx)]
+    mut = base != target
+    left = (idx >= s) & (idx <= e)
+    right = ~left & (idx >= rs) & (idx <= re)
+    mirror = np.clip(s + re - idx, 0, base.shape[1] - 1)
+    mut_mirror = np.take_along_axis(mut, mirror, axis=1)
+    target_mirror = np.take_along_axis(target, mirror, axis=1)
+    comp = mut & left & mut_mirror & (COMPLEMENT_CODE[target] == target_mirror)
+    return mut, left, right, comp, mirror
+
+def _rows_to_strings(codes, no_stem):
+    """
+    Decode a uint8 matrix row by row, NaN for rows flagged in `no_stem`.
+    """
+    width = codes.shape[1]
+    text = codes.tobytes().decode('ascii')
+    return [np.nan if no_stem[i] else text[i*width:(i+1)*width] for i in range(len(codes))]
+
+def notations_from_masks(target, mut, left, right, comp, mirror, stem_start_idx, stem_end_idx, 
+                         rc_start_idx, rc_end_idx, which=("struc", "db", "symbol")):
+    """
+    Build structure notations directly from stem indices and the masks of `mutation_masks`,
+    without parsing other notations. Rows without a stem (stem_end_idx == 0) get NaN.
+
+    Output: a dict with the requested notations (lists of strings)
+    1. struc: notation of `find_mutation`, mutations in lower case, compensatory pairs in 
+       upper case, '-' elsewhere, and the stem delimited by '{', '(', ')' and '}'.
+    2. db: dot-bracket notation, same as `db_notation_from_old_notaion`.
+    3. symbol: dot-bracket with '*' for mutations and '<', '>' for compensatory pairs, 
+       same as `symbol_notation_from_old_notaion`.
+    """
+    n, L = target.shape
+    s, e, rs, re = [np.asarray(x, dtype=np.int64) for x in 
+                    (stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx)]
+    no_stem = e == 0
+    rows, cols = np.nonzero(comp)
+    paired = comp.copy()
+    paired[rows, mirror[rows, cols]] = True
+    notations = {}
+
+    if "struc" in which:
+        struc = np.where(mut, LOWER_CODE[target], ord('-')).astype(np.uint8)
+        struc[paired] = target[paired]
+        # insert the 4 delimiters: shift each position by the number of delimiters before it
+        idx = np.arange(L)[None, :]
+        dest = idx + (idx >= s[:, None]) + (idx > e[:, None]) + (idx >= rs[:, None]) + (idx > re[:, None])
+        # rows without a stem have overlapping delimiters (and end up as NaN), so pre-fill
+        out = np.full((n, L + 4), ord('-'), dtype=np.uint8)
+        out[np.arange(n)[:, None], dest] = struc
+        for col, char in [(s, '{'), (e + 2, '('), (rs + 2, ')'), (re + 4, '}')]:
+            out[np.arange(n), col] = ord(char)
+        notations["struc"] = _rows_to_strings(out, no_stem)
+
+    if "db" in which or "symbol" in which:
+        db = np.full((n, L), ord('.'), dtype=np.uint8)
+        db[left] = ord('(')
+        db[right] = ord(')')
+        if "db" in which:
+            notations["db"] = _rows_to_strings(db, no_stem)
+        if "symbol" in which:
+            lowered = LOWER_CODE[target]
+            upper = paired & (target >= ord('A')) & (target <= ord('Z'))
+            lower = mut & ~paired & (lowered >= ord('a')) & (lowered <= ord('z'))
+            before_rc = np.arange(L)[None, :] < rs[:, None]
+            db[lower] = ord('*')
+            db[upper & before_rc] = ord('<')
+            db[upper & ~before_rc] = ord('>')
+            notations["symbol"] = _rows_to_strings(db, no_stem)
+    return notations
+
+def _length_groups(target):
+    """
+    Yield (seq_len, rows) for the rows of each distinct sequence length.
+    """
+    lengths = np.array([len(t) for t in target], dtype=np.int64)
+    for seq_len in np.unique(lengths):
+        yield seq_len, np.flatnonzero(lengths == seq_len)
+
+def mutation_counts_packed(base, target, stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx):
+    """
+    (totaMut, stemMut, compMut) of `find_mutation` for sequences packed in SeqArrays: mutations 
+    are counted with a popcount of the packed mismatch bits, restricted to the stem for stemMut.
+    """
+    idx = np.arange(base.seq_len)[None, :]
+    s, e, rs, re = [np.asarray(x, dtype=np.int64)[:, None] for x in 
+                    (stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx)]
+    left = (idx >= s) & (idx <= e)
+    stem = left | ((idx >= rs) & (idx <= re))
+    totaMut = base.mismatch_count(target)
+    stemMut = base.mismatch_count(target, stem)
+    mut = base.mismatch_bits(target)
+
+    # compensatory pairs: position s+t of the left stem and its mirror re-t are both mutated and 
+    # complementary (2-bit codes: XOR 3), N pairs with N. Only stem positions are gathered.
+    t = np.arange(max(int((e - s).max()) + 1, 1))[None, :] if len(s) else np.zeros((1, 0), dtype=np.int64)
+    in_stem = t <= e - s
+    left_idx = np.clip(s + t, 0, base.seq_len - 1)
+    right_idx = np.clip(re - t, 0, base.seq_len - 1)
+    rows = np.arange(len(s))[:, None]
+    left_pos = packed_positions(target.packed, rows, left_idx)
+    right_pos = packed_positions(target.packed, rows, right_idx)
+    codes_left, codes_right = read_packed(target.packed, left_pos), read_packed(target.packed, right_pos)
+    complementary = (codes_left ^ 3) == codes_right
+    if target.n_bits is not None:
+        amb_left, amb_right = read_packed(target.n_bits, left_pos), read_packed(target.n_bits, right_pos)
+        complementary = np.where(amb_left | amb_right, amb_left & amb_right, complementary)
+    comp = in_stem & (read_packed(mut, left_pos) & read_packed(mut, right_pos) != 0) & complementary
+    return totaMut, stemMut, comp.sum(axis=1)
+
+def _pack_group(seqs):
+    """
+    SeqArray of the sequences, or None if they contain characters other than A, C, G, T and N.
+    """
+    try:
+        return SeqArray.from_strings(seqs)
+    except ValueError:
+        return None
+
+def find_mutation_batch(base, target, stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx, notation=True):
+    """
+    Vectorized `find_mutation` over many rows. Rows are grouped by sequence length. Without 
+    notations, each group is packed 2 bits per base (`mutation_counts_packed`); with notations, or 
+    for sequences with other characters than A, C, G, T and N, it is handled as a uint8 matrix of 
+    ASCII codes with array masks.
+
+    Input:
+    base, target: sequences (base and target of a row have the same length)
+    stem indices: one value per row
+    notation: also build the structure notation strings (otherwise None is returned for them)
+
+    Output:
+    (totaMut, stemMut, compMut, struc) with one entry per row
+    """
+    base, target = list(base), list(target)
+    stem_idx = [np.asarray(x, dtype=np.int64) for x in 
+                (stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx)]
+    n = len(target)
+    totaMut, stemMut, compMut = (np.zeros(n, dtype=np.int64) for _ in range(3))
+    struc = np.empty(n, dtype=object) if notation else None
+
+    for seq_len, rows in _length_groups(target):
+        row_idx = [x[rows] for x in stem_idx]
+        if not notation:
+            base_arr = _pack_group(base[i] for i in rows)
+            target_arr = _pack_group(target[i] for i in rows)
+            if base_arr is not None and target_arr is not None:
+                totaMut[rows], stemMut[rows], compMut[rows] = mutation_counts_packed(base_arr, target_arr, *row_idx)
+                continue
+        base_mat = encode_seqs(base[i] for i in rows)
+        target_mat = encode_seqs(target[i] for i in rows)
+        mut, left, right, comp, mirror = mutation_masks(base_mat, target_mat, *row_idx)
+        totaMut[rows] = mut.sum(axis=1)
+        stemMut[rows] = (mut & (left | right)).sum(axis=1)
+        compMut[rows] = comp.sum(axis=1)
+        if notation:
+            struc[rows] = notations_from_masks(target_mat, mut, left, right, comp, mirror, 
+                                               *row_idx, which=("struc",))["struc"]
+    return totaMut, stemMut, compMut, struc
+
+def structure_notations(base, target, stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx):
+    """
+    Return the three structure notations (strucNotation, db_strucNotation, symbol_strucNotation)
+    for many rows, built from stem indices and mutation masks. Used to annotate only the rows 
+    that are needed, independently of the statistics.
+    """
+    base, target = list(base), list(target)
+    stem_idx = [np.asarray(x, dtype=np.int64) for x in 
+                (stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx)]
+    notations = {key: np.empty(len(target), dtype=object) for key in ("struc", "db", "symbol")}
+    for seq_len, rows in _length_groups(target):
+        base_mat = encode_seqs(base[i] for i in rows)
+        target_mat = encode_seqs(target[i] for i in rows)
+        row_idx = [x[rows] for x in stem_idx]
+        masks = mutation_masks(base_mat, target_mat, *row_idx)
+        for key, values in notations_from_masks(target_mat, *masks, *row_idx).items():
+            notations[key][rows] = values
+    return notations["struc"], notations["db"], notations["symbol"]
+
+NOTATION_COLUMNS = ["strucNotation", "db_strucNotation", "symbol_strucNotation"]
+NOTATION_MODES = ["all", "significant", "none"]
+
+def init_notation_columns(df, suffix=""):
+    """
+    Add empty notation columns (e.g. strucNotation{suffix}) so that they keep their place 
+    in the output when they are filled later by `add_structure_notations`.
+    """
+    for col in NOTATION_COLUMNS:
+        df[col + suffix] = pd.Series(np.nan, index=df.index, dtype=object)
+    return df
+
+def add_structure_notations(df, rows=None, suffix="", base_col="base_target", target_col="target"):
+    """
+    Fill the three notation columns of `rows` (index labels, all rows if None) of df. 
+    Stem indices are read from the stem_start_idx{suffix}, ... columns.
+    """
+    if f"strucNotation{suffix}" not in df.columns:
+        init_notation_columns(df, suffix)
+    sub_df = df if rows is None else df.loc[rows]
+    if len(sub_df) == 0:
+        return df
+    notations = structure_notations(sub_df[base_col], sub_df[target_col], 
+                                    sub_df[f"stem_start_idx{suffix}"], sub_df[f"stem_end_idx{suffix}"], 
+                                    sub_df[f"rc_start_idx{suffix}"], sub_df[f"rc_end_idx{suffix}"])
+    for col, values in zip(NOTATION_COLUMNS, notations):
+        df.loc[sub_df.index, col + suffix] = values
+    return df
+
 def db_notation_from_idx(stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx, target_length):
     db_notation=''
     for i in range(target_length):
@@ -1,9 +1,57 @@
 import numpy as np
 import pandas as pd
-from math import comb
+from math import comb, lgamma
+from functools import lru_cache
 import itertools
+import time
 import sys
-from pandarallel import pandarallel
+
+from splash_structure_py.src.executor import get_executor
+from splash_structure_py.src.profiling import get_profiler
+
+### 0. Per-process cache for target p ###
+# target_p and target_p_outcome only depend on a few small integers, so the same
+# parameter tuples are evaluated over and over across targets and anchors. Both are
+# memoized in a bounded LRU cache (one per process, i.e. one per worker of a process pool).
+TARGET_P_CACHE_SIZE = 2**16
+OUTCOME_CACHE_SIZE = 2**14
+
+def _target_p_uncached(k, stemL, totaMut, stemMut, compMut):
+    p_1 = target_p1_closed_form(k, totaMut, stemL, compMut)
+    p_2 = comb(k - 2 * stemL, totaMut) / comb(k, totaMut)
+    p = (stemMut > 0) * p_1 + (stemMut == 0) * p_2
+    return p
+
+def _target_p_outcome_uncached(k, stemL, totaMut):
+    all_possible_outcome = set()
+    stemMut_start = 0 if totaMut - (k - 2 * stemL) < 0 else totaMut - (k - 2 * stemL)
+    for stemMut in range(stemMut_start, min(totaMut, 2*stemL)+1):
+        for compMut in range((stemMut+2)//2):
+            all_possible_outcome.add(target_p(k, stemL, totaMut, stemMut, compMut))
+    outcome = np.array(sorted(all_possible_outcome), dtype=float)
+    # pmf of each outcome is the increment between consecutive sorted outcomes
+    pmf = np.diff(outcome, prepend=0.0)
+    # cached arrays are shared by all callers, so make them read-only
+    outcome.setflags(write=False)
+    pmf.setflags(write=False)
+    return outcome, pmf
+
+_target_p_cached = lru_cache(maxsize=TARGET_P_CACHE_SIZE)(_target_p_uncached)
+_target_p_outcome_cached = lru_cache(maxsize=OUTCOME_CACHE_SIZE)(_target_p_outcome_uncached)
+
+def clear_caches():
+    """
+    Empty the target_p and target_p_outcome caches and reset their counters.
+    """
+    _target_p_cached.cache_clear()
+    _target_p_outcome_cached.cache_clear()
+
+def cache_info():
+    """
+    Return hits, misses, maxsize and currsize of both caches of the current process.
+    """
+    return {name: func.cache_info()._asdict() for name, func in 
+            [("target_p", _target_p_cached), ("target_p_outcome", _target_p_outcome_cached)]}
 
 ### 1. Target p computation ###
 def target_p1_closed_form(k, v, L, c):
@@ -38,13 +86,106 @@ def target_p(k, stemL, totaMut, stemMut, compMut):
     p_1: exact p-val found using lookup table `dt` or approximate p for longer stem
     p_2: no stem mutations 
     combine multiple p: (stemMut > 0) * p_1 + (stemMut == 0) * p_2
+
+    Results are memoized per process, see `cache_info`.
     """
+    return _target_p_cached(int(k), int(stemL), int(totaMut), int(stemMut), int(compMut))
 
-    p_1 = target_p1_closed_form(k, totaMut, stemL, compMut)
-    p_2 = comb(k - 2 * stemL, totaMut) / comb(k, totaMut)
-    p = (stemMut > 0) * p_1 + (stemMut == 0) * p_2
+### 1b. Vectorized target p in log space ###
+# `target_p_batch` evaluates the same closed form as `target_p` for arrays of parameters.
+# All binomials and powers are taken in log space from a log-factorial table, so no big 
+# integers are involved. The inner sums over (g, l, m) only depend on (L, h, c) and are 
+# tabulated once per stem length. Agreement with the exact `target_p` is within a relative
+# error of 1e-10 (absolute 1e-14 for values close to 0) for k <= 200.
+TARGET_P_BATCH_RTOL = 1e-10
+TARGET_P_BATCH_ATOL = 1e-14
+LOG2 = np.log(2)
+LOG3 = np.log(3)
+_log_fact = np.zeros(1)
+
+def _log_factorial(n_max):
+    """
+    Return a table of log(n!) for n = 0..n_max (grown on demand).
+    """
+    global _log_fact
+    if len(_log_fact) <= n_max:
+        _log_fact = np.array([lgamma(i + 1) for i in range(2 * n_max + 1)])
+    return _log_fact
+
+def _log_comb(n, r):
+    """
+    Vectorized log(comb(n, r)); -inf where comb(n, r) == 0.
+    """
+    n, r = np.broadcast_arrays(np.asarray(n, dtype=np.int64), np.asarray(r, dtype=np.int64))
+    lf = _log_factorial(max(int(n.max(initial=0)), 0))
+    valid = (r >= 0) & (r <= n) & (n >= 0)
+    n_, r_ = np.where(valid, n, 0), np.where(valid, r, 0)
+    return np.where(valid, lf[n_] - lf[r_] - lf[n_ - r_], -np.inf)
+
+@lru_cache(maxsize=None)
+def _compensatory_table(L):
+    """
+    Tabulate U[h, c] = sum_{g=c}^{h//2} p_g(h) for a stem of length L, where p_g(h) is the 
+    inner sum over l and m of `target_p1_closed_form` (already divided by comb(2L,h) * 3^h).
+    """
+    U = np.zeros((2 * L + 1, L + 1))
+    g = np.arange(L + 1)[:, None, None]
+    l_raw = np.arange(L + 1)[None, :, None]
+    m = np.arange(L + 1)[None, None, :]
+    for h in range(2 * L + 1):
+        l = np.maximum(l_raw, h - l_raw) # same reassignment as in the closed form
+        valid = ((l_raw >= g) & (l_raw <= min(h, L)) & (l <= L) & (2 * g <= h) & 
+                 (m <= l - g) & (m <= h - l - g))
+        r = h - l - g - m
+        log_term = (_log_comb(L, l) + l * LOG3 + _log_comb(l, g) + _log_comb(l - g, m) + m * LOG2 
+                    + _log_comb(L - l, r) + r * LOG3 - _log_comb(2 * L, h) - h * LOG3)
+        p_g = np.where(valid, np.exp(np.where(valid, log_term, -np.inf)), 0).sum(axis=(1, 2))
+        U[h] = np.cumsum(p_g[::-1])[::-1] # sum over g >= c
+    U.setflags(write=False)
+    return U
+
+def target_p1_batch(k, v, L, c):
+    """
+    Vectorized, log-space version of `target_p1_closed_form` over arrays of k, v, L and c.
+    """
+    k, v, L, c = [np.asarray(x, dtype=np.int64) for x in np.broadcast_arrays(k, v, L, c)]
+    p = np.zeros(k.shape)
+    for stemL in np.unique(L):
+        sel = L == stemL
+        U = _compensatory_table(int(stemL))
+        h = np.arange(2 * stemL + 1)[None, :]
+        ks, vs, cs = k[sel][:, None], v[sel][:, None], c[sel][:, None]
+        log_p_h = _log_comb(2 * stemL, h) + _log_comb(ks - 2 * stemL, vs - h) - _log_comb(ks, vs)
+        valid = (h >= 2 * cs) & (h <= vs) & (cs <= stemL)
+        p_c_h = U[h, np.minimum(cs, stemL)]
+        p[sel] = np.where(valid, np.exp(np.where(valid, log_p_h, -np.inf)) * p_c_h, 0).sum(axis=1)
     return p
 
+def target_p_batch(k, stemL, totaMut, stemMut, compMut):
+    """
+    Return target p-values for arrays of (k, stemL, totaMut, stemMut, compMut) at once.
+    Same as calling `target_p` on every element, up to TARGET_P_BATCH_RTOL.
+    Duplicated parameter tuples are evaluated only once.
+    """
+    params = np.stack([np.asarray(x, dtype=np.int64).ravel() for x in 
+                       np.broadcast_arrays(k, stemL, totaMut, stemMut, compMut)], axis=1)
+    if len(params) == 0:
+        return np.zeros(0)
+    # the small non-negative parameters of a row usually fit in one int64 key (mixed radix), 
+    # which is much faster to deduplicate than the rows
+    radix = params.max(axis=0) + 1
+    if params.min() >= 0 and np.log2(radix.astype(float)).sum() < 62:
+        weights = np.cumprod(np.r_[radix[1:], 1][::-1])[::-1]
+        _, first, inverse = np.unique(params @ weights, return_index=True, return_inverse=True)
+        uniq = params[first]
+    else:
+        uniq, inverse = np.unique(params, axis=0, return_inverse=True)
+    k, stemL, totaMut, stemMut, compMut = uniq.T
+    p_1 = target_p1_batch(k, totaMut, stemL, compMut)
+    p_2 = np.exp(_log_comb(k - 2 * stemL, totaMut) - _log_comb(k, totaMut))
+    p = np.where(stemMut > 0, p_1, p_2)
+    return p[inverse.ravel()]
+
 ### 2. Anchor p computation ###
 def target_p_outcome(k, stemL, totaMut):
     """
@@ -54,38 +195,45 @@ def target_p_outcome(k, stemL, totaMut):
     Output: 
     all_possible_outcome: list of all possible outcomes of target_p
     """
-    all_possible_outcome = set()
-    stemMut_start = 0 if totaMut - (k - 2 * stemL) < 0 else totaMut - (k - 2 * stemL)
-    for stemMut in range(stemMut_start, min(totaMut, 2*stemL)+1):
-        for compMut in range((stemMut+2)//2):
-            all_possible_outcome.add(target_p(k, stemL, totaMut, stemMut, compMut))
-    all_possible_outcome = list(all_possible_outcome)
-    all_possible_outcome.sort()
-    return all_possible_outcome
+    return target_p_outcome_pmf(k, stemL, totaMut)[0].tolist()
 
-def prep_for_conv(num_target, wgt_all, k, stemL_list, totaMut_list):
+def target_p_outcome_pmf(k, stemL, totaMut):
+    """
+    Cached version of `target_p_outcome` that also returns the PMF of each outcome.
+
+    Output:
+    outcome: sorted (read-only) array of all possible outcomes of target_p
+    pmf: (read-only) array of the probability of each outcome
+    """
+    return _target_p_outcome_cached(int(k), int(stemL), int(totaMut))
+
+def prep_for_conv(num_target, wgt_all, k, stemL_list, totaMut_list, max_targets=4):
     """
     Step 2: prep for convolution: calculate PMF of each outcome of target_p
     
     Output: 
     wgted_target_outcomes: nested lists of (weighted) target_p for all targets of an anchor
     target_pmf: 
+
+    Note:
+    The exhaustive `pmf_anchor_score` is exponential in the number of targets, so by default
+    only the top `max_targets` targets are kept and their weights renormalised. Use 
+    max_targets=None to keep all targets (with `anchor_pmf_conv`).
     """
-    if num_target > 4: # cap number of targets for convolution to 4
-        wgt_all = [i / sum(wgt_all[0:4]) for i in wgt_all[0:4]]
-        stemL_list = stemL_list[0:4]
-        totaMut_list = totaMut_list[0:4]
-        num_target = 4
+    if max_targets is not None and num_target > max_targets: # cap number of targets for convolution
+        wgt_all = [i / sum(wgt_all[0:max_targets]) for i in wgt_all[0:max_targets]]
+        stemL_list = stemL_list[0:max_targets]
+        totaMut_list = totaMut_list[0:max_targets]
+        num_target = max_targets
         
     wgted_target_outcomes = []
     target_pmf = [] 
     
     for i in range(num_target):
-        targetp = target_p_outcome(k, stemL_list[i], totaMut_list[i])
-        pmf = [targetp[0]]+[targetp[i+1] - targetp[i] for i in range(len(targetp)-1)]
+        targetp, pmf = target_p_outcome_pmf(k, stemL_list[i], totaMut_list[i])
 
         target_pmf.append(pmf)
-        wgted_target_outcomes.append([wgt_all[i] * j for j in targetp])
+        wgted_target_outcomes.append(wgt_all[i] * targetp)
     return wgted_target_outcomes, target_pmf
 
 def pmf_anchor_score(wgted_target_outcomes, target_pmf):
@@ -101,6 +249,53 @@ def pmf_anchor_score(wgted_target_outcomes, target_pmf):
     anchor_pmf = [np.prod(x) for x in itertools.product(*target_pmf)] 
     return all_anchor_outcomes, anchor_pmf
 
+# Support size above which `anchor_pmf_conv` switches to a grid of width `resolution`
+ANCHOR_CONV_MAX_SUPPORT = 2**16
+ANCHOR_CONV_RESOLUTION = 1e-6
+
+def anchor_pmf_conv(wgted_target_outcomes, target_pmf, resolution=ANCHOR_CONV_RESOLUTION, 
+                    max_support=ANCHOR_CONV_MAX_SUPPORT):
+    """
+    Step 3 (convolution): same distribution as `pmf_anchor_score`, but targets are folded 
+    in one at a time, merging identical outcomes after every fold. Time and memory grow 
+    with the size of the merged support instead of the product of all outcome lists.
+
+    The support is exact as long as it has at most `max_support` points. Past that, outcomes 
+    are rounded to a grid of width `resolution` (set resolution=None to never bin) and the 
+    remaining targets are convolved on the grid. 
+
+    Output:
+    all_anchor_outcomes: sorted array of distinct outcomes of anchor_score
+    anchor_pmf: probability of each outcome
+    err_bound: upper bound on how far any outcome was moved by the binning (0 if exact)
+    """
+    outcome, pmf = np.zeros(1), np.ones(1)
+    grid = None # dense grid of probabilities once binning kicks in
+    err_bound = 0.0
+    for target_outcome, target_prob in zip(wgted_target_outcomes, target_pmf):
+        target_outcome = np.asarray(target_outcome, dtype=float)
+        target_prob = np.asarray(target_prob, dtype=float)
+        if grid is None:
+            outcome = np.add.outer(outcome, target_outcome).ravel()
+            pmf = np.multiply.outer(pmf, target_prob).ravel()
+            outcome, inverse = np.unique(outcome, return_inverse=True)
+            pmf = np.bincount(inverse.ravel(), weights=pmf)
+            if resolution is not None and len(outcome) > max_support:
+                idx = np.round(outcome / resolution).astype(np.int64)
+                err_bound += np.abs(idx * resolution - outcome).max()
+                grid = np.bincount(idx, weights=pmf)
+        else:
+            shifts = np.round(target_outcome / resolution).astype(np.int64)
+            err_bound += np.abs(shifts * resolution - target_outcome).max()
+            new_grid = np.zeros(len(grid) + shifts.max())
+            for shift, prob in zip(shifts, target_prob):
+                new_grid[shift:shift + len(grid)] += prob * grid
+            grid = new_grid
+    if grid is not None:
+        idx = np.flatnonzero(grid)
+        outcome, pmf = idx * resolution, grid[idx]
+    return outcome, pmf, err_bound
+
 def anchor_p(all_anchor_outcomes, anchor_pmf, anchor_p):
     """
     Step 4: calculate the CDF of anchor_p and find p-value of anchor_p
@@ -113,59 +308,186 @@ def anchor_p(all_anchor_outcomes, anchor_pmf, anchor_p):
         p_val = df.iloc[0]['cdf']
     return p_val
     
-def anchor_p_target_subdf(sub_df):
+def anchor_score_pmf(num_target, wgt_all, k, stemL_list, totaMut_list, method="conv"):
+    """
+    Return the outcomes and PMF of anchor_score for one anchor, and the error bound of the 
+    outcomes (see `anchor_pmf_conv`).
+    method="conv" folds all targets with `anchor_pmf_conv`; method="exhaustive" is the 
+    original enumeration over the top 4 targets, kept as a fallback for validation (exact).
+    """
+    if method == "exhaustive":
+        return (*pmf_anchor_score(*prep_for_conv(num_target, wgt_all, k, stemL_list, totaMut_list)), 0.0)
+    if method == "conv":
+        return anchor_pmf_conv(*prep_for_conv(num_target, wgt_all, k, stemL_list, totaMut_list, 
+                                              max_targets=None))
+    raise ValueError(f"Unknown anchor_p method: {method}")
+
+def anchor_p_target_subdf(sub_df, method="conv"):
     """
     Step 5 (1): wrap all functions for one anchor and apply to sub-dataframe for stucture-target
     """
-    p_val = sub_df['anchor_score'].iloc[0]
+    p_val, err_bound = sub_df['anchor_score'].iloc[0], 0.0
         
     if len(sub_df) > 1:
-        all_anchor_outcomes, anchor_pmf = pmf_anchor_score(*prep_for_conv(len(sub_df),\
+        all_anchor_outcomes, anchor_pmf, err_bound = anchor_score_pmf(len(sub_df),\
                                                       list(sub_df['tar_wgt_filtered']), \
                                                       len(sub_df['base_target'].iloc[0]), \
                                                       list(sub_df['stemL']), \
-                                                      list(sub_df['totaMut'])))
+                                                      list(sub_df['totaMut']), method)
             
         p_val = anchor_p(all_anchor_outcomes, anchor_pmf, p_val)
         
-    return p_val
+    return p_val, err_bound
 
-def anchor_p_compactor_subdf(sub_df):
+def anchor_p_compactor_subdf(sub_df, method="conv"):
     """
     Step 5 (2): wrap all functions for one anchor-split and apply to each anchor for stucture-compactor
     """
     # for compactors, we compute anchor-score for each split
-    p_val = sub_df['anchor_score_per_split'].iloc[0]
+    p_val, err_bound = sub_df['anchor_score_per_split'].iloc[0], 0.0
     
     if len(sub_df) > 1:
         # structure evaluation length for compactor is 80 (HARDCODED)
-        all_anchor_outcomes, anchor_pmf = pmf_anchor_score(*prep_for_conv(len(sub_df),\
+        all_anchor_outcomes, anchor_pmf, err_bound = anchor_score_pmf(len(sub_df),\
                                                       list(sub_df['compactor_weight']), \
                                                       80, \
                                                       list(sub_df['stemL']), \
-                                                      list(sub_df['totaMut'])))
+                                                      list(sub_df['totaMut']), method)
         p_val = anchor_p(all_anchor_outcomes, anchor_pmf, p_val)
         
-    return p_val
+    return p_val, err_bound
 
-def wrap_anchor_p_target(df):
+def _group_anchor_p(group, method="conv"):
+    """
+    anchor_p and its error bound for one group (wgt, k, stemL, totaMut, anchor_score) of 
+    `anchor_p_grouped`: same lookup as `anchor_p`, done where the PMF is built so that only 
+    the p-value is returned. anchor_score may hold several scores (e.g. simulated draws), which 
+    are looked up in the same CDF.
+    """
+    wgt, k, stemL, totaMut, score = group
+    if len(wgt) == 1:
+        return score, 0.0
+    outcome, pmf, err_bound = anchor_score_pmf(len(wgt), wgt, k, stemL, totaMut, method)
+    outcome, pmf = np.asarray(outcome, dtype=float), np.asarray(pmf, dtype=float)
+    order = np.argsort(outcome, kind='stable')
+    cdf = np.cumsum(pmf[order])
+    # last outcome at or below the threshold, or the first one if there is none
+    below = np.searchsorted(outcome[order], score + 1e-6, side='right')
+    return cdf[np.maximum(below - 1, 0)], float(err_bound)
+
+def _cache_counts():
+    """
+    (hits, misses) of the target_p and target_p_outcome caches of the current process.
+    """
+    return np.array([[func.cache_info().hits, func.cache_info().misses] 
+                     for func in (_target_p_cached, _target_p_outcome_cached)])
+
+def _timed_group_anchor_p(group, method="conv"):
+    """
+    `_group_anchor_p`, its wall time (for the anchor_p cost percentiles of --profile) and the 
+    cache hits and misses of its lookups. The lookups run in the process of the worker, so they 
+    are returned with the result instead of read from the caches of the main process (threads 
+    that use the caches at the same time may count each other's lookups).
+    """
+    counts = _cache_counts()
+    start = time.perf_counter()
+    p_val, err_bound = _group_anchor_p(group, method)
+    seconds = time.perf_counter() - start
+    return p_val, err_bound, seconds, _cache_counts() - counts
+
+def _split_groups(group, *columns):
+    """
+    Cut per-row arrays into one tuple of lists per group code (0..num_group-1), rows of a group 
+    keep their order. Return the groups and the number of rows of each group.
+    """
+    group = np.asarray(group)
+    order = np.argsort(group, kind='stable')
+    group_size = np.bincount(group)
+    starts = np.concatenate([[0], np.cumsum(group_size)])
+    columns = [np.asarray(x) for x in columns]
+    groups = [tuple(x[order[starts[g]:starts[g+1]]].tolist() for x in columns) 
+              for g in range(len(group_size))]
+    return groups, group_size
+
+def anchor_p_grouped(group, wgt, k, stemL, totaMut, anchor_score, method="conv", executor=None):
+    """
+    Step 4 (batched): anchor_p of every group (anchor) at once. Each worker builds the PMF of 
+    its groups and looks up the observed score itself, so only one p-value per group is sent 
+    back and memory does not grow with the support of the distributions.
+
+    Input:
+    group: group code (0..num_group-1) of each row, rows of a group keep their order
+    wgt, k, stemL, totaMut: per-row arrays, k is read from the first row of each group
+    anchor_score: observed anchor_score of each group, or a (num_group, n_draws) array of scores
+    that are all looked up in the distribution of their group (e.g. simulated draws)
+    executor: Executor the groups are mapped on (default: the shared executor)
+
+    Output:
+    p_val: p-value of each group (anchor_score for groups with a single target), with the shape 
+    of anchor_score
+    err_bound: error bound of the outcomes of each group's distribution (0 if exact)
+    """
+    groups, group_size = _split_groups(group, wgt, k, stemL, totaMut)
+    groups = [(wgt_g, k_g[0], stemL_g, totaMut_g, np.asarray(score, dtype=float)) 
+              for (wgt_g, k_g, stemL_g, totaMut_g), score in zip(groups, anchor_score)]
+    executor = executor or get_executor()
+    profiler = get_profiler()
+    if profiler.enabled:
+        results = executor.map(_timed_group_anchor_p, groups, method)
+        profiler.add_costs("anchor_p", [result[2] for result in results], group_size)
+        counts = sum((result[3] for result in results), np.zeros((2, 2), dtype=np.int64))
+        for name, (hits, misses) in zip(("target_p", "target_p_outcome"), counts):
+            profiler.count(name, hits=hits, misses=misses)
+        results = [result[:2] for result in results]
+    else:
+        results = executor.map(_group_anchor_p, groups, method)
+    p_val = np.array([result[0] for result in results], dtype=float).reshape(np.shape(anchor_score))
+    return p_val, np.array([result[1] for result in results], dtype=float)
+
+def wrap_anchor_p_batch(df, group_col, wgt_col, score_col, k, method="conv"):
+    """
+    Step 6 (batched): anchor_p of every group of `group_col` with `anchor_p_grouped`.
+    The result is written back to a copy of `df` through the group codes instead of a merge.
+    anchor_p_err is the error bound of the binned conv distribution (0 if exact).
+    """
+    if len(df) == 0:
+        return df.assign(anchor_p=np.zeros(0), anchor_p_err=np.zeros(0))
+    codes, _ = pd.factorize(df[group_col])
+    k = np.broadcast_to(np.asarray(k), (len(df),))
+    # observed anchor_score of each group (first row of the group)
+    first_row = np.unique(codes, return_index=True)[1]
+    anchor_score = df[score_col].to_numpy()[first_row]
+    p_val, err_bound = anchor_p_grouped(codes, df[wgt_col], k, df['stemL'], df['totaMut'], 
+                                        anchor_score, method)
+    return df.assign(anchor_p=p_val[codes], anchor_p_err=err_bound[codes])
+
+def wrap_anchor_p_target(df, method="conv", batched=True):
     """
     Step 6 (1): wrap all functions for one anchor and apply to the whole dataframe for stucture-target
     """
-    grouped = df.groupby('anchor') # create a groupby object based on 'anchor'
-    p_val_results = grouped.parallel_apply(anchor_p_target_subdf) # Apply function to each group
-    # The result is a Series where the index is the group keys ('anchor' values)
+    if batched:
+        return wrap_anchor_p_batch(df, 'anchor', 'tar_wgt_filtered', 'anchor_score', 
+                                   df['base_target'].str.len(), method)
+    keys, sub_dfs = zip(*df.groupby('anchor')) # split the dataframe by 'anchor'
+    p_val_results = pd.DataFrame(get_executor().map(anchor_p_target_subdf, sub_dfs, method), index=keys, 
+                                 columns=['anchor_p', 'anchor_p_err'])
+    # The result is a DataFrame where the index is the group keys ('anchor' values)
     # We can now assign this back to your DataFrame, but you'll need to align the indices
-    df = df.merge(p_val_results.rename('anchor_p'), left_on='anchor', right_index=True)
+    df = df.merge(p_val_results, left_on='anchor', right_index=True)
     return df
 
-def wrap_anchor_p_compactor(df):
+def wrap_anchor_p_compactor(df, method="conv", batched=True):
     """
     Step 6 (1): wrap all functions for one anchor and apply to the whole dataframe for stucture-compactor
     """
-    grouped = df.groupby('anchor_split') # create a groupby object based on 'anchor_split'
-    p_val_results = grouped.parallel_apply(anchor_p_compactor_subdf) # Apply function to each group
-    # The result is a Series where the index is the group keys ('anchor_split' values)
+    if batched:
+        # structure evaluation length for compactor is 80 (HARDCODED)
+        return wrap_anchor_p_batch(df, 'anchor_split', 'compactor_weight', 'anchor_score_per_split', 
+                                   80, method)
+    keys, sub_dfs = zip(*df.groupby('anchor_split')) # split the dataframe by 'anchor_split'
+    p_val_results = pd.DataFrame(get_executor().map(anchor_p_compactor_subdf, sub_dfs, method), index=keys, 
+                                 columns=['anchor_p', 'anchor_p_err'])
+    # The result is a DataFrame where the index is the group keys ('anchor_split' values)
     # We can now assign this back to your DataFrame, but you'll need to align the indices
-    df = df.merge(p_val_results.rename('anchor_p'), left_on='anchor_split', right_index=True)
-    return df
\ No newline at end of file
+    df = df.merge(p_val_results, left_on='anchor_split', right_index=True)
+    return df
@@ -0,0 +1,209 @@
+"""
+Asynchronous runner for external jobs such as the element annotation pipeline. `submit` starts a
+job and returns at once with a `Job` handle; the caller keeps working and calls `wait` (or polls
+`done`) when it needs the result. Jobs run as local subprocesses ('local', for a plain Linux box)
+or are submitted to SLURM with sbatch ('slurm'). Job states are polled with exponential backoff,
+jobs running longer than `timeout` seconds are cancelled, and a job only succeeds if it exits with
+status 0: the exit code of the process, or the state and exit code reported by sacct.
+"""
+import os
+import time
+import shlex
+import subprocess
+
+JOB_BACKENDS = ["local", "slurm"]
+POLL_INTERVAL = 10            # seconds before the first poll
+MAX_POLL_INTERVAL = 300       # backoff doubles the interval up to this many seconds
+LOST_AFTER_POLLS = 5          # a SLURM job unknown to sacct and scontrol for this many polls is lost
+# SLURM states of finished jobs (sacct); any other state is pending or running
+SLURM_FINAL_STATES = ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL",
+                      "PREEMPTED", "BOOT_FAIL", "DEADLINE"]
+
+class JobError(RuntimeError):
+    """
+    A job failed to start, exited with a non-zero status, timed out, or was lost.
+    """
+
+def _run(command):
+    """
+    Run a SLURM command; a missing command counts as a failed one (return code 127).
+    """
+    try:
+        return subprocess.run(command, capture_output=True, text=True)
+    except OSError as err:
+        return subprocess.CompletedProcess(command, 127, "", str(err))
+
+class Job:
+    """
+    Handle of a submitted job. The state is refreshed by `poll` (at most once per backoff
+    interval from `done`, or in the loop of `wait`).
+    """
+    def __init__(self, runner, name, command, job_id, process=None, log_file=None):
+        self.runner = runner
+        self.name = name
+        self.command = command
+        self.job_id = job_id
+        self.process = process
+        self.log_file = log_file
+        self.submitted = time.monotonic()
+        self.state = "RUNNING"
+        self.exit_code = None
+        self._interval = runner.poll_interval
+        self._next_poll = self.submitted
+        self._unknown_polls = 0
+
+    def poll(self):
+        """
+        Refresh and return the exit code (None while the job runs). Cancel the job on timeout.
+        Raise JobError if the job has been unknown to SLURM for `lost_after_polls` polls in a row.
+        """
+        if self.exit_code is None:
+            self.state, self.exit_code = self.runner.status(self)
+            self._unknown_polls = self._unknown_polls + 1 if self.state == "UNKNOWN" else 0
+            if self._unknown_polls >= self.runner.lost_after_polls:
+                raise JobError(f"Job {self.name} ({self.job_id}) is unknown to sacct and scontrol after "
+                               f"{self._unknown_polls} polls; it was lost or purged.")
+            if self.exit_code is None and self.runner.timeout is not None \
+                    and time.monotonic() - self.submitted > self.runner.timeout:
+                self.runner.cancel(self)
+                self.state, self.exit_code = "TIMEOUT", -1
+        return self.exit_code
+
+    def done(self):
+        """
+        Non-blocking: True once the job has finished. Polls only when the backoff interval is over.
+        """
+        if self.exit_code is None and time.monotonic() >= self._next_poll:
+            self.poll()
+            self._next_poll = time.monotonic() + self._interval
+            self._interval = min(self._interval * 2, self.runner.max_poll_interval)
+        return self.exit_code is not None
+
+    def wait(self):
+        """
+        Block until the job finishes. Raise JobError unless it exited with status 0.
+        """
+        while not self.done():
+            time.sleep(max(0.0, self._next_poll - time.monotonic()))
+        if self.state != "COMPLETED" or self.exit_code != 0:
+            log = f" See {self.log_file}." if self.log_file else ""
+            raise JobError(f"Job {self.name} ({self.job_id}) ended with state {self.state} and "
+                           f"exit code {self.exit_code}.{log}")
+        return self
+
+class JobRunner:
+    """
+    Submit commands as jobs.
+
+    backend: 'local' (subprocess of this process) or 'slurm' (sbatch, states from sacct)
+    poll_interval, max_poll_interval: backoff of the state polls, in seconds
+    timeout: cancel jobs running longer than this many seconds (None: no limit)
+    sbatch_args: extra sbatch options, e.g. "--partition=normal --time=12:00:00"
+    lost_after_polls: polls in a row a SLURM job may be unknown to sacct and scontrol (e.g.
+    right after submission) before it is considered lost
+    """
+    def __init__(self, backend="slurm", poll_interval=POLL_INTERVAL, max_poll_interval=MAX_POLL_INTERVAL,
+                 timeout=None, sbatch_args="", lost_after_polls=LOST_AFTER_POLLS):
+        if backend not in JOB_BACKENDS:
+            raise ValueError(f"Unknown job backend '{backend}', choose from {JOB_BACKENDS}.")
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(max_poll_interval, poll_interval)
+        self.timeout = timeout
+        self.sbatch_args = sbatch_args
+        self.lost_after_polls = lost_after_polls
+
+    def submit(self, name, script, args=(), log_file=None):
+        """
+        Start the shell script `script` with arguments `args` and return its Job without waiting
+        for it. Output goes to `log_file` (default: the SLURM default for sbatch, discarded locally).
+        """
+        command = [script] + [str(arg) for arg in args]
+        if self.backend == "local":
+            command = ["bash"] + command
+            log = open(log_file, 'w') if log_file else subprocess.DEVNULL
+            try:
+                process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            except OSError as err:
+                raise JobError(f"Job {name} could not be started: {err}") from err
+            finally:
+                if log_file:
+                    log.close()
+            return Job(self, name, command, process.pid, process, log_file)
+
+        sbatch = ["sbatch", "--parsable", f"--job-name={name}"] + shlex.split(self.sbatch_args)
+        if log_file:
+            sbatch.append(f"--output={log_file}")
+        result = _run(sbatch + command)
+        if result.returncode != 0:
+            raise JobError(f"sbatch failed for job {name}: {result.stderr.strip()}")
+        # --parsable prints "<job id>[;<cluster>]"
+        return Job(self, name, command, result.stdout.strip().split(';')[0], log_file=log_file)
+
+    def status(self, job):
+        """
+        (state, exit code) of a job; the exit code is None while the job is pending or running.
+        A SLURM job that neither sacct nor scontrol knows is in state UNKNOWN.
+        """
+        if self.backend == "local":
+            code = job.process.poll()
+            return ("RUNNING", None) if code is None else ("COMPLETED" if code == 0 else "FAILED", code)
+
+        result = _run(["sacct", "-j", str(job.job_id), "-X", "-n", "-P", "-o", "State,ExitCode"])
+        lines = result.stdout.strip().splitlines()
+        if result.returncode == 0 and lines:
+            state, exit_code = lines[0].split('|')
+        else:
+            # not in the accounting database (yet, or accounting is off): ask the controller, which
+            # knows queued, running and recently finished jobs
+            control = _run(["scontrol", "show", "job", "-o", str(job.job_id)])
+            fields = dict(field.split('=', 1) for field in control.stdout.split() if '=' in field)
+            if control.returncode != 0 or "JobState" not in fields:
+                if result.returncode == 0:
+                    return "UNKNOWN", None
+                raise JobError(f"Cannot get the state of job {job.name} ({job.job_id}): "
+                               f"{(result.stderr or control.stderr).strip()}")
+            state, exit_code = fields["JobState"], fields.get("ExitCode", "0:0")
+        state = state.split()[0]      # e.g. "CANCELLED by 123"
+        if state not in SLURM_FINAL_STATES:
+            return state, None
+        # ExitCode is "<exit status>:<signal>"
+        status, signal = (int(x) for x in exit_code.split(':'))
+        return state, status if signal == 0 else 128 + signal
+
+    def cancel(self, job):
+        if self.backend == "local":
+            if job.process.poll() is None:
+                os.killpg(job.process.pid, 15)
+                job.process.wait()
+        else:
+            _run(["scancel", str(job.job_id)])
+
+def wait_all(jobs):
+    """
+    Wait for several jobs at once, polling each with its own backoff. Raise the JobError of the
+    first failed job after all jobs finished.
+    """
+    pending = list(jobs)
+    while pending:
+        pending = [job for job in pending if not job.done()]
+        if pending:
+            time.sleep(max(0.0, min(job._next_poll for job in pending) - time.monotonic()))
+    for job in jobs:
+        job.wait()
+    return jobs
+
+# runner shared by the pipeline steps; SLURM with the default polling until configured
+_runner = JobRunner()
+
+def configure_job_runner(backend="slurm", poll_interval=POLL_INTERVAL, max_poll_interval=MAX_POLL_INTERVAL,
+                         timeout=None, sbatch_args=""):
+    """
+    Replace the shared job runner and return it.
+    """
+    global _runner
+    _runner = JobRunner(backend, poll_interval, max_poll_interval, timeout, sbatch_args)
+    return _runner
+
+def get_job_runner():
+    return _runner
@@ -1,10 +1,49 @@
-import pandas as pd
-import sys
+"""
+Join the hits of an Rfam search on the query sequences of `prep_query_for_rfam` back to the
+significant rows of the result table. The result table is read in chunks and each row is matched
+to the Rfam hits by the content-hash ID of its query sequence ('query name' of the Rfam table),
+so rows sharing a sequence get the same hits. The merged table is written chunk by chunk.
+Run with: ss-rfam-merge {extendor,compactor} <results_file> <rfam_file> [--output merged.tsv]
+"""
+import os
 import csv
+import pandas as pd
+
+from splash_structure_py.src.prep_query_for_rfam import iter_queries, BH_THRESHOLD, CHUNK_SIZE
+from splash_structure_py.src.parse_args import argument_parser_rfam_merge
+
+def read_rfam_hits(rfam_file):
+    """
+    Read the Rfam hits table, one row per query (the first hit of a query is kept).
+    """
+    df_rfam = pd.read_csv(rfam_file, sep='\t', quoting=csv.QUOTE_NONE)
+    return df_rfam.drop_duplicates('query name')
+
+def merge_rfam(results_file, rfam_file, output_file, seq_type="extendor", bh_threshold=BH_THRESHOLD,
+               chunksize=CHUNK_SIZE):
+    """
+    Left join of the significant rows of the result table and the Rfam hits on the query ID,
+    written to `output_file` (TSV, gzipped if it ends with .gz). Returns the number of rows.
+    """
+    df_rfam = read_rfam_hits(rfam_file)
+    num_rows, header = 0, True
+    for chunk, _, ids in iter_queries(results_file, seq_type, bh_threshold, chunksize):
+        if 'query name' not in chunk.columns:
+            chunk = chunk.assign(**{'query name': ids})
+        # hash join on the query ID; the rows keep their order
+        merged = chunk.merge(df_rfam, how='left', on='query name', sort=False)
+        merged.to_csv(output_file, sep='\t', index=False, mode='w' if header else 'a', header=header)
+        num_rows, header = num_rows + len(merged), False
+    return num_rows
+
+def run_merge_rfam():
+    """
+    Entry point of ss-rfam-merge.
+    """
+    args = argument_parser_rfam_merge()
+    output_file = args["output"] or f"{os.path.splitext(args['results_file'])[0]}.RFAM.tsv"
+    merge_rfam(args["results_file"], args["rfam_file"], output_file, args["seq_type"], args["bh_threshold"],
+               args["chunk_size"])
 
-df_structure = pd.read_csv(sys.argv[1], sep='\t').loc[lambda df: df['anchor_p_BH'] < 0.1]
-df_rfam = pd.read_csv(sys.argv[2],sep ='\t',quoting=csv.QUOTE_NONE)
-if 'query name' not in df_structure.columns:
-    df_structure['query name'] = pd.Series([f'Sequence{i+1}' for i in range(len(df_structure))])
-df_structure=df_structure.merge(df_rfam.drop_duplicates('query name'), how='left', on='query name')
-df_structure.to_csv(f'{sys.argv[1][0:-4]}.RFAM.tsv', index=False, sep='\t')
+if __name__ == "__main__":
+    run_merge_rfam()
@@ -1,37 +1,244 @@
 import argparse
 
+from splash_structure_py.src.checkpoints import TARGET_STAGES, COMPACTOR_STAGES
+
+DESCRIPTION = ("SPLASH-structure: a statistical approach to identify RNA secondary structures from raw "
+               "sequencing data, bypassing multiple sequence alignment.")
+
+def _cache_options(parser):
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Recompute every anchor and do not read or write the per-anchor result cache.")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Folder of the per-anchor result cache (result_cache.sqlite), e.g. shared by "
+                             "reruns with different output prefixes. Default: the output folder.")
+    parser.add_argument("--cache_max_size_mb", type=float, default=2048,
+                        help="Evict the least recently used cache entries above this size. Default: 2048.")
+    parser.add_argument("--cache_max_age_days", type=float, default=30,
+                        help="Evict cache entries not used for this many days. Default: 30.")
+
+def _stem_index_options(parser, default_dir="the output folder"):
+    parser.add_argument("--stem_index_dir", default=None,
+                        help="Folder of the persistent stem index (stem_index.sqlite), which stores the stems "
+                             "of every base sequence searched, e.g. shared by several runs and both modes. "
+                             f"Default: {default_dir}.")
+    parser.add_argument("--no_stem_index", action="store_true",
+                        help="Search the stems of every base sequence again and do not read or write the "
+                             "persistent stem index.")
+
+def _annotation_options(parser):
+    parser.add_argument("--annotation_backend", choices=["slurm", "local"], default="slurm",
+                        help="How the element annotation job of -a runs: submitted with sbatch, or as a "
+                             "local subprocess. Default: slurm.")
+    parser.add_argument("--annotation_script", default=None,
+                        help="Element annotation script, called with <sequence list> <output folder> <name>. "
+                             "Default: $SS_ELEM_ANNS_SCRIPT (one of them is required with -a).")
+    parser.add_argument("--annotation_timeout", type=float, default=None,
+                        help="Cancel the element annotation job after this many seconds. Default: no limit.")
+    parser.add_argument("--annotation_poll_interval", type=float, default=10,
+                        help="Seconds before the first poll of the annotation job; the interval doubles "
+                             "after every poll. Default: 10.")
+    parser.add_argument("--annotation_max_poll_interval", type=float, default=300,
+                        help="Upper bound of the poll interval, in seconds. Default: 300.")
+    parser.add_argument("--sbatch_args", default="",
+                        help="Extra sbatch options of the annotation job, e.g. \"--partition=normal --time=12:00:00\".")
+
+def _statistics_options(parser):
+    parser.add_argument("--anchor_p_method", choices=["conv", "exhaustive"], default="conv",
+                        help="How the null distribution of the anchor score is computed: 'conv' convolves "
+                             "all targets, 'exhaustive' enumerates the top 4 targets (original method, "
+                             "for validation). Default: conv.")
+    parser.add_argument("--notation", choices=["all", "significant", "none"], default="all",
+                        help="Which rows get structure notations: all rows, only rows of anchors with "
+                             "anchor_p_BH below --notation_threshold, or none (notation columns are "
+                             "dropped). Default: all.")
+    parser.add_argument("--notation_threshold", type=float, default=0.05,
+                        help="anchor_p_BH threshold used by --notation significant. Default: 0.05.")
+    parser.add_argument("--output_format", choices=["tsv", "parquet", "arrow"], default="tsv",
+                        help="Format of the result table: tab-separated text, or Parquet / Arrow IPC with "
+                             "dictionary-encoded sequences and zstd compression (needs pyarrow). Default: tsv.")
+
+def _checkpoint_options(parser, stages=None):
+    """
+    --checkpoint and --resume, and --start_at / --stop_after with the `stages` of a pipeline.
+    """
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="Write a checkpoint after every stage (<output_prefix>_results/checkpoints) for "
+                             "later --resume or --start_at runs. On with --resume, --start_at and --stop_after.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the stages that completed in a previous run with the same input file and "
+                             "options (checkpoints in <output_prefix>_results/checkpoints).")
+    if stages is not None:
+        parser.add_argument("--start_at", choices=stages, default=None,
+                            help="Start at this stage, from the checkpoint of the stage before it.")
+        parser.add_argument("--stop_after", choices=stages, default=None,
+                            help="Stop after this stage, e.g. --stop_after stats to compute the statistics only.")
+
+def _executor_options(parser):
+    parser.add_argument("--executor", choices=["auto", "serial", "thread", "process"], default="auto",
+                        help="How per-anchor work is run: serially, on a thread pool, or on a process pool "
+                             "that is kept for the whole run. 'auto' uses the process pool and falls back "
+                             "to serial for small inputs. Default: auto.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of pool workers. Default: number of available CPUs.")
+    parser.add_argument("--batch_size", type=int, default=None,
+                        help="Number of anchors (or sequences) per batch sent to a worker. "
+                             "Default: about 4 batches per worker.")
+
+def _profile_options(parser, cprofile=True):
+    parser.add_argument("--profile", action="store_true",
+                        help="Record wall/CPU time, rows in and out and peak RSS of every step, cache hit "
+                             "rates and anchor_p cost percentiles in <output_prefix>_results/run_report.json.")
+    if cprofile:
+        parser.add_argument("--cprofile", action="store_true",
+                            help="With --profile, also run cProfile on every step and dump the stats of the "
+                                 "slowest step to run_profile_step<N>.prof.")
+
+def _pipeline_options(parser, stages):
+    """
+    Options shared by ss-target and ss-compactor.
+    """
+    _stem_index_options(parser)
+    _annotation_options(parser)
+    _statistics_options(parser)
+    _checkpoint_options(parser, stages)
+    _executor_options(parser)
+    _profile_options(parser)
+
 def argument_parser_target():
-    parser = argparse.ArgumentParser(description="SPLASH-structure: a statistical approach to identify "
-                                                 "RNA secondary structures from raw sequencing data, "
-                                                 "bypassing multiple sequence alignment.")
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
 
     # Required arguments
     parser.add_argument("output_prefix", help="Prefix for naming the output result folder.")
-    parser.add_argument("splash_output_file", help="Path to the SPLASH output file.")
+    parser.add_argument("splash_output_file", help="Path to the SPLASH output file (TSV, Parquet or Arrow IPC).")
     
 
     # Options
     parser.add_argument("-a", "--element_annotation", action="store_true", 
                         help="Enable element annotation on targets.", )
+    parser.add_argument("--stream_chunk_size", type=int, default=None,
+                        help="Streaming mode: read the SPLASH output this many anchors at a time and spill "
+                             "per-chunk results to disk, so that peak memory is bounded by the chunk size. "
+                             "Default: read the whole file at once.")
+    _cache_options(parser)
+    _pipeline_options(parser, TARGET_STAGES)
  
     arguments = parser.parse_args()
 
     return vars(arguments)
 
 def argument_parser_compactor():
-    parser = argparse.ArgumentParser(description="SPLASH-structure: a statistical approach to identify "
-                                                 "RNA secondary structures from raw sequencing data, "
-                                                 "bypassing multiple sequence alignment.")
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
 
     # Required arguments
     parser.add_argument("output_prefix", help="Prefix for naming the output result folder.")
-    parser.add_argument("compactor_file", help="Path to the compactor file.")
+    parser.add_argument("compactor_file", help="Path to the compactor file (TSV, Parquet or Arrow IPC).")
     
 
     # Options
     parser.add_argument("-a", "--element_annotation", action="store_true", 
                         help="Enable element annotation on compactors.", )
+    parser.add_argument("--preprocess_backend", choices=["python", "julia"], default="python",
+                        help="Backend used to split compactors into segments: the built-in Python "
+                             "implementation, or the original Julia script (writes "
+                             "interm_compactor/processed_compactors.tsv; for parity testing). Default: python.")
+    _pipeline_options(parser, COMPACTOR_STAGES)
  
     arguments = parser.parse_args()
 
-    return vars(arguments)
\ No newline at end of file
+    return vars(arguments)
+
+def argument_parser_simulate():
+    parser = argparse.ArgumentParser(description="Monte Carlo anchor_p of SPLASH-structure results: the "
+                                                 "targets (compactors) of every anchor are replaced by random "
+                                                 "mutants of the base target with the same number of mutations.")
+
+    # Required arguments
+    parser.add_argument("mode", choices=["target", "compactor"], help="Pipeline that produced the results.")
+    parser.add_argument("results_file", help="Result table of ss-target or ss-compactor (TSV, Parquet or Arrow IPC).")
+    parser.add_argument("output_file", help="Output table with one row per anchor and anchor_p_simulated.")
+
+    # Options
+    parser.add_argument("--n_iter", type=int, default=100, help="Number of simulated draws per anchor. Default: 100.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0.")
+    parser.add_argument("--anchor_p_method", choices=["conv", "exhaustive"], default="conv",
+                        help="Null distribution of the anchor score, as in the pipelines. Default: conv.")
+    parser.add_argument("--save_draws", default=None,
+                        help="Also save every simulated anchor_p (anchors x n_iter) to this .npz file.")
+    parser.add_argument("--executor", choices=["auto", "serial", "thread", "process"], default="auto",
+                        help="How batches of anchors are run. Default: auto.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of pool workers. Default: number of available CPUs.")
+
+    arguments = parser.parse_args()
+
+    return vars(arguments)
+
+def _rfam_arguments(parser):
+    parser.add_argument("seq_type", choices=["extendor", "compactor"],
+                        help="Query sequences: anchor + target (ss-target results) or the compactor (ss-compactor results).")
+    parser.add_argument("results_file", help="Result table of ss-target or ss-compactor (TSV, Parquet or Arrow IPC).")
+
+def _rfam_options(parser):
+    parser.add_argument("--bh_threshold", type=float, default=0.1,
+                        help="Only rows with anchor_p_BH below this threshold are used. Default: 0.1.")
+    parser.add_argument("--chunk_size", type=int, default=100000,
+                        help="Rows of the result table read at a time. Default: 100000.")
+
+def argument_parser_rfam_query():
+    parser = argparse.ArgumentParser(description="Write the distinct query sequences of significant SPLASH-structure "
+                                                 "results to FASTA for an Rfam search, named by a hash of the sequence.")
+    _rfam_arguments(parser)
+    parser.add_argument("--output", default=None,
+                        help="FASTA file, gzipped if it ends with .gz. Default: <seq_type>.fasta.")
+    _rfam_options(parser)
+
+    arguments = parser.parse_args()
+
+    return vars(arguments)
+
+def argument_parser_rfam_merge():
+    parser = argparse.ArgumentParser(description="Join the Rfam hits of the queries of ss-rfam-query back to the "
+                                                 "significant SPLASH-structure results.")
+    _rfam_arguments(parser)
+    parser.add_argument("rfam_file", help="Tab-separated Rfam hits with a 'query name' column.")
+    parser.add_argument("--output", default=None,
+                        help="Merged TSV, gzipped if it ends with .gz. Default: <results_file without extension>.RFAM.tsv.")
+    _rfam_options(parser)
+
+    arguments = parser.parse_args()
+
+    return vars(arguments)
+
+def argument_parser_batch():
+    parser = argparse.ArgumentParser(description="Run SPLASH-structure on many datasets in one process, sharing "
+                                                 "the worker pool, the target_p caches and the stem index.")
+
+    # Required arguments
+    parser.add_argument("manifest", help="Tab-separated file with the columns mode (target or compactor), "
+                                         "input_file and output_prefix, one dataset per line.")
+
+    # Options of the batch
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of datasets run at a time. Default: half the available CPUs.")
+    parser.add_argument("--memory_mb", type=float, default=None,
+                        help="Memory budget of the datasets run at a time, estimated from their input file "
+                             "sizes. Default: the available memory.")
+
+    # Options of every dataset, see ss-target and ss-compactor
+    parser.add_argument("-a", "--element_annotation", action="store_true",
+                        help="Enable element annotation on targets (compactors).")
+    parser.add_argument("--preprocess_backend", choices=["python", "julia"], default="python",
+                        help="Compactor mode: backend used to split compactors into segments. Default: python.")
+    parser.add_argument("--stream_chunk_size", type=int, default=None,
+                        help="Target mode: streaming mode with this many anchors per chunk. Default: off.")
+    _cache_options(parser)
+    _stem_index_options(parser, "the folder of the manifest")
+    _annotation_options(parser)
+    _statistics_options(parser)
+    _checkpoint_options(parser)
+    _executor_options(parser)
+    _profile_options(parser, cprofile=False)
+
+    arguments = parser.parse_args()
+
+    return vars(arguments)
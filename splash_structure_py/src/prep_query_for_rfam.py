@@ -1,12 +1,86 @@
+"""
+Export the query sequences of significant results for an Rfam search. The result table is read
+in chunks, rows with anchor_p_BH below the threshold are kept, and their sequences (anchor + target
+in target mode, the compactor in compactor mode) are written to FASTA. Identical sequences are
+written once under a content-hash ID, so `merge_structure_rfam` can join the Rfam hits back to
+every row of the sequence.
+Run with: ss-rfam-query {extendor,compactor} <results_file> [--output queries.fasta.gz]
+"""
+import gzip
+import hashlib
+import numpy as np
 import pandas as pd
-import sys
 
-df = pd.read_csv(sys.argv[1], sep='\t').loc[lambda df: df['anchor_p_BH'] < 0.1]
+from splash_structure_py.src.table_io import iter_table
+from splash_structure_py.src.parse_args import argument_parser_rfam_query
 
-with open(f"{sys.argv[2]}.fasta", "w") as f:
-    if sys.argv[2] == "extendor":
-        for i in range(df.shape[0]):
-            f.write(f">Sequence{i+1}\n{df.loc[i, 'anchor']+df.loc[i, 'target']}\n")
-    else:
-        for i in range(df.shape[0]):
-            f.write(f">Sequence{i+1}\n{df.loc[i, 'compactor']}\n")
+BH_THRESHOLD = 0.1
+CHUNK_SIZE = 100000           # rows of the result table read at a time
+QUERY_COLUMNS = {"extendor": ["anchor", "target"], "compactor": ["compactor"]}
+
+def query_id(seq):
+    """
+    Stable ID of a query sequence: a hash of its content, the same in every run and file.
+    """
+    return "q" + hashlib.blake2b(seq.encode(), digest_size=8).hexdigest()
+
+def open_text(path, mode="r"):
+    """
+    Open a text file, gzip-compressed if `path` ends with .gz.
+    """
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+def query_sequences(chunk, seq_type="extendor"):
+    """
+    Query sequence of every row of a result table chunk, as an object array.
+    """
+    if seq_type == "extendor":
+        return (chunk['anchor'].astype(str) + chunk['target'].astype(str)).to_numpy(dtype=object)
+    return chunk['compactor'].astype(str).to_numpy(dtype=object)
+
+def iter_queries(results_file, seq_type="extendor", bh_threshold=BH_THRESHOLD, chunksize=CHUNK_SIZE,
+                 columns=None):
+    """
+    Yield (chunk, query sequences, query IDs) for the rows of the result table with anchor_p_BH
+    below `bh_threshold`, `chunksize` rows of the table at a time. `columns` are read in addition
+    to the ones needed for the queries (None: all columns).
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(['anchor_p_BH'] + QUERY_COLUMNS[seq_type] + list(columns)))
+    for chunk in iter_table(results_file, chunksize, columns=columns):
+        chunk = chunk.loc[chunk['anchor_p_BH'].to_numpy() < bh_threshold]
+        seqs = query_sequences(chunk, seq_type)
+        # hash each distinct sequence of the chunk once
+        codes, distinct = pd.factorize(seqs)
+        ids = np.array([query_id(seq) for seq in distinct], dtype=object)[codes]
+        yield chunk, seqs, ids
+
+def export_queries(results_file, fasta_file, seq_type="extendor", bh_threshold=BH_THRESHOLD,
+                   chunksize=CHUNK_SIZE):
+    """
+    Write the distinct query sequences of the significant rows to `fasta_file` (gzipped if it
+    ends with .gz), one buffered write per chunk. Returns the number of sequences written.
+    """
+    seen = set()
+    with open_text(fasta_file, "w") as f:
+        for _, seqs, ids in iter_queries(results_file, seq_type, bh_threshold, chunksize, columns=[]):
+            records = []
+            for seq_id, seq in zip(ids, seqs):
+                if seq_id not in seen:
+                    seen.add(seq_id)
+                    records.append(f">{seq_id}\n{seq}\n")
+            f.write("".join(records))
+    return len(seen)
+
+def run_export_queries():
+    """
+    Entry point of ss-rfam-query.
+    """
+    args = argument_parser_rfam_query()
+    fasta_file = args["output"] or f"{args['seq_type']}.fasta"
+    export_queries(args["results_file"], fasta_file, args["seq_type"], args["bh_threshold"], args["chunk_size"])
+
+if __name__ == "__main__":
+    run_export_queries()
@@ -0,0 +1,301 @@
+"""
+This script is the first step of the compactor pipeline. It takes in a dataframe of compactors
+and returns a dataframe where each compactor is split into 4 segments that are paired in 
+3 ways (D1, D2, D3), together with compactor weights and the base segments of each anchor.
+It is a NumPy port of `process_compactor_4_segments.jl` and returns the same table.
+The pipeline keeps the table lean: anchor, compactor, segment_index, base_S1 and base_S2 are 
+categorical, counts are small integers, and the per-row segments S1 and S2 are not stored but 
+derived from the compactor and its pairing when they are needed (`pairing_segments`).
+"""
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.seq_array import SeqArray
+from splash_structure_py.src.stem_search import segment_hairpins, HAIRPIN_COLUMNS, HAIRPIN_BATCH
+from splash_structure_py.src.stem_index import find_stems
+from splash_structure_py.src.executor import get_executor
+from splash_structure_py.src.table_io import with_output_dtypes
+
+# segment pairings, indexed as <Destruction><No.>: (S1 = seg_a + seg_b, S2 = seg_c + seg_d)
+SEGMENT_PAIRINGS = {"D1": [0, 1, 2, 3], 
+                    "D2": [0, 2, 1, 3], 
+                    "D3": [0, 3, 1, 2]}
+SEG_NUM = 4
+
+def segment_bounds(seq_len, seg_num=SEG_NUM):
+    """
+    Split a sequence of length `seq_len` into `seg_num` segments, distributing the extra 
+    characters to the first segments. Return the start index of each segment and the end.
+    """
+    base_len, extra = divmod(seq_len, seg_num)
+    seg_lengths = [base_len + 1 if i < extra else base_len for i in range(seg_num)]
+    return np.cumsum([0] + seg_lengths)
+
+def pairing_columns(seq_len, pairing, seg_num=SEG_NUM):
+    """
+    Return the column indices (into the trimmed compactor) that make up S1 and S2 of a pairing.
+    """
+    bounds = segment_bounds(seq_len, seg_num)
+    seg = [np.arange(bounds[i], bounds[i+1]) for i in range(seg_num)]
+    a, b, c, d = pairing
+    return np.concatenate([seg[a], seg[b]]), np.concatenate([seg[c], seg[d]])
+
+def split_compactors(compactors, anchor_len, pairings=tuple(SEGMENT_PAIRINGS)):
+    """
+    Trim the anchor off each compactor and build S1 / S2 of every pairing in `pairings`.
+    Compactors of each length are packed 2 bits per base in a SeqArray (uint8 matrix of ASCII 
+    codes if they contain other characters than A, C, G, T and N), and the segments are decoded 
+    to strings only for the output table.
+
+    Output:
+    A dict {pairing: (S1 array, S2 array)} with one entry per compactor.
+    """
+    compactors = np.asarray(compactors, dtype=object)
+    lengths = np.array([len(c) for c in compactors], dtype=np.int64) - anchor_len
+    segments = {name: (np.empty(len(compactors), dtype=object), np.empty(len(compactors), dtype=object)) 
+                for name in pairings}
+    for seq_len in np.unique(lengths):
+        rows = np.flatnonzero(lengths == seq_len)
+        trimmed = [c[anchor_len:] for c in compactors[rows]]
+        try:
+            packed = SeqArray.from_strings(trimmed)
+        except ValueError:
+            packed = None
+            mat = np.frombuffer(''.join(trimmed).encode('ascii'), dtype=np.uint8).reshape(len(rows), seq_len)
+        for name in pairings:
+            for out, cols in zip(segments[name], pairing_columns(seq_len, SEGMENT_PAIRINGS[name])):
+                if packed is not None:
+                    out[rows] = packed.take_columns(cols).to_strings()
+                    continue
+                text = np.ascontiguousarray(mat[:, cols]).tobytes().decode('ascii')
+                out[rows] = [text[i*len(cols):(i+1)*len(cols)] for i in range(len(rows))]
+    return segments
+
+def pairing_hairpins(compactors, anchor_len, stem_L=5, top_k=None, pairings=tuple(SEGMENT_PAIRINGS)):
+    """
+    Candidate hairpins of S1 and S2 of every pairing of the compactors, from one pairing matrix 
+    per trimmed compactor instead of one stem search per segment. The first hairpin of a segment 
+    is the stem `find_stem_ind` finds in it; top_k limits the hairpins per segment.
+
+    Output:
+    A dataframe with one row per hairpin: compactor (position in `compactors`), segment_index 
+    (pairing), segment (1 for S1, 2 for S2) and the stem_search.HAIRPIN_COLUMNS.
+    """
+    compactors = np.asarray(compactors, dtype=object)
+    lengths = np.array([len(c) for c in compactors], dtype=np.int64) - anchor_len
+    parts = []
+    for seq_len in np.unique(lengths):
+        rows = np.flatnonzero(lengths == seq_len)
+        segments = [cols for name in pairings for cols in pairing_columns(seq_len, SEGMENT_PAIRINGS[name])]
+        part = segment_hairpins([c[anchor_len:] for c in compactors[rows]], segments, stem_L, top_k)
+        segment = part.pop("segment").to_numpy()
+        part.insert(0, "compactor", rows[part.pop("sequence").to_numpy(dtype=np.int64)])
+        part.insert(1, "segment_index", np.asarray(pairings, dtype=object)[segment // 2])
+        part.insert(2, "segment", segment % 2 + 1)
+        parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=["compactor", "segment_index", "segment"] + HAIRPIN_COLUMNS)
+    return pd.concat(parts).sort_values(["compactor", "segment_index", "segment"], kind="stable", ignore_index=True)
+
+def join_segments(S1, S2, segment_index):
+    """
+    The trimmed compactors whose segments in pairing `segment_index` are S1 and S2 (the inverse 
+    of `split_compactors`), one per row.
+    """
+    S1, S2 = np.asarray(S1, dtype=object), np.asarray(S2, dtype=object)
+    segment_index = np.asarray(segment_index, dtype=object)
+    lengths = np.array([len(s1) + len(s2) for s1, s2 in zip(S1, S2)], dtype=np.int64)
+    compactors = np.empty(len(S1), dtype=object)
+    for name in SEGMENT_PAIRINGS:
+        for seq_len in np.unique(lengths[segment_index == name]):
+            rows = np.flatnonzero((segment_index == name) & (lengths == seq_len))
+            joined = ''.join(s1 + s2 for s1, s2 in zip(S1[rows], S2[rows])).encode('ascii')
+            mat = np.empty((len(rows), seq_len), dtype=np.uint8)
+            mat[:, np.concatenate(pairing_columns(seq_len, SEGMENT_PAIRINGS[name]))] = \
+                np.frombuffer(joined, dtype=np.uint8).reshape(len(rows), seq_len)
+            text = mat.tobytes().decode('ascii')
+            compactors[rows] = [text[i*seq_len:(i+1)*seq_len] for i in range(len(rows))]
+    return compactors
+
+def _segment_stems(compactors, stem_L):
+    """
+    {segment: stem indices} of the segments of trimmed compactors that have a stem.
+    """
+    segments = split_compactors(compactors, 0)
+    hairpins = pairing_hairpins(compactors, 0, stem_L, top_k=1)
+    return {segments[pairing][segment - 1][i]: stem for i, pairing, segment, *stem in 
+            hairpins[["compactor", "segment_index", "segment"] + HAIRPIN_COLUMNS[:5]].itertuples(index=False)}
+
+def base_segment_stems(base_S1, base_S2, segment_index, stem_L=5):
+    """
+    Stem indices of base_S1 and base_S2 of every row, the same as `find_stems([base_S1, base_S2])`.
+    The base segments of the 3 pairings of an anchor come from the same base compactor, so the
+    segments that are not in the stem index are searched with `pairing_hairpins`, from one pairing
+    matrix per base compactor instead of one stem search per segment.
+
+    Output:
+    stems_1, stems_2: (num_rows, 5) int64 arrays of stem_index.STEM_COLUMNS
+    """
+    rows = pd.DataFrame({"S1": pd.Series(base_S1).to_numpy(dtype=object), 
+                         "S2": pd.Series(base_S2).to_numpy(dtype=object), 
+                         "pairing": pd.Series(segment_index).to_numpy(dtype=object)})
+    # base compactor of every distinct base segment (any of them if a segment occurs in several)
+    distinct = rows.drop_duplicates()
+    compactors = join_segments(distinct.S1, distinct.S2, distinct.pairing)
+    compactor_of = dict(zip(distinct.S2, compactors))
+    compactor_of.update(zip(distinct.S1, compactors))
+
+    def search(seqs, stem_L):
+        compactors = pd.unique(pd.Series([compactor_of[seq] for seq in seqs], dtype=object))
+        batches = [compactors[i:i+HAIRPIN_BATCH] for i in range(0, len(compactors), HAIRPIN_BATCH)]
+        found = {}
+        for stems in get_executor().map(_segment_stems, batches, stem_L):
+            found.update(stems)
+        return [found.get(seq, [0, 0, 0, 0, 0]) for seq in seqs]
+
+    return find_stems([rows.S1, rows.S2], stem_L, search)
+
+def support_rank(anchor_codes, support):
+    """
+    Support rank column of the Julia script: within each anchor (rows in file order), 
+    row i gets the i-th entry of `sortperm(support, rev=true)`, i.e. the position of 
+    the i-th most supported compactor (ties in file order). For compactors sorted by 
+    support within an anchor, this is the rank of the compactor.
+    """
+    anchor_codes, support = np.asarray(anchor_codes), np.asarray(support)
+    position = np.arange(len(support))
+    local_idx = pd.Series(anchor_codes).groupby(anchor_codes).cumcount().to_numpy()
+    rows_in_order = np.argsort(anchor_codes, kind='stable')
+    rows_by_support = np.lexsort((position, -support, anchor_codes))
+    rank = np.empty(len(support), dtype=np.int64)
+    rank[rows_in_order] = local_idx[rows_by_support] + 1
+    return rank
+
+def pairing_segments(compactor, segment_index, anchor_len, rows=None):
+    """
+    S1 and S2 of compactors split by their pairing, e.g. of the rows of the stacked table.
+
+    Input:
+    compactor, segment_index: one entry per row (plain or categorical)
+    rows: positions of the rows to split (default: all rows)
+
+    Output:
+    S1, S2: object arrays with one string per row
+    """
+    compactor, segment_index = pd.Series(compactor), pd.Series(segment_index)
+    if rows is not None:
+        compactor, segment_index = compactor.iloc[rows], segment_index.iloc[rows]
+    compactor, segment_index = compactor.to_numpy(dtype=object), segment_index.to_numpy(dtype=object)
+    S1, S2 = np.empty(len(compactor), dtype=object), np.empty(len(compactor), dtype=object)
+    for name in SEGMENT_PAIRINGS:
+        sel = np.flatnonzero(segment_index == name)
+        if len(sel) > 0:
+            S1[sel], S2[sel] = split_compactors(compactor[sel], anchor_len, (name,))[name]
+    return S1, S2
+
+def add_segment_columns(df):
+    """
+    Materialize the S1 and S2 columns (after compactor_weight) of a lean compactor table, for 
+    notations and output. Tables that have them are returned unchanged.
+    """
+    if "S1" in df.columns or len(df) == 0:
+        return df
+    S1, S2 = pairing_segments(df['compactor'], df['segment_index'], len(df['anchor'].iloc[0]))
+    df = df.copy()
+    position = df.columns.get_loc('compactor_weight') + 1 if 'compactor_weight' in df.columns else len(df.columns)
+    df.insert(position, 'S1', S1)
+    df.insert(position + 1, 'S2', S2)
+    return df
+
+def lean_compactor_table(df):
+    """
+    Categorical IDs and small integer dtypes for a processed compactor table (e.g. the output of 
+    the Julia script), without the S1 and S2 columns.
+    """
+    df = df.drop(columns=[col for col in ('S1', 'S2') if col in df.columns])
+    df = with_output_dtypes(df.astype({"compactor": "category"}))
+    if 'segment_index' in df.columns:
+        df['segment_index'] = df['segment_index'].cat.set_categories(list(SEGMENT_PAIRINGS))
+    return df
+
+def drop_unused_categories(df):
+    """
+    Drop the categories of categorical columns that no row uses any more, e.g. after filtering.
+    """
+    for col in df.columns[[isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes]]:
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+def anchor_split_column(anchor, segment_index):
+    """
+    anchor + '_' + segment_index of every row as a categorical. Only the distinct pairs are 
+    formatted; categories are sorted, so sorting by the column sorts by the strings.
+    """
+    anchor_codes, anchors = pd.factorize(pd.Series(anchor).to_numpy(dtype=object))
+    segment_codes, segments = pd.factorize(pd.Series(segment_index).to_numpy(dtype=object))
+    pair_codes, pairs = pd.factorize(anchor_codes.astype(np.int64) * len(segments) + segment_codes)
+    names = (np.asarray(anchors, dtype=object)[pairs // len(segments)] + '_' 
+             + np.asarray(segments, dtype=object)[pairs % len(segments)])
+    return pd.Categorical.from_codes(pair_codes, categories=names).set_categories(sorted(names))
+
+def process_compactors(df, wgt_thres=0.05, segments=True):
+    """
+    Same steps as `process_compactor_4_segments.jl`:
+    1. rank compactors of each anchor by support
+    2. drop anchors whose 2nd ranked compactor has support < 2
+    3. split compactors into 4 segments and stack the 3 pairings D1, D2, D3 (column segment_index)
+    4. compactor weight per anchor and pairing; drop compactors with weight < wgt_thres
+    5. base segments (base_S1, base_S2) from the best ranked compactor; drop the base compactor
+    6. recompute the compactor weight
+    The stacked rows reference their compactor and pairing; only the base compactors are split.
+    With segments=False, S1 and S2 are left out (see `add_segment_columns`).
+
+    Output columns: the input columns, support_rank, segment_index, compactor_weight, S1, S2, 
+    base_S1, base_S2
+    """
+    if len(df) == 0:
+        return df
+    anchor_len = len(df.iloc[0, 0])
+    df = df.astype({"anchor": "category", "compactor": "category"})
+    anchor_codes = df['anchor'].cat.codes.to_numpy()
+
+    # Add compactor rank (sorted by support descendingly) to a new column. 
+    df['support_rank'] = support_rank(anchor_codes, df['support'].to_numpy())
+
+    # filter out anchors whose 2nd most abundant compactor has support < 2
+    anchors_to_remove = np.unique(anchor_codes[(df.support_rank == 2) & (df.support < 2)])
+    df = df[~np.isin(anchor_codes, anchors_to_remove)].reset_index(drop=True)
+    if len(df) == 0:
+        return df
+    df = with_output_dtypes(df)
+
+    # stack the pairings (D1 rows, then D2, then D3); a row is identified by its compactor and pairing
+    n, num_pairings = len(df), len(SEGMENT_PAIRINGS)
+    stacked = df.iloc[np.tile(np.arange(n), num_pairings)].reset_index(drop=True)
+    segment_codes = np.repeat(np.arange(num_pairings, dtype=np.int8), n)
+    stacked['segment_index'] = pd.Categorical.from_codes(segment_codes, categories=list(SEGMENT_PAIRINGS))
+
+    # get target weight and filter compactor abundance >= .05
+    group_keys = stacked['anchor'].cat.codes.to_numpy(dtype=np.int64) * num_pairings + segment_codes
+    stacked['compactor_weight'] = stacked['support'] / stacked.groupby(group_keys)['support'].transform('sum')
+    keep = (stacked['compactor_weight'] >= wgt_thres).to_numpy()
+    stacked, group_keys = stacked[keep].reset_index(drop=True), group_keys[keep]
+
+    # base target: segments of the best ranked (first on ties) compactor of each anchor and pairing
+    base_row = stacked.groupby(group_keys)['support_rank'].transform('idxmin').to_numpy()
+    base_rows, base_inverse = np.unique(base_row, return_inverse=True)
+    for col, base_segment in zip(['base_S1', 'base_S2'], 
+                                 pairing_segments(stacked['compactor'], stacked['segment_index'], anchor_len, base_rows)):
+        stacked[col] = pd.Categorical(base_segment[base_inverse])
+    # remove rows where the segments are equal to the base segments; S1 and S2 together hold all 
+    # bases of the compactor, so these are the rows of the base compactor itself
+    compactor_codes = stacked['compactor'].cat.codes.to_numpy()
+    keep = compactor_codes != compactor_codes[base_row]
+    stacked, group_keys = stacked[keep].reset_index(drop=True), group_keys[keep]
+        
+    # Recalculate 'compactor_weight' after filtering, grouping by 'anchor' and 'segment_index'.
+    stacked['compactor_weight'] = stacked['support'] / stacked.groupby(group_keys)['support'].transform('sum')
+
+    columns = list(df.columns) + ['segment_index', 'compactor_weight', 'base_S1', 'base_S2']
+    stacked = stacked[columns]
+    return add_segment_columns(stacked) if segments else stacked
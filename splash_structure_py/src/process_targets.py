@@ -5,7 +5,8 @@ and target weight information.
 """
 import pandas as pd
 import numpy as np
-from pandarallel import pandarallel
+
+from splash_structure_py.src.stem_index import find_stems, STEM_COLUMNS
 
 def rc(seq):
     """
@@ -14,9 +15,11 @@ def rc(seq):
     complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
     return ''.join(complement.get(base, base) for base in reversed(seq))
 
-def find_stem_ind(target, stem_L=5):
+def find_stem_ind_bruteforce(target, stem_L=5):
     """
     This fucntion find a hairpin structure in `target` sequence and returns stem indices.
+    It tries every stem length and start position, and is kept as the reference 
+    for `stem_search.find_stem_ind`, which returns the same result much faster.
 
     Input: 
     A target sequence and the minimum stem length (default value is 5).
@@ -47,15 +50,18 @@ def find_stem_ind(target, stem_L=5):
     return [0,0,0,0,0]
 
 
-def process_row(row):
+def expand_targets(df):
     """
-    This function takes in a dataframe row with found hairpin in the 
-    most-frequent target and returns a dataframe with 11 columns.
+    This function takes in a dataframe with found hairpin in the most-frequent 
+    target of each row and returns a long dataframe with one row per target.
 
     For each row (each significant anchor from SPLASH)):
     1. take rank-1 target as the 'base_target' and the rest as 'target'. 
     2. Calculate the weight of each target.
 
+    The `most_freq_target_2..` / `cnt_most_freq_target_2..` blocks are reshaped as 
+    (num_anchor, num_target) arrays in one pass; '-' targets and zero counts are masked out.
+
     Return 11 quantities: 
     1. anchor (same for all rows)
     2. M (number of occurences in data, same for all rows)
@@ -68,25 +74,23 @@ def process_row(row):
     9. target (different for each row)
     10. target_count (different for each row)
     11. target_wgt (different for each row): target_count / sum(up to top 10 target_counts)
-    12. tar_wgt_filtered (different for each row): after abundance filtering, reweight targets, excluding base target
 """
-    
-    # obtain the target list and its counts. 
-    # Filter index names by regex and drop '-' target.
-    target_list = [row[tar] for tar in row.filter(regex=("^most_freq_target_")).index.to_list()[1:] if row[tar] != '-' ]
-    cnt_list = np.array([row[cnt] for cnt in row.filter(regex=("^cnt_most_freq_target_")).index.to_list()[1:] if row[cnt] != 0])
-    
-    new_df = pd.DataFrame({"anchor": row["anchor"], 
-                           "M": row["M"],
-                           "stem_start_idx": row["stem_start_idx"], 
-                           "stem_end_idx": row["stem_end_idx"], 
-                           "rc_start_idx": row["rc_start_idx"], 
-                           "rc_end_idx": row["rc_end_idx"],
-                           "stemL": row["stemL"],
-                           "base_target": row["most_freq_target_1"], 
-                           "target": target_list, 
-                           "target_count": cnt_list,
-                           "target_wgt": np.array(cnt_list)/(sum(cnt_list) + row["cnt_most_freq_target_1"])})
+    # obtain the target and count blocks, in column order, without the rank-1 target
+    target_cols = df.filter(regex=("^most_freq_target_")).columns.to_list()[1:]
+    cnt_cols = df.filter(regex=("^cnt_most_freq_target_")).columns.to_list()[1:]
+    targets = df[target_cols].to_numpy(dtype=object)
+    cnts = df[cnt_cols].to_numpy()
+    keep = (targets != '-') & (cnts != 0)
+    total_cnt = np.where(keep, cnts, 0).sum(axis=1) + df["cnt_most_freq_target_1"].to_numpy()
+
+    # row-major order: targets of an anchor stay together and in rank order
+    rows, cols = np.nonzero(keep)
+    new_df = pd.DataFrame({col: df[col].to_numpy()[rows] for col in 
+                           ["anchor", "M", "stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx", "stemL"]})
+    new_df["base_target"] = df["most_freq_target_1"].to_numpy()[rows]
+    new_df["target"] = targets[rows, cols]
+    new_df["target_count"] = cnts[rows, cols]
+    new_df["target_wgt"] = cnts[rows, cols] / total_cnt[rows]
     return new_df
 
 def process_df(df, wgt_thres=0.05, stemL=5):
@@ -98,8 +102,8 @@ def process_df(df, wgt_thres=0.05, stemL=5):
     weights are returned. 
     """
 
-    # find stems and store the index (both included)
-    df[["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx", "stemL"]] = pd.DataFrame(df.parallel_apply(lambda x: find_stem_ind(x.most_freq_target_1, 5), axis=1).tolist())
+    # find stems and store the index (both included); each distinct base target is searched once
+    df[STEM_COLUMNS] = pd.DataFrame(find_stems(df.most_freq_target_1, stemL), index=df.index)
 
     # drop anchors without stem using condition stem_start_idx == stem_end_idx
     df = df[df.stemL != 0]
@@ -110,11 +114,10 @@ def process_df(df, wgt_thres=0.05, stemL=5):
         return pd.DataFrame()
 
     # for each anchor, find base targets and targets
-    df_processed = df.parallel_apply(process_row , axis=1)
-    df = pd.concat(df_processed.to_list(), ignore_index=True)
+    df = expand_targets(df)
     
     # filter target abundance >.05
-    df = df.loc[df['target_wgt'] > .05].reset_index(drop=True)
+    df = df.loc[df['target_wgt'] > wgt_thres].reset_index(drop=True)
     
     # recalculate target_weight (exclude cnts of base target)
     df["tar_wgt_filtered"] = df["target_count"] / df.groupby("anchor")["target_count"].transform("sum")
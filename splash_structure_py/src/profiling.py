@@ -0,0 +1,218 @@
+"""
+Run instrumentation for --profile. Every numbered step of the pipelines records its wall and CPU
+time (of this process and of finished child processes such as Julia or the annotation jobs), the
+rows it reads and writes, and its peak RSS. Cache hit rates and the cost of every anchor_p
+computation are collected along the way. The report is written to `run_report.json` in the
+output folder; with --cprofile the hottest step is also dumped as a cProfile file.
+Steps that run several times (e.g. once per chunk in streaming mode) are aggregated.
+"""
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+REPORT_FILE = "run_report.json"
+PERCENTILES = [50, 90, 99]
+TOP_FUNCTIONS = 25            # functions of the hottest step listed in the report
+
+def _read_status_mb(field):
+    """
+    Field of /proc/self/status in MB (e.g. VmHWM, the peak RSS), or None if unavailable.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process (Linux), so that the next reading is the peak of a single
+    step. Return False if it cannot be reset; the peak is then the peak since the process started.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    peak = _read_status_mb('VmHWM')
+    if peak is None:
+        # ru_maxrss is in kB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    return peak
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def _hit_rate(hits, misses):
+    return hits / (hits + misses) if hits + misses > 0 else None
+
+class RunProfiler:
+    """
+    Collects the measurements of one pipeline run. Disabled profilers only cost a function call
+    per step.
+
+    outfolder: folder of run_report.json
+    enabled: record anything at all (--profile)
+    cprofile: also run cProfile on every step and dump the hottest one (--cprofile)
+    """
+    def __init__(self, outfolder=None, enabled=False, cprofile=False, mode=None, params=None):
+        self.outfolder = outfolder
+        self.enabled = enabled
+        self.cprofile = enabled and cprofile
+        self.mode = mode
+        self.params = params or {}
+        self.steps = {}
+        self.counters = {}
+        self.costs = {}
+        self._profiles = {}
+        self._start = (time.perf_counter(), time.process_time(), _children_cpu())
+
+    @contextmanager
+    def step(self, step, name, df=None):
+        """
+        Measure the block as step `step` (its number in the pipeline) called `name`. `df` is the
+        input of the step; set record["rows_out"] to the number of output rows.
+        """
+        record = {}
+        if not self.enabled:
+            yield record
+            return
+        profile = self._profiles.setdefault(step, cProfile.Profile()) if self.cprofile else None
+        exact_peak = reset_peak_rss()
+        start = (time.perf_counter(), time.process_time(), _children_cpu())
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall, cpu, children_cpu = (time.perf_counter() - start[0], time.process_time() - start[1],
+                                       _children_cpu() - start[2])
+            total = self.steps.setdefault(step, {"step": step, "name": name, "calls": 0, "wall_s": 0.0,
+                                                 "cpu_s": 0.0, "children_cpu_s": 0.0, "rows_in": 0,
+                                                 "rows_out": 0, "peak_rss_mb": 0.0})
+            total["calls"] += 1
+            total["wall_s"] += wall
+            total["cpu_s"] += cpu
+            total["children_cpu_s"] += children_cpu
+            total["rows_in"] += 0 if df is None else len(df)
+            total["rows_out"] += record.get("rows_out", 0)
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], peak_rss_mb())
+            total["peak_rss_exact"] = exact_peak
+
+    def count(self, name, **counts):
+        """
+        Add to the counters of `name`, e.g. count("result_cache", hits=10, misses=2).
+        """
+        if self.enabled:
+            counter = self.counters.setdefault(name, {})
+            for key, value in counts.items():
+                counter[key] = counter.get(key, 0) + int(value)
+
+    def add_costs(self, name, seconds, sizes=None):
+        """
+        Record the cost (seconds) of every item of a batch, e.g. of every anchor in anchor_p,
+        with the size of the item (number of targets).
+        """
+        if self.enabled:
+            costs = self.costs.setdefault(name, {"seconds": [], "sizes": []})
+            costs["seconds"].extend(np.asarray(seconds, dtype=float).tolist())
+            costs["sizes"].extend([] if sizes is None else np.asarray(sizes).tolist())
+
+    def _cost_summary(self, name):
+        seconds, sizes = np.array(self.costs[name]["seconds"]), np.array(self.costs[name]["sizes"])
+        if len(seconds) == 0:
+            return {"count": 0}
+        summary = {"count": len(seconds), "total_s": float(seconds.sum()), "mean_s": float(seconds.mean()),
+                   "max_s": float(seconds.max())}
+        summary.update({f"p{q}_s": float(np.percentile(seconds, q)) for q in PERCENTILES})
+        if len(sizes) == len(seconds):
+            summary["size_of_slowest"] = int(sizes[seconds.argmax()])
+        return summary
+
+    def _cache_report(self):
+        # target_p caches are counted by the anchor_p workers (see get_pval.anchor_p_grouped), 
+        # whose caches live in the pool processes
+        caches = {}
+        for name, counter in self.counters.items():
+            caches[name] = dict(counter, hit_rate=_hit_rate(counter.get("hits", 0), counter.get("misses", 0)))
+        return caches
+
+    def _dump_hottest(self):
+        """
+        Write the cProfile stats of the step with the largest wall time and return its summary.
+        """
+        hottest = max(self.steps.values(), key=lambda s: s["wall_s"])
+        profile = self._profiles[hottest["step"]]
+        path = os.path.join(self.outfolder, f"run_profile_step{hottest['step']}.prof")
+        profile.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        return {"step": hottest["step"], "name": hottest["name"], "file": path, "top_functions": text.getvalue()}
+
+    def report(self):
+        wall, cpu, children_cpu = (time.perf_counter() - self._start[0], time.process_time() - self._start[1],
+                                   _children_cpu() - self._start[2])
+        report = {"mode": self.mode, "command": sys.argv, "params": self.params,
+                  "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "total": {"wall_s": wall, "cpu_s": cpu, "children_cpu_s": children_cpu,
+                            # resetting the peak for each step also resets the process peak
+                            "peak_rss_mb": max([peak_rss_mb()] + [s["peak_rss_mb"] for s in self.steps.values()])},
+                  "steps": list(self.steps.values()),
+                  "caches": self._cache_report(),
+                  "costs": {name: self._cost_summary(name) for name in self.costs}}
+        if self.cprofile and self.steps:
+            report["cprofile"] = self._dump_hottest()
+        return report
+
+    def write_report(self):
+        """
+        Write run_report.json to the output folder (nothing if the profiler is disabled).
+        """
+        if not self.enabled or self.outfolder is None:
+            return None
+        path = os.path.join(self.outfolder, REPORT_FILE)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Run report written to {path}")
+        return path
+
+# profiler shared by the pipeline steps of a thread (every dataset of a batch runs in its own 
+# thread); disabled until `configure_profiler` is called
+_local = threading.local()
+
+def configure_profiler(outfolder=None, enabled=False, cprofile=False, mode=None, params=None):
+    """
+    Replace the shared profiler of this thread and return it.
+    """
+    _local.profiler = RunProfiler(outfolder, enabled, cprofile, mode, params)
+    return _local.profiler
+
+def get_profiler():
+    if getattr(_local, "profiler", None) is None:
+        _local.profiler = RunProfiler()
+    return _local.profiler
+
+def finish_profiler():
+    """
+    Write the report of the shared profiler of this thread and disable it.
+    """
+    path = get_profiler().write_report()
+    _local.profiler = RunProfiler()
+    return path
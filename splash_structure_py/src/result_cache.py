@@ -0,0 +1,142 @@
+"""
+On-disk cache of per-anchor results for incremental reruns. Each anchor is keyed by a hash of
+its input columns (e.g. anchor, base target, targets and counts) and of the run parameters, so
+anchors whose inputs are unchanged are read back instead of recomputed. Results are stored in an
+SQLite file; old entries are evicted by age and total size.
+"""
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.profiling import get_profiler
+
+CACHE_FILE = "result_cache.sqlite"
+CACHE_VERSION = 2             # bump when the cached results change for the same inputs
+CACHE_MAX_SIZE_MB = 2048
+CACHE_MAX_AGE_DAYS = 30
+VACUUM_FREE_FRACTION = 0.25   # share of free pages above which `evict` compacts the file
+
+def anchor_keys(df, key_columns, params):
+    """
+    Return one hex key per row of `df`: a hash of the row's `key_columns` and of `params`.
+    """
+    prefix = repr((CACHE_VERSION, sorted(params.items()))).encode()
+    values = df[key_columns].astype(str).to_numpy()
+    return [hashlib.blake2b(prefix + '\t'.join(row).encode(), digest_size=16).hexdigest() for row in values]
+
+class ResultCache:
+    """
+    SQLite key/value store of per-anchor result rows.
+    A key maps to the list of result rows of one anchor (possibly empty, e.g. no stem found);
+    the columns and dtypes of the rows are stored once per parameter set.
+    """
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results "
+                          "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS schemas (params TEXT PRIMARY KEY, value BLOB)")
+        self.conn.commit()
+
+    def get_schema(self, params_key):
+        row = self.conn.execute("SELECT value FROM schemas WHERE params = ?", (params_key,)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put_schema(self, params_key, schema):
+        self.conn.execute("INSERT OR REPLACE INTO schemas VALUES (?, ?)", (params_key, pickle.dumps(schema)))
+        self.conn.commit()
+
+    def get_many(self, keys, batch=500):
+        """
+        Return {key: rows} for the keys found in the cache, and refresh their access time.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(keys), batch):
+            chunk = keys[i:i+batch]
+            query = f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})"
+            for key, value in self.conn.execute(query, chunk):
+                found[key] = pickle.loads(value)
+        now = time.time()
+        self.conn.executemany("UPDATE results SET accessed = ? WHERE key = ?", [(now, key) for key in found])
+        self.conn.commit()
+        return found
+
+    def put_many(self, items):
+        """
+        Store {key: rows}.
+        """
+        now = time.time()
+        records = []
+        for key, rows in items.items():
+            value = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+            records.append((key, value, len(value), now))
+        self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", records)
+        self.conn.commit()
+
+    def evict(self, max_size_mb=CACHE_MAX_SIZE_MB, max_age_days=CACHE_MAX_AGE_DAYS):
+        """
+        Delete entries not used for `max_age_days`, then the least recently used entries until
+        the stored results take at most `max_size_mb`. None disables a limit. The file is only
+        compacted when at least VACUUM_FREE_FRACTION of its pages are free.
+        """
+        if max_age_days is not None:
+            self.conn.execute("DELETE FROM results WHERE accessed < ?", (time.time() - max_age_days * 86400,))
+        if max_size_mb is not None:
+            # keep the most recently used entries whose cumulative size fits
+            self.conn.execute("DELETE FROM results WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER "
+                              "(ORDER BY accessed DESC, key) AS total FROM results) WHERE total > ?)",
+                              (max_size_mb * 2**20,))
+        self.conn.commit()
+        # VACUUM rewrites the whole file: only worth it once enough pages are free
+        free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        total_pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        if total_pages > 0 and free_pages / total_pages >= VACUUM_FREE_FRACTION:
+            self.conn.execute("VACUUM")
+
+    def close(self):
+        self.conn.close()
+
+def cached_by_anchor(df, func, cache, key_columns, params, group_col="anchor"):
+    """
+    Apply `func` to the rows of `df` (one row per anchor) whose results are not cached, and
+    combine them with the cached results. `func` must handle every anchor independently and
+    return its result rows grouped by `group_col`. Results are returned in the order of `df`.
+    """
+    keys = anchor_keys(df, key_columns, params)
+    params_key = repr((CACHE_VERSION, sorted(params.items())))
+    schema = cache.get_schema(params_key)
+    found = cache.get_many(keys) if schema is not None else {}
+    miss = [key not in found for key in keys]
+    get_profiler().count("result_cache", hits=len(miss) - sum(miss), misses=sum(miss))
+
+    new_df = func(df.loc[miss]) if any(miss) else pd.DataFrame()
+    if len(new_df) > 0:
+        schema = [(col, str(dtype)) for col, dtype in new_df.dtypes.items()]
+        cache.put_schema(params_key, schema)
+    new_rows = {key: [] for key, is_miss in zip(keys, miss) if is_miss}
+    if len(new_df) > 0:
+        anchor_key = dict(zip(df[group_col], keys))
+        records = list(zip(*[new_df[col].tolist() for col in new_df.columns]))
+        codes, anchors = pd.factorize(new_df[group_col])
+        order = np.argsort(codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes))])
+        for g, anchor in enumerate(anchors):
+            new_rows[anchor_key[anchor]] = [records[i] for i in order[bounds[g]:bounds[g+1]]]
+    cache.put_many(new_rows)
+
+    # nothing cached (or nothing found): the fresh results are complete
+    if len(found) == 0 or schema is None:
+        return new_df
+    found.update(new_rows)
+    rows = [row for key in keys for row in found[key]]
+    if len(rows) == 0:
+        return pd.DataFrame()
+    columns = [col for col, _ in schema]
+    return pd.DataFrame.from_records(rows, columns=columns).astype(dict(schema))
@@ -0,0 +1,185 @@
+"""
+Compact container for many DNA sequences of the same length: 2 bits per base (A=0, C=1, G=2, T=3,
+4 bases per byte) and a bit mask of ambiguous bases (N). Mismatch counting is a bitwise operation
+on the packed codes. Sequences are converted from and to strings only
+where the tables are read and written.
+"""
+import numpy as np
+
+BASES = 'ACGT'
+# ASCII -> 2-bit code; 255 marks characters other than A, C, G, T
+BASE_CODE = np.full(256, 255, dtype=np.uint8)
+BASE_CODE[list(b'ACGT')] = [0, 1, 2, 3]
+CODE_BASE = np.frombuffer(BASES.encode('ascii'), dtype=np.uint8)
+# number of set bits of every byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# one bit (the low bit of each 2-bit base) per base
+LOW_BITS = 0x55
+
+def pack_codes(codes):
+    """
+    Pack a (n, L) matrix of 2-bit codes into a (n, ceil(L/4)) uint8 matrix, first base in the
+    highest bits. Padding bases are 0.
+    """
+    n, seq_len = codes.shape
+    padded = np.zeros((n, -(-seq_len // 4) * 4), dtype=np.uint8)
+    padded[:, :seq_len] = codes
+    quads = padded.reshape(n, -1, 4)
+    return (quads[:, :, 0] << 6) | (quads[:, :, 1] << 4) | (quads[:, :, 2] << 2) | quads[:, :, 3]
+
+def unpack_codes(packed, seq_len):
+    """
+    Inverse of `pack_codes`.
+    """
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    codes = (packed[:, :, None] >> shifts) & 3
+    return codes.reshape(len(packed), -1)[:, :seq_len]
+
+def pack_bits(mask):
+    """
+    Pack a (n, L) boolean mask into the bit layout of `pack_codes` (the low bit of each base).
+    """
+    return pack_codes(mask.astype(np.uint8))
+
+def packed_positions(packed, rows, cols):
+    """
+    Flat byte index and bit shift of the bases at (rows, cols) of a packed matrix.
+    """
+    return rows * packed.shape[1] + (cols >> 2), (6 - 2 * (cols & 3)).astype(np.uint8)
+
+def read_packed(packed, positions):
+    """
+    2-bit values of a packed matrix at the `positions` of `packed_positions`.
+    """
+    flat, shift = positions
+    return (np.take(packed.ravel(), flat) >> shift) & 3
+
+class SeqArray:
+    """
+    Fixed-width sequences packed 2 bits per base.
+
+    Attributes:
+    packed: (n, ceil(seq_len/4)) uint8 matrix of packed codes
+    seq_len: length of every sequence
+    n_bits: N bases packed like `pack_bits` (low bit of the base set), or None if there is none
+    """
+    def __init__(self, packed, seq_len, n_mask=None):
+        self.packed = packed
+        self.seq_len = seq_len
+        self.n_bits = pack_bits(n_mask) if n_mask is not None and n_mask.any() else None
+
+    @classmethod
+    def from_strings(cls, seqs):
+        """
+        Pack equal-length sequences of A, C, G, T and N. Raise ValueError for other characters
+        or sequences of different lengths.
+        """
+        seqs = list(seqs)
+        seq_len = len(seqs[0]) if seqs else 0
+        text = ''.join(seqs).encode('ascii')
+        if len(text) != seq_len * len(seqs):
+            raise ValueError("SeqArray needs sequences of the same length.")
+        ascii_mat = np.frombuffer(text, dtype=np.uint8).reshape(len(seqs), seq_len)
+        codes = BASE_CODE[ascii_mat]
+        if codes.size == 0 or codes.max() < 4:
+            return cls(pack_codes(codes), seq_len)
+        n_mask = ascii_mat == ord('N')
+        if ((codes == 255) & ~n_mask).any():
+            raise ValueError("SeqArray only stores the bases A, C, G, T and N.")
+        codes[n_mask] = 0
+        return cls(pack_codes(codes), seq_len, n_mask)
+
+    def __len__(self):
+        return len(self.packed)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + (0 if self.n_bits is None else self.n_bits.nbytes)
+
+    def codes(self):
+        """
+        (n, seq_len) uint8 matrix of 2-bit codes (N bases have code 0).
+        """
+        return unpack_codes(self.packed, self.seq_len)
+
+    def codes_at(self, rows, cols):
+        """
+        2-bit codes at the positions (rows, cols) (broadcast index arrays), read from the packed
+        bytes without unpacking the sequences.
+        """
+        return read_packed(self.packed, packed_positions(self.packed, rows, cols))
+
+    def ambiguous_at(self, rows, cols):
+        """
+        Boolean N mask at the positions (rows, cols).
+        """
+        if self.n_bits is None:
+            return np.zeros(np.broadcast(rows, cols).shape, dtype=bool)
+        return read_packed(self.n_bits, packed_positions(self.n_bits, rows, cols)).astype(bool)
+
+    def ambiguous(self):
+        """
+        (n, seq_len) boolean matrix of N bases.
+        """
+        if self.n_bits is None:
+            return np.zeros((len(self), self.seq_len), dtype=bool)
+        return unpack_codes(self.n_bits, self.seq_len).astype(bool)
+
+    def to_ascii(self):
+        """
+        (n, seq_len) uint8 matrix of ASCII codes.
+        """
+        ascii_mat = CODE_BASE[self.codes()]
+        if self.n_bits is not None:
+            ascii_mat[self.ambiguous()] = ord('N')
+        return ascii_mat
+
+    def to_strings(self):
+        """
+        List of the sequences as strings.
+        """
+        text = np.ascontiguousarray(self.to_ascii()).tobytes().decode('ascii')
+        return [text[i*self.seq_len:(i+1)*self.seq_len] for i in range(len(self))]
+
+    def take(self, rows):
+        """
+        SeqArray of the selected rows.
+        """
+        taken = SeqArray(self.packed[rows], self.seq_len)
+        taken.n_bits = None if self.n_bits is None else self.n_bits[rows]
+        return taken
+
+    def take_columns(self, cols):
+        """
+        SeqArray of the bases at positions `cols` (e.g. to cut sequences into segments).
+        """
+        n_mask = None if self.n_bits is None else self.ambiguous()[:, cols]
+        return SeqArray(pack_codes(self.codes()[:, cols]), len(cols), n_mask)
+
+    def mismatch_bits(self, other):
+        """
+        Packed mismatches with `other` (same shape): the low bit of a base is set where the bases
+        differ. N matches only N.
+        """
+        diff = self.packed ^ other.packed
+        bits = (diff | (diff >> 1)) & LOW_BITS
+        if self.n_bits is not None or other.n_bits is not None:
+            zeros = np.zeros_like(self.packed)
+            bits |= (zeros if self.n_bits is None else self.n_bits) ^ (zeros if other.n_bits is None else other.n_bits)
+        return bits
+
+    def mismatches(self, other):
+        """
+        (n, seq_len) boolean matrix of the positions where the sequences differ from `other`.
+        """
+        return unpack_codes(self.mismatch_bits(other), self.seq_len).astype(bool)
+
+    def mismatch_count(self, other, mask=None):
+        """
+        Number of mismatches with `other` per row, only at positions of the boolean (n, seq_len)
+        `mask` if given. Counted with a popcount of the packed mismatch bits.
+        """
+        bits = self.mismatch_bits(other)
+        if mask is not None:
+            bits &= pack_bits(mask)
+        return POPCOUNT[bits].sum(axis=1, dtype=np.int64)
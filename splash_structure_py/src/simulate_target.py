@@ -1,100 +1,189 @@
-import random
-import sys
-import gc
-sys.path.append('/oak/stanford/groups/horence/juliew/structure/src')
-import find_comp_mut
-import get_pval
-
-def random_mutate(base_target, totaMul):
-    """
-    Given the base_target and total mutations (hamming distance),
-    randomly select totaMul positions and mutate with 3 possibilities.
-    """
-    mutations = {'A':['C', 'G', 'T'],
-                  'C':['A', 'G', 'T'],
-                  'G':['A', 'C', 'T'],
-                  'T':['A', 'C', 'G']} # possible mutations for each base
-    base_list = list(base_target)
-    mutate_ind = random.sample(range(len(base_target)), k=totaMul) # select totaMul random locations to mutate
-    for i in mutate_ind:
-        cur_base = base_list[i]
-        base_list[i] = random.choice(mutations[cur_base])
-
-    return  "".join(base_list) # back to string
-
-def get_simulated_p(anchor, df, n_iter,):
-    sub_df = df.loc[df.anchor == anchor].reset_index(drop=True)
-    base_target = sub_df.loc[0, 'base_target']
-    stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx, stemL = sub_df.loc[0, ['stem_start_idx', 'stem_end_idx', 'rc_start_idx', 'rc_end_idx', 'stemL']]
-    
-    anchor_score=0
-    anchor_p_multi_simu = []
-    
-    for n in range(n_iter):
-        anchor_score = 0
-        for i in range(len(sub_df)):
-            simu_target = random_mutate(base_target, sub_df.totaMut.iloc[i])
-            totaMut, stemMut, compMut, _ = find_comp_mut.find_mutation(base_target, simu_target, stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx)
-            target_p = get_pval.target_p(len(base_target), stemL, totaMut, stemMut, compMut)
-            anchor_score += target_p * sub_df.tar_wgt_filtered.iloc[i]
-
-        p_val_one_simu = anchor_score
-        if len(sub_df) > 1:
-            all_anchor_outcomes, anchor_pmf = get_pval.pmf_anchor_score(*get_pval.prep_for_conv(len(sub_df), \
-                                                list(sub_df['tar_wgt_filtered']), \
-                                                len(sub_df['base_target'].iloc[0]), \
-                                                list(sub_df['stemL']), \
-                                                list(sub_df['totaMut'])))
-            p_val_one_simu = get_pval.anchor_p(all_anchor_outcomes, anchor_pmf, p_val_one_simu) 
-
-        anchor_p_multi_simu.append(p_val_one_simu)
-#    f = open("/oak/stanford/groups/horence/juliew/structure/0204_results/Batson_results/simulation_p.txt", "a")
-#    f.write(f"{anchor}\n{anchor_p_multi_simu}\n")
-#    f.close()
-
-    # delete sub_df from memory
-    del sub_df
-    gc.collect()
-    return tuple(anchor_p_multi_simu)
-
-
-def get_simulated_p_compactor(anchor_split, df, n_iter):
-    sub_df = df.loc[df.anchor_split == anchor_split].reset_index(drop=True) ###TODO: check if this is correct, should be anchor-split
-
-    base_target_1 = sub_df.loc[0, 'base_S1']
-    stem_start_idx_1, stem_end_idx_1, rc_start_idx_1, rc_end_idx_1, stemL_1 = sub_df.loc[0, ['stem_start_idx_1', 'stem_end_idx_1', 'rc_start_idx_1', 'rc_end_idx_1', 'stemL_1']]
-    
-    base_target_2 = sub_df.loc[0, 'base_S2']
-    stem_start_idx_2, stem_end_idx_2, rc_start_idx_2, rc_end_idx_2, stemL_2 = sub_df.loc[0, ['stem_start_idx_2', 'stem_end_idx_2', 'rc_start_idx_2', 'rc_end_idx_2', 'stemL_2']]
-   
-    anchor_score_per_split=0
-    anchor_p_multi_simu = 0
-    
-    for n in range(n_iter):
-        anchor_p_one_simu = 0
-        for i in range(len(sub_df)):
-            simu_target_1 = random_mutate(base_target_1, sub_df.totaMut_1.iloc[i])
-            totaMut_1, stemMut_1, compMut_1, _ = find_comp_mut.find_mutation(base_target_1, simu_target_1, stem_start_idx_1, stem_end_idx_1, rc_start_idx_1, rc_end_idx_1)
-            simu_target_1 = random_mutate(base_target_1, sub_df.totaMut_1.iloc[i])
-            totaMut_2, stemMut_2, compMut_2, _ = find_comp_mut.find_mutation(base_target_2, simu_target_2, stem_start_idx_2, stem_end_idx_2, rc_start_idx_2, rc_end_idx_2)
-            simu_target_2 = random_mutate(base_target_2, sub_df.totaMut_2.iloc[i])
-
-            target_p = get_pval.target_p(80, stemL_1+stemL_2, totaMut_1+totaMut_2, stemMut_1+stemMut_2, compMut_1+compMut_2)
-
-            anchor_score_per_split += target_p * sub_df.target_weight.iloc[i]
-
-        p_val_one_simu = anchor_score_per_split
-        if len(sub_df) > 1:
-            all_anchor_outcomes, anchor_pmf = get_pval.pmf_anchor_score(*get_pval.prep_for_conv(len(sub_df), \
-                                                list(sub_df['target_weight']), \
-                                                80, \
-                                                list(sub_df['stemL']), \
-                                                list(sub_df['totaMut'])))
-            p_val_one_simu = get_pval.anchor_p(all_anchor_outcomes, anchor_pmf, p_val_one_simu)
-
-        anchor_p_multi_simu += p_val_one_simu/n_iter
-
-    # delete sub_df from memory
-    del sub_df
-    gc.collect()
-    return anchor_p_multi_simu
+"""
+Monte Carlo null of anchor_p. For every anchor of a pipeline result table, each target (compactor)
+is replaced by a random mutant of the base target with the same number of mutations, n_iter times.
+The mutants are scored like the observed targets: mutation counts, target_p, anchor_score, and
+anchor_p under the anchor's null distribution, which is computed once per anchor.
+anchor_p_simulated is the mean of the simulated anchor_p over the iterations, for calibration of
+the analytical anchor_p. Anchors are simulated in batches on the shared executor; each batch draws
+from its own seeded stream, so the results only depend on the seed.
+Run with: ss-simulate {target,compactor} <results_file> <output_file> --n_iter 100 --seed 0
+"""
+import numpy as np
+import pandas as pd
+
+import splash_structure_py.src.get_pval as get_pval
+from splash_structure_py.src.find_comp_mut import mutation_counts_packed
+from splash_structure_py.src.seq_array import SeqArray, pack_codes
+from splash_structure_py.src.executor import Executor, configure_executor, get_executor, shutdown_executor
+from splash_structure_py.src.table_io import read_table, write_table
+from splash_structure_py.src.parse_args import argument_parser_simulate
+
+BATCH_ELEMENTS = 2**21        # simulated bases (n_iter x rows x length) per batch
+# per mode: group column, weight column, segments (base, stem index suffix, totaMut column), and 
+# the sequence length used in target_p (None: length of the base segments) and in the null
+SIMULATION_MODES = {
+    "target": {"group": "anchor", "wgt": "tar_wgt_filtered", "score": "anchor_score",
+               "segments": [("base_target", "", "totaMut")], "k_null": None},
+    "compactor": {"group": "anchor_split", "wgt": "compactor_weight", "score": "anchor_score_per_split",
+                  "segments": [("base_S1", "_1", "totaMut_1"), ("base_S2", "_2", "totaMut_2")], 
+                  # structure evaluation length for compactor is 80 (HARDCODED), as in wrap_anchor_p_compactor
+                  "k_null": 80},
+}
+
+def random_mutate_codes(codes, totaMul, rng):
+    """
+    Random mutants of a (n, L) matrix of 2-bit base codes (A=0, C=1, G=2, T=3): row i gets 
+    totaMul[i] mutations at distinct random positions, each to one of the 3 other bases.
+    rng is a numpy Generator. Returns a new matrix.
+    """
+    codes = np.array(codes, dtype=np.uint8)
+    totaMul = np.broadcast_to(np.asarray(totaMul), (len(codes),))
+    # random permutation of the positions of each row; the first totaMul[i] ones are mutated
+    perm = np.argsort(rng.random(codes.shape), axis=1)
+    mutate = np.zeros(codes.shape, dtype=bool)
+    np.put_along_axis(mutate, perm, np.arange(codes.shape[1])[None, :] < totaMul[:, None], axis=1)
+    shift = rng.integers(1, 4, size=codes.shape, dtype=np.uint8)
+    codes[mutate] = (codes[mutate] + shift[mutate]) % 4
+    return codes
+
+
+def simulate_mutation_counts(base, stem_idx, totaMut, n_iter, rng):
+    """
+    Mutate every base sequence `n_iter` times with its number of mutations (`random_mutate_codes` 
+    on 2-bit codes) and count the stem and compensatory mutations of the mutants (packed counting 
+    of `find_mutation_batch`). N bases are simulated as A.
+
+    Input:
+    base: base sequences, one per row
+    stem_idx: (stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx) arrays
+    totaMut: number of mutations of each row
+
+    Output:
+    stemMut, compMut: (n_iter, n) arrays
+    """
+    base = np.asarray(base, dtype=object)
+    totaMut = np.asarray(totaMut, dtype=np.int64)
+    n = len(base)
+    stemMut, compMut = np.zeros((n_iter, n), dtype=np.int64), np.zeros((n_iter, n), dtype=np.int64)
+    lengths = np.array([len(seq) for seq in base], dtype=np.int64)
+    for seq_len in np.unique(lengths):
+        rows = np.flatnonzero(lengths == seq_len)
+        base_arr = SeqArray.from_strings(base[rows])
+        base_rep = SeqArray(np.tile(base_arr.packed, (n_iter, 1)), seq_len)
+        mutants = random_mutate_codes(np.tile(base_arr.codes(), (n_iter, 1)), np.tile(totaMut[rows], n_iter), rng)
+        _, stem, comp = mutation_counts_packed(base_rep, SeqArray(pack_codes(mutants), seq_len), 
+                                               *[np.tile(np.asarray(x)[rows], n_iter) for x in stem_idx])
+        stemMut[:, rows] = stem.reshape(n_iter, len(rows))
+        compMut[:, rows] = comp.reshape(n_iter, len(rows))
+    return stemMut, compMut
+
+def _simulate_batch(batch, n_iter, method="conv"):
+    """
+    Simulated anchor_p of the groups of one batch of `_make_batches`: a (num_group, n_iter) array.
+    """
+    group, wgt, stemL, totaMut, k, k_null, segments, seed = batch
+    rng = np.random.default_rng(seed)
+    stemMut, compMut = 0, 0
+    for base, stem_idx, seg_totaMut in segments:
+        seg_stemMut, seg_compMut = simulate_mutation_counts(base, stem_idx, seg_totaMut, n_iter, rng)
+        stemMut, compMut = stemMut + seg_stemMut, compMut + seg_compMut
+    target_p = get_pval.target_p_batch(k[None, :], stemL[None, :], totaMut[None, :], 
+                                       stemMut, compMut).reshape(n_iter, len(group))
+    # rows of a group are contiguous
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    anchor_scores = np.add.reduceat(target_p * wgt[None, :], starts, axis=1)
+    # null distribution of each group, computed once for all draws
+    p_val, _ = get_pval.anchor_p_grouped(group, wgt, k_null, stemL, totaMut, anchor_scores.T, method, 
+                                         Executor("serial"))
+    return p_val
+
+def _make_batches(df, mode, n_iter, seed=0):
+    """
+    Cut the rows (sorted by group) into batches of whole groups with about BATCH_ELEMENTS 
+    simulated bases each. Every batch gets its own seed spawned from `seed`.
+    """
+    config = SIMULATION_MODES[mode]
+    codes, _ = pd.factorize(df[config["group"]])
+    seq_len = sum(df[base].str.len().to_numpy() for base, _, _ in config["segments"])
+    k = seq_len if mode == "target" else 2 * df["base_S1"].str.len().to_numpy()
+    k_null = k if config["k_null"] is None else np.full(len(df), config["k_null"])
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    # simulated bases before each group
+    work_before = np.r_[0, np.cumsum(seq_len * n_iter)][starts]
+    bounds = [0]
+    while bounds[-1] < len(df):
+        # next batch starts at the first group beyond the budget (and holds at least one group)
+        i = np.searchsorted(work_before, work_before[np.searchsorted(starts, bounds[-1])] + BATCH_ELEMENTS)
+        i = max(i, np.searchsorted(starts, bounds[-1]) + 1)
+        bounds.append(starts[i] if i < len(starts) else len(df))
+    batches = []
+    for start, end, batch_seed in zip(bounds[:-1], bounds[1:], np.random.SeedSequence(seed).spawn(len(bounds) - 1)):
+        rows = slice(start, end)
+        segments = [(df[base].to_numpy()[rows], 
+                     [df[f"{col}{suffix}"].to_numpy()[rows] for col in 
+                      ("stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx")], 
+                     df[seg_totaMut].to_numpy()[rows]) for base, suffix, seg_totaMut in config["segments"]]
+        group = codes[rows] - codes[start]
+        batches.append((group, df[config["wgt"]].to_numpy(dtype=float)[rows], df["stemL"].to_numpy()[rows], 
+                        df["totaMut"].to_numpy()[rows], k[rows], k_null[rows], segments, batch_seed))
+    return batches
+
+def simulate_anchor_p(df, mode="target", n_iter=100, seed=0, method="conv"):
+    """
+    Monte Carlo anchor_p of every anchor (anchor_split in compactor mode) of a pipeline result 
+    table. Batches of anchors run on the shared executor.
+
+    Output:
+    A dataframe with one row per anchor: the group column, num_target, the observed anchor score 
+    and anchor_p (if present) and anchor_p_simulated (mean over the draws), and the 
+    (num_anchor, n_iter) array of simulated anchor_p.
+    """
+    config = SIMULATION_MODES[mode]
+    # group rows of an anchor together, keeping their order
+    df = df.sort_values(config["group"], kind="stable").reset_index(drop=True)
+    results = get_executor().map(_simulate_batch, _make_batches(df, mode, n_iter, seed), n_iter, method)
+    draws = np.concatenate(results) if results else np.zeros((0, n_iter))
+
+    first = df.drop_duplicates(config["group"])
+    summary = pd.DataFrame({config["group"]: first[config["group"]].to_numpy(),
+                            "num_target": df.groupby(config["group"], sort=False).size().to_numpy()})
+    for col in [config["score"], "anchor_p"]:
+        if col in df.columns:
+            summary[col] = first[col].to_numpy()
+    summary["anchor_p_simulated"] = draws.mean(axis=1)
+    return summary, draws
+
+def get_simulated_p(anchor, df, n_iter, seed=None, method="conv"):
+    """
+    Simulated anchor_p of one anchor of a target mode result table, one value per iteration.
+    """
+    _, draws = simulate_anchor_p(df.loc[df.anchor == anchor], "target", n_iter, seed, method)
+    return tuple(draws[0].tolist())
+
+def get_simulated_p_compactor(anchor_split, df, n_iter, seed=None, method="conv"):
+    """
+    Simulated anchor_p of one anchor_split of a compactor mode result table, averaged over the iterations.
+    """
+    summary, _ = simulate_anchor_p(df.loc[df.anchor_split == anchor_split], "compactor", n_iter, seed, method)
+    return summary.anchor_p_simulated.iloc[0]
+
+def run_simulation():
+    """
+    Entry point of ss-simulate: simulate the anchors of a result table and save anchor_p_simulated.
+    """
+    args = argument_parser_simulate()
+    # batches are few and heavy, so send them to the pool one at a time
+    configure_executor(args["executor"], args["workers"], batch_size=1, serial_threshold=2)
+    try:
+        df = read_table(args["results_file"])
+        summary, draws = simulate_anchor_p(df, args["mode"], args["n_iter"], args["seed"], args["anchor_p_method"])
+        write_table(summary, args["output_file"])
+        if args["save_draws"]:
+            group = SIMULATION_MODES[args["mode"]]["group"]
+            np.savez_compressed(args["save_draws"], **{group: summary[group].to_numpy(dtype=str)}, 
+                                anchor_p_simulated=draws)
+    finally:
+        shutdown_executor()
+
+if __name__ == "__main__":
+    run_simulation()
@@ -0,0 +1,152 @@
+"""
+Deduplicating stem-index service shared by both pipelines. Base sequences repeat heavily (base
+targets shared by overlapping anchors, base_S1 / base_S2 identical for every compactor of an
+anchor_split), so the distinct sequences are collected, each is searched once on the shared
+executor, and the stem indices are broadcast back to the rows by sequence. A persistent SQLite
+store keeps the stems of previous runs, so sequences seen before are not searched again.
+"""
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.stem_search import find_stem_ind
+from splash_structure_py.src.executor import get_executor
+from splash_structure_py.src.profiling import get_profiler
+
+STEM_INDEX_FILE = "stem_index.sqlite"
+STEM_INDEX_VERSION = 1        # bump when find_stem_ind returns other stems for the same sequence
+STEM_COLUMNS = ["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx", "stemL"]
+
+class StemIndexStore:
+    """
+    SQLite store of the stem indices of sequences, keyed by (sequence, stem_L).
+    """
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, STEM_INDEX_FILE)
+        # the datasets of a batch share the store from several threads
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stems (seq TEXT, stem_L INTEGER, version INTEGER, "
+                          "stem_start_idx INTEGER, stem_end_idx INTEGER, rc_start_idx INTEGER, "
+                          "rc_end_idx INTEGER, stemL INTEGER, accessed REAL, PRIMARY KEY (seq, stem_L))")
+        self.conn.commit()
+
+    def get_many(self, seqs, stem_L, batch=500):
+        """
+        Return {sequence: stem indices} for the sequences found in the store, and refresh their
+        access time.
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(seqs), batch):
+                chunk = list(seqs[i:i+batch])
+                query = (f"SELECT seq, stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx, stemL FROM stems "
+                         f"WHERE stem_L = ? AND version = ? AND seq IN ({','.join('?' * len(chunk))})")
+                for seq, *stem in self.conn.execute(query, [stem_L, STEM_INDEX_VERSION] + chunk):
+                    found[seq] = stem
+            now = time.time()
+            self.conn.executemany("UPDATE stems SET accessed = ? WHERE seq = ? AND stem_L = ?",
+                                  [(now, seq, stem_L) for seq in found])
+            self.conn.commit()
+        return found
+
+    def put_many(self, stems, stem_L):
+        """
+        Store {sequence: stem indices}.
+        """
+        with self.lock:
+            now = time.time()
+            self.conn.executemany("INSERT OR REPLACE INTO stems VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  [(seq, stem_L, STEM_INDEX_VERSION, *map(int, stem), now) 
+                                   for seq, stem in stems.items()])
+            self.conn.commit()
+
+    def evict(self, max_age_days=None):
+        """
+        Delete stems not used for `max_age_days` and stems of older versions.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM stems WHERE version != ?", (STEM_INDEX_VERSION,))
+            if max_age_days is not None:
+                self.conn.execute("DELETE FROM stems WHERE accessed < ?", (time.time() - max_age_days * 86400,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# store shared by the pipeline steps; None (no persistence) until `open_stem_index` is called
+_store = None
+
+def open_stem_index(cache_dir=None):
+    """
+    Open the shared stem store in `cache_dir` (None: no persistent store) and return it. A store 
+    that is already open in `cache_dir` is kept, e.g. for the datasets of a batch.
+    """
+    global _store
+    if _store is not None and cache_dir is not None and \
+            os.path.abspath(_store.path) == os.path.abspath(os.path.join(cache_dir, STEM_INDEX_FILE)):
+        return _store
+    close_stem_index()
+    _store = None if cache_dir is None else StemIndexStore(cache_dir)
+    return _store
+
+def close_stem_index(max_age_days=None):
+    """
+    Evict old entries of the shared store (if `max_age_days` is given) and close it.
+    """
+    global _store
+    if _store is not None:
+        if max_age_days is not None:
+            _store.evict(max_age_days)
+        _store.close()
+        _store = None
+
+def _search_each(seqs, stem_L):
+    return get_executor().map(find_stem_ind, seqs, stem_L)
+
+def find_stems(seqs, stem_L=5, search=_search_each):
+    """
+    Stem indices of many sequences: each distinct sequence is read from the shared store or
+    searched once, and the results are broadcast back to the sequences.
+
+    Input:
+    seqs: one or several sequence columns (e.g. [df.base_S1, df.base_S2]) of the same length
+    search: search(seqs, stem_L) returns the stem indices of a list of distinct sequences that 
+    are not in the store (default: `find_stem_ind` of each sequence on the shared executor)
+
+    Output:
+    A (num_seq, 5) int64 array of [stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx, stemL]
+    per sequence, or a list of such arrays (one per column) if several columns are given.
+    """
+    columns = list(seqs) if isinstance(seqs, (list, tuple)) else [seqs]
+    codes, distinct = pd.factorize(pd.concat([pd.Series(np.asarray(col, dtype=object)) for col in columns],
+                                             ignore_index=True))
+    distinct = distinct.to_numpy(dtype=object)
+    stems = np.zeros((len(distinct), len(STEM_COLUMNS)), dtype=np.int64)
+    profiler = get_profiler()
+    profiler.count("stem_search_dedup", hits=len(codes) - len(distinct), misses=len(distinct))
+
+    missing = np.ones(len(distinct), dtype=bool)
+    if _store is not None and len(distinct) > 0:
+        found = _store.get_many(distinct, stem_L)
+        for i, seq in enumerate(distinct):
+            stem = found.get(seq)
+            if stem is not None:
+                stems[i] = stem
+                missing[i] = False
+        profiler.count("stem_index_store", hits=len(found), misses=int(missing.sum()))
+    if missing.any():
+        searched = search(distinct[missing].tolist(), stem_L)
+        stems[missing] = np.array(searched, dtype=np.int64).reshape(-1, len(STEM_COLUMNS))
+        if _store is not None:
+            _store.put_many(dict(zip(distinct[missing], stems[missing])), stem_L)
+
+    per_seq = stems[codes]
+    if len(columns) == 1 and not isinstance(seqs, (list, tuple)):
+        return per_seq
+    bounds = np.cumsum([0] + [len(col) for col in columns])
+    return [per_seq[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
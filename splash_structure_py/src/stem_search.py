@@ -0,0 +1,176 @@
+"""
+This script finds hairpin (stem-loop) structures with an index over reverse-complement windows.
+It returns exactly the same stem as `process_targets.find_stem_ind_bruteforce`, i.e. the 
+longest inverted repeat, with ties broken by the leftmost stem and then by the leftmost 
+reverse complement.
+
+For a stem length i, every window of length i is looked up in a table that maps each window 
+to its last occurrence in the sequence. A stem of length i exists iff the reverse complement 
+of some window starts at or after the end of that window. If a stem of length i exists, 
+so does one of length i-1 (drop its outermost base pair), so the longest stem is found by a 
+binary search over i, i.e. O(n log n) window lookups instead of O(n^3) scans.
+
+`enumerate_hairpins` reports every maximal stem instead of the longest one. Base a pairs with 
+base b if b is the complement of a; a stem of length L is a run of L pairs (j, r+L-1), 
+(j+1, r+L-2), ... on the anti-diagonal a + b = j + r + L - 1 of the pairing matrix, so all 
+stems come from one pass over the O(n^2) pairs. A pairing matrix can be reused for sequences 
+made of columns of the same sequence, e.g. the S1 / S2 segments of the compactor pairings.
+"""
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+def rc(seq):
+    """
+    Take in sequence and return the reverse complement of the given sequence.
+    """
+    return seq.translate(COMPLEMENT)[::-1]
+
+def _first_stem(target, target_rc, i):
+    """
+    Return the smallest start index j of a stem of length i, or -1 if there is none.
+    """
+    n = len(target)
+    last_pos = {}
+    for p in range(n - i + 1):
+        last_pos[target[p:p+i]] = p
+    for j in range(n - 2*i + 1):
+        # rc(target[j:j+i]) is a window of the reverse complement of the whole sequence
+        if last_pos.get(target_rc[n-j-i:n-j], -1) >= j + i:
+            return j
+    return -1
+
+def find_stem_ind(target, stem_L=5):
+    """
+    This fucntion find a hairpin structure in `target` sequence and returns stem indices.
+    Drop-in replacement of `process_targets.find_stem_ind_bruteforce` (same input and output).
+
+    Output: 
+    [stem_start_idx, stem_end_idx, rc_start_idx, rc_end_idx, stemL] if a hairpin is found. 
+    Else, return [0,0,0,0,0]. 
+    """
+    target_rc = rc(target)
+    lo, hi = stem_L, len(target) // 2
+    best_L, best_j = 0, -1
+    # binary search for the longest stem length with at least one stem
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        j = _first_stem(target, target_rc, mid)
+        if j > -1:
+            best_L, best_j = mid, j
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    if best_j == -1:
+        return [0,0,0,0,0]
+    i, j = best_L, best_j
+    loc = target[j+i:].find(target_rc[len(target)-j-i:len(target)-j])
+    return j, i + j - 1, loc + i + j, loc + i + j + i - 1, i
+
+HAIRPIN_COLUMNS = ["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx", "stemL", "loop"]
+HAIRPIN_BATCH = 4096          # sequences per stack of pairing matrices
+
+def pairing_matrices(targets):
+    """
+    (num_seq, n, n) boolean stack of the pairing matrices of sequences of equal length n: 
+    [i, a, b] is True if base b of sequence i is the complement of its base a (N pairs with N, 
+    as in `find_stem_ind`).
+    """
+    n = len(targets[0]) if len(targets) else 0
+    joined = "".join(targets)
+    seq = np.frombuffer(joined.encode('ascii'), dtype=np.uint8).reshape(len(targets), n)
+    comp = np.frombuffer(joined.translate(COMPLEMENT).encode('ascii'), dtype=np.uint8).reshape(len(targets), n)
+    return comp[:, :, None] == seq[:, None, :]
+
+@lru_cache(maxsize=None)
+def _anti_diagonals(n):
+    """
+    Pairs (a, b) with a < b of an (n, n) matrix, laid out as rows of anti-diagonals a + b = s: 
+    flat matrix indices of the valid cells of a (2n-1, n+1) grid (column a, a border at the end).
+    """
+    s, a = np.arange(2*n - 1)[:, None], np.arange(n + 1)[None, :]
+    b = s - a
+    valid = (a < b) & (b < n)
+    return (a * n + b)[valid], valid
+
+def hairpins_from_matrices(pairs, stem_L=5, top_k=None):
+    """
+    Every maximal stem (a stem that cannot be extended by a base pair on either side) of at least
+    `stem_L` base pairs, for a stack of pairing matrices.
+
+    Input:
+    pairs: (num_seq, n, n) boolean array, see `pairing_matrices`
+
+    Output:
+    seq: the sequence (position in the stack) of every hairpin
+    hairpins: a (num_hairpin, 6) int64 array of [stem_start_idx, stem_end_idx, rc_start_idx, 
+    rc_end_idx, stemL, loop] (loop: bases between the stem and its reverse complement). The 
+    hairpins of a sequence are contiguous, longest stems first, then by stem_start_idx and 
+    rc_start_idx; only the first `top_k` of each sequence if top_k is given.
+    """
+    num_seq, n = pairs.shape[0], pairs.shape[-1]
+    stem_L = max(stem_L, 1)
+    if num_seq == 0 or 2 * stem_L > n:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, len(HAIRPIN_COLUMNS)), dtype=np.int64)
+    index, valid = _anti_diagonals(n)
+    width = valid.shape[1] - stem_L + 1
+    grid = np.zeros((num_seq,) + valid.shape, dtype=bool)
+    grid[:, valid] = pairs.reshape(num_seq, n * n)[:, index]
+    # window[i, s, a]: stem_L pairs from (a, s-a) along the anti-diagonal; a maximal stem is a run
+    # of windows, from its first to its last window (first and last windows come in the same order)
+    window = grid[..., :width].copy()
+    for t in range(1, stem_L):
+        window &= grid[..., t:t+width]
+    first, last = window.copy(), window.copy()
+    first[..., 1:] &= ~window[..., :-1]
+    last[..., :-1] &= ~window[..., 1:]
+    seq, diag, start = np.nonzero(first)
+    length = np.nonzero(last)[2] + stem_L - start
+    rc_start = diag - start - length + 1
+    order = np.lexsort((rc_start, start, -length, seq))
+    if top_k is not None:
+        # rank of every hairpin within its sequence
+        seq_sorted = seq[order]
+        rank = np.arange(len(order)) - np.searchsorted(seq_sorted, seq_sorted)
+        order = order[rank < top_k]
+    seq, start, length, rc_start = seq[order], start[order], length[order], rc_start[order]
+    return seq.astype(np.int64), np.stack([start, start + length - 1, rc_start, rc_start + length - 1, 
+                                           length, rc_start - start - length], axis=1).astype(np.int64)
+
+def enumerate_hairpins(target, stem_L=5, top_k=None):
+    """
+    Every maximal stem of at least `stem_L` base pairs in `target`, as a (num_hairpin, 6) array 
+    (see `hairpins_from_matrices`). The first row (top_k=1) is the stem of `find_stem_ind`.
+    """
+    return hairpins_from_matrices(pairing_matrices([target]), stem_L, top_k)[1]
+
+def segment_hairpins(targets, segments, stem_L=5, top_k=None):
+    """
+    Hairpins of several sequences made of columns of each target (e.g. the S1 / S2 segments of 
+    the D1-D3 compactor pairings), from one pairing matrix per target.
+
+    Input:
+    targets: sequences of equal length
+    segments: list of column index arrays into the targets
+
+    Output:
+    A dataframe with one row per hairpin: sequence (position in `targets`), segment (position in 
+    `segments`) and the HAIRPIN_COLUMNS, with indices into the segment.
+    """
+    targets = list(targets)
+    parts = []
+    for first in range(0, len(targets), HAIRPIN_BATCH):
+        pairs = pairing_matrices(targets[first:first+HAIRPIN_BATCH])
+        for i, cols in enumerate(segments):
+            cols = np.asarray(cols)
+            seq, hairpins = hairpins_from_matrices(pairs[:, cols[:, None], cols[None, :]], stem_L, top_k)
+            part = pd.DataFrame(hairpins, columns=HAIRPIN_COLUMNS)
+            part.insert(0, "sequence", seq + first)
+            part.insert(1, "segment", i)
+            parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=["sequence", "segment"] + HAIRPIN_COLUMNS, dtype=np.int64)
+    hairpins = pd.concat(parts, ignore_index=True)
+    return hairpins.sort_values(["sequence", "segment"], kind="stable", ignore_index=True)
@@ -0,0 +1,52 @@
+"""
+Helpers for the streaming (bounded-memory) mode of the pipelines: global BH correction 
+from per-chunk p-values and a k-way merge of sorted TSV parts.
+"""
+import heapq
+import numpy as np
+from statsmodels.stats.multitest import multipletests
+
+def bh_by_chunk(pval_chunks):
+    """
+    BH correction over the p-values of all chunks at once.
+
+    Input:
+    pval_chunks: list of arrays, one p-value per anchor of each chunk
+
+    Output:
+    list of arrays with the BH-corrected p-values, split back by chunk
+    """
+    if len(pval_chunks) == 0:
+        return []
+    correction = multipletests(np.concatenate(pval_chunks), alpha=0.05, method='fdr_bh')
+    offsets = np.cumsum([len(x) for x in pval_chunks])[:-1]
+    return np.split(correction[1], offsets)
+
+def merge_sorted_tsv(part_files, out_file, key_columns, key_types):
+    """
+    Merge TSV files (with identical headers) that are each sorted by `key_columns` into 
+    `out_file`, keeping only one line per file in memory. Lines with equal keys keep the 
+    order of `part_files`, then their order within the file.
+
+    Input:
+    part_files: list of TSV paths
+    key_columns: names of the sort columns, e.g. ['anchor_p_BH', 'anchor']
+    key_types: function to parse each key column, e.g. [float, str]
+    """
+    handles = [open(path) for path in part_files]
+    try:
+        headers = [handle.readline() for handle in handles]
+        if len(set(headers)) > 1:
+            raise ValueError("Cannot merge TSV files with different columns.")
+        key_idx = [headers[0].rstrip('\n').split('\t').index(col) for col in key_columns]
+
+        def line_key(line):
+            fields = line.rstrip('\n').split('\t')
+            return tuple(parse(fields[i]) for i, parse in zip(key_idx, key_types))
+
+        with open(out_file, 'w') as out:
+            out.write(headers[0])
+            out.writelines(heapq.merge(*handles, key=line_key))
+    finally:
+        for handle in handles:
+            handle.close()
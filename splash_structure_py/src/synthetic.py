@@ -0,0 +1,162 @@
+"""
+Synthetic workloads: SPLASH output files (anchors with their most frequent targets) and compactor
+files at a configurable scale. Every anchor gets a random base sequence, which carries a hairpin
+(an inverted repeat around a short loop) with probability `hairpin_rate`; the other targets or
+compactors of the anchor are copies of it with a number of point mutations drawn from
+`mutation_load`, as in `simulate_target.random_mutate_codes`. Generation is vectorized and seeded.
+Run with: python -m splash_structure_py.src.synthetic {splash,compactor} <output> <n_anchors>
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.seq_array import CODE_BASE
+from splash_structure_py.src.simulate_target import random_mutate_codes
+from splash_structure_py.src.table_io import table_format, tsv_to_table
+
+ANCHOR_LEN = 27
+SPLASH_TARGETS = 10           # most_freq_target_1 ... most_freq_target_10 in SPLASH output
+MIN_STEM, MAX_STEM = 5, 9
+MIN_LOOP, MAX_LOOP = 3, 8
+UNSORTED_RATE = 0.2           # fraction of anchors whose compactors are not sorted by support
+
+def codes_to_strings(codes):
+    """
+    List of the rows of a (n, L) matrix of 2-bit codes as strings.
+    """
+    seq_len = codes.shape[1]
+    text = np.ascontiguousarray(CODE_BASE[codes]).tobytes().decode('ascii')
+    return [text[i*seq_len:(i+1)*seq_len] for i in range(len(codes))]
+
+def insert_hairpins(codes, rng, hairpin_rate):
+    """
+    In place: for a fraction `hairpin_rate` of the rows, overwrite the bases after a random stem
+    and loop with the reverse complement of the stem (complement is 3 - code).
+    """
+    n, seq_len = codes.shape
+    max_stem = min(MAX_STEM, (seq_len - MIN_LOOP) // 2)
+    if max_stem < MIN_STEM:
+        return codes
+    rows = np.flatnonzero(rng.random(n) < hairpin_rate)
+    stem = rng.integers(MIN_STEM, max_stem + 1, len(rows))
+    loop = np.minimum(rng.integers(MIN_LOOP, MAX_LOOP + 1, len(rows)), seq_len - 2 * stem)
+    start = (rng.random(len(rows)) * (seq_len - 2 * stem - loop + 1)).astype(np.int64)
+    for j in range(max_stem):
+        sel = stem > j
+        left = start[sel] + j
+        right = start[sel] + 2 * stem[sel] + loop[sel] - 1 - j
+        codes[rows[sel], right] = 3 - codes[rows[sel], left]
+    return codes
+
+def _family_codes(rng, n_anchors, seq_len, family_size, hairpin_rate, mutation_load):
+    """
+    Base sequences of the anchors and, for every anchor, `family_size[i]` members: the base
+    sequence first, then mutated copies. Return (anchor index of each member, member codes).
+    """
+    base = insert_hairpins(rng.integers(0, 4, (n_anchors, seq_len), dtype=np.uint8), rng, hairpin_rate)
+    owner = np.repeat(np.arange(n_anchors), family_size)
+    first = np.concatenate([[0], np.cumsum(family_size)[:-1]])
+    n_mut = rng.integers(mutation_load[0], mutation_load[1] + 1, len(owner))
+    n_mut[first] = 0
+    return owner, random_mutate_codes(base[owner], np.minimum(n_mut, seq_len), rng)
+
+def synthetic_splash(n_anchors, targets_per_anchor=(2, SPLASH_TARGETS), seq_len=27, hairpin_rate=0.5,
+                     mutation_load=(1, 4), max_count=200, seed=0):
+    """
+    Synthetic SPLASH output of `n_anchors` anchors with a random number of targets in
+    `targets_per_anchor` (min, max), each of length `seq_len`. Target counts are sorted descendingly
+    and M is their sum plus a few reads of unlisted targets. `seed` is an int or a numpy Generator
+    (to draw consecutive chunks from one stream).
+
+    Output columns: anchor, M, most_freq_target_i, cnt_most_freq_target_i for i = 1 ... max(10, max targets)
+    """
+    rng = np.random.default_rng(seed)
+    n_cols = max(SPLASH_TARGETS, targets_per_anchor[1])
+    n_targets = rng.integers(targets_per_anchor[0], targets_per_anchor[1] + 1, n_anchors)
+    owner, target_codes = _family_codes(rng, n_anchors, seq_len, n_targets, hairpin_rate, mutation_load)
+
+    targets = np.full((n_anchors, n_cols), '-', dtype=object)
+    slot = np.arange(len(owner)) - np.repeat(np.cumsum(n_targets) - n_targets, n_targets)
+    targets[owner, slot] = codes_to_strings(target_codes)
+    counts = -np.sort(-rng.integers(1, max_count + 1, (n_anchors, n_cols)), axis=1)
+    counts[np.arange(n_cols)[None, :] >= n_targets[:, None]] = 0
+
+    data = {"anchor": codes_to_strings(rng.integers(0, 4, (n_anchors, ANCHOR_LEN), dtype=np.uint8)),
+            "M": counts.sum(axis=1) + rng.integers(0, 10, n_anchors)}
+    for i in range(n_cols):
+        data[f"most_freq_target_{i+1}"] = targets[:, i]
+        data[f"cnt_most_freq_target_{i+1}"] = counts[:, i]
+    return pd.DataFrame(data)
+
+def synthetic_compactors(n_anchors, compactors_per_anchor=(2, 8), seq_len=27, hairpin_rate=0.5,
+                         mutation_load=(1, 6), max_support=40, seed=0):
+    """
+    Synthetic compactor file of `n_anchors` anchors with a random number of compactors in
+    `compactors_per_anchor` (min, max). Each compactor is the anchor followed by `seq_len` bases.
+    Supports are sorted descendingly within an anchor, except for a fraction of the anchors.
+
+    Output columns: anchor, compactor, support, exact_support, extender_specificity, num_extended
+    """
+    rng = np.random.default_rng(seed)
+    n_comp = rng.integers(compactors_per_anchor[0], compactors_per_anchor[1] + 1, n_anchors)
+    owner, comp_codes = _family_codes(rng, n_anchors, seq_len, n_comp, hairpin_rate, mutation_load)
+    anchors = np.array(codes_to_strings(rng.integers(0, 4, (n_anchors, ANCHOR_LEN), dtype=np.uint8)), dtype=object)
+
+    # supports sorted descendingly within each anchor, then shuffled for some anchors
+    support = rng.integers(1, max_support + 1, len(owner))
+    shuffled = (rng.random(n_anchors) < UNSORTED_RATE)[owner]
+    support = support[np.lexsort((np.where(shuffled, rng.random(len(owner)), -support), owner))]
+    return pd.DataFrame({"anchor": anchors[owner],
+                         "compactor": anchors[owner] + np.array(codes_to_strings(comp_codes), dtype=object),
+                         "support": support,
+                         "exact_support": support,
+                         "extender_specificity": -1.0,
+                         "num_extended": 0})
+
+def write_synthetic(path, kind, n_anchors, chunk_size=100000, seed=0, **params):
+    """
+    Write a synthetic SPLASH (`kind` 'splash') or compactor ('compactor') file of `n_anchors`
+    anchors, generated `chunk_size` anchors at a time from one seeded stream. The format follows
+    the extension of `path` (TSV, Parquet or Arrow IPC).
+    """
+    generate = {"splash": synthetic_splash, "compactor": synthetic_compactors}[kind]
+    fmt = table_format(path)
+    tsv_path = path if fmt == "tsv" else path + ".tmp.tsv"
+    rng = np.random.default_rng(seed)
+    for i, start in enumerate(range(0, n_anchors, chunk_size)):
+        chunk = generate(min(chunk_size, n_anchors - start), seed=rng, **params)
+        chunk.to_csv(tsv_path, sep='\t', index=False, mode='w' if i == 0 else 'a', header=i == 0,
+                     float_format='%.6f')
+    if fmt != "tsv":
+        tsv_to_table(tsv_path, path, fmt, chunksize=chunk_size)
+        os.remove(tsv_path)
+    return path
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Generate a synthetic SPLASH or compactor file.")
+    parser.add_argument("kind", choices=["splash", "compactor"], help="Type of file to generate.")
+    parser.add_argument("output", help="Output path (.tsv, .parquet or .arrow).")
+    parser.add_argument("n_anchors", type=int, help="Number of anchors.")
+    parser.add_argument("--per_anchor", type=int, nargs=2, default=None, metavar=("MIN", "MAX"),
+                        help="Range of the number of targets (compactors) per anchor. "
+                             "Default: 2 10 (2 8 for compactors).")
+    parser.add_argument("--seq_len", type=int, default=27,
+                        help="Length of the targets, or of the compactors after the anchor. Default: 27.")
+    parser.add_argument("--hairpin_rate", type=float, default=0.5,
+                        help="Fraction of anchors whose base sequence carries a hairpin. Default: 0.5.")
+    parser.add_argument("--mutation_load", type=int, nargs=2, default=None, metavar=("MIN", "MAX"),
+                        help="Range of the number of point mutations of each non-base target (compactor). "
+                             "Default: 1 4 (1 6 for compactors).")
+    parser.add_argument("--chunk_size", type=int, default=100000, help="Anchors generated at a time.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0.")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    params = {"seq_len": args.seq_len, "hairpin_rate": args.hairpin_rate}
+    if args.per_anchor is not None:
+        params["targets_per_anchor" if args.kind == "splash" else "compactors_per_anchor"] = tuple(args.per_anchor)
+    if args.mutation_load is not None:
+        params["mutation_load"] = tuple(args.mutation_load)
+    write_synthetic(args.output, args.kind, args.n_anchors, args.chunk_size, args.seed, **params)
@@ -0,0 +1,167 @@
+"""
+Reading and writing of input and output tables as tab-separated text, Parquet or Arrow IPC.
+The format is chosen from the file extension (.parquet/.pq, .arrow/.feather/.ipc, else TSV).
+Parquet and Arrow need the optional `pyarrow` dependency (pip install "splash-structure[parquet]").
+"""
+import pandas as pd
+
+TABLE_FORMATS = {"tsv": ".tsv", "parquet": ".parquet", "arrow": ".arrow"}
+EXTENSION_FORMATS = {".parquet": "parquet", ".pq": "parquet", 
+                     ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+
+# explicit dtypes of the output columns: dictionary-encoded sequences / IDs, small integers
+CATEGORY_COLUMNS = ["anchor", "compactor", "base_target", "anchor_split", "segment_index", "base_S1", "base_S2"]
+INT32_COLUMNS = ["M", "target_count", "support", "exact_support", "num_extended", "support_rank",
+                 "num_target", "num_stem_loop"]
+INT16_COLUMNS = ["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx", "stemL", 
+                 "totaMut", "stemMut", "compMut"]
+STRING_COLUMNS = ["strucNotation", "db_strucNotation", "symbol_strucNotation"]
+
+def table_format(path):
+    """
+    Return 'parquet', 'arrow' or 'tsv' depending on the extension of `path`.
+    """
+    for ext, fmt in EXTENSION_FORMATS.items():
+        if str(path).endswith(ext):
+            return fmt
+    return "tsv"
+
+def table_path(path_stem, fmt="tsv"):
+    """
+    Return `path_stem` with the extension of format `fmt`.
+    """
+    return f"{path_stem}{TABLE_FORMATS[fmt]}"
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as err:
+        raise ImportError("Parquet and Arrow tables need pyarrow: "
+                          "pip install \"splash-structure[parquet]\"") from err
+    return pyarrow
+
+def _dtype_for(col):
+    """
+    Output dtype of a column (also for suffixed compactor columns such as stemL_1), or None.
+    """
+    base = col.rsplit('_', 1)[0] if col[-2:] in ("_1", "_2") else col
+    if col in CATEGORY_COLUMNS:
+        return "category"
+    if base in INT32_COLUMNS:
+        return "int32"
+    if base in INT16_COLUMNS:
+        return "int16"
+    if base in STRING_COLUMNS:
+        return "string"
+    return None
+
+def with_output_dtypes(df):
+    """
+    Cast known columns to their output dtypes (columns with missing integers are left alone).
+    """
+    dtypes = {}
+    for col in df.columns:
+        dtype = _dtype_for(col)
+        if dtype is None:
+            continue
+        if dtype.startswith("int") and not pd.api.types.is_integer_dtype(df[col]):
+            continue
+        dtypes[col] = dtype
+    return df.astype(dtypes)
+
+def read_table(path, columns=None, **kwargs):
+    """
+    Read a table in any supported format; `columns` restricts the columns that are read.
+    """
+    fmt = table_format(path)
+    if fmt == "parquet":
+        _require_pyarrow()
+        return pd.read_parquet(path, columns=columns, **kwargs)
+    if fmt == "arrow":
+        _require_pyarrow()
+        return pd.read_feather(path, columns=columns, **kwargs)
+    return pd.read_csv(path, sep='\t', usecols=columns, **kwargs)
+
+def iter_table(path, chunksize, columns=None):
+    """
+    Yield the table in chunks of at most `chunksize` rows. Only one chunk (or one record batch 
+    of an Arrow IPC file) is held in memory at a time.
+    """
+    fmt = table_format(path)
+    if fmt == "tsv":
+        yield from pd.read_csv(path, sep='\t', usecols=columns, chunksize=chunksize)
+        return
+    _require_pyarrow()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns)
+    else:
+        batches = _iter_ipc_batches(path, chunksize, columns)
+    for batch in batches:
+        yield batch.to_pandas()
+
+def _iter_ipc_batches(path, chunksize, columns=None):
+    """
+    Record batches of an Arrow IPC file, read one at a time from a memory map and sliced 
+    into pieces of at most `chunksize` rows.
+    """
+    pa = _require_pyarrow()
+    import pyarrow.ipc as ipc
+    with pa.memory_map(str(path)) as source:
+        reader = ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns:
+                batch = batch.select(columns)
+            for offset in range(0, batch.num_rows, chunksize):
+                yield batch.slice(offset, chunksize)
+
+def write_table(df, path, fmt=None, compression="zstd"):
+    """
+    Write `df` as TSV, or as Parquet / Arrow IPC with explicit dtypes and compression.
+    """
+    fmt = fmt or table_format(path)
+    if fmt == "tsv":
+        df.to_csv(path, index=False, sep='\t')
+        return
+    _require_pyarrow()
+    df = with_output_dtypes(df)
+    if fmt == "parquet":
+        df.to_parquet(path, index=False, compression=compression)
+    else:
+        df.reset_index(drop=True).to_feather(path, compression=compression)
+
+def _dictionary_type(pa, dtype, fmt):
+    """
+    Output type of a column of type `dtype`: a dictionary with int32 indices in Parquet, plain 
+    values in Arrow IPC; other types are kept.
+    """
+    if not pa.types.is_dictionary(dtype):
+        return dtype
+    return pa.dictionary(pa.int32(), dtype.value_type) if fmt == "parquet" else dtype.value_type
+
+def tsv_to_table(tsv_path, path, fmt, chunksize=100000, compression="zstd"):
+    """
+    Convert a TSV file to Parquet / Arrow IPC chunk by chunk, with the dtypes of `write_table`.
+    Dictionary columns get int32 indices in Parquet output, whatever index width pandas picks for
+    the categories of a chunk. Arrow IPC files allow a single dictionary per column, so dictionary 
+    columns are written as plain strings in Arrow output.
+    """
+    pa = _require_pyarrow()
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+    writer = None
+    try:
+        for chunk in pd.read_csv(tsv_path, sep='\t', chunksize=chunksize):
+            table = pa.Table.from_pandas(with_output_dtypes(chunk), preserve_index=False)
+            if writer is None:
+                # the schema of the first chunk is used for all chunks
+                schema = pa.schema([f.with_type(_dictionary_type(pa, f.type, fmt)) for f in table.schema])
+                if fmt == "parquet":
+                    writer = pq.ParquetWriter(path, schema, compression=compression)
+                else:
+                    writer = ipc.new_file(path, schema, options=ipc.IpcWriteOptions(compression=compression))
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
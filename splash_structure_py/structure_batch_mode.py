@@ -0,0 +1,147 @@
+"""
+Batch mode: run target and compactor mode on many datasets (e.g. one SPLASH output per tissue or
+donor) in one process. The datasets share the process pool of the executor, the target_p caches
+(of this process and of the pool workers) and one stem index, so every dataset after the first
+starts warm. Datasets run concurrently, each in its own thread, up to --jobs at a time and within
+the available memory (estimated from the input file sizes). Every dataset writes the same results
+to its own output folder as a single ss-target / ss-compactor run.
+The script takes in:
+1. a manifest: tab-separated file with the columns mode (target or compactor), input_file and
+   output_prefix, one dataset per line
+2. optional: --jobs N, --memory_mb N to limit how many datasets run at a time
+3. optional: the options of ss-target and ss-compactor, applied to every dataset of its mode
+"""
+import os
+import time
+import inspect
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+
+from splash_structure_py.structure_target_mode import SS_target
+from splash_structure_py.structure_compactor_mode import SS_compactor
+from splash_structure_py.src.parse_args import argument_parser_batch
+from splash_structure_py.src.executor import available_cpus, configure_executor, shutdown_executor
+from splash_structure_py.src.stem_index import close_stem_index
+from splash_structure_py.src.profiling import finish_profiler
+
+# pipeline and its input file argument, per mode
+BATCH_MODES = {"target": (SS_target, "splash_output_file"), "compactor": (SS_compactor, "compactor_file")}
+MANIFEST_COLUMNS = ["mode", "input_file", "output_prefix"]
+MEMORY_PER_INPUT_MB = 20      # estimated peak memory of a dataset per MB of input file
+# start method of the process pool workers: the dataset threads use the pool, and forking a worker
+# while another thread holds a lock can deadlock it
+POOL_START_METHOD = "forkserver"
+
+def read_manifest(manifest_file):
+    """
+    Read the datasets of a batch manifest as a list of {mode, input_file, output_prefix}.
+    Lines starting with # are ignored.
+    """
+    manifest = pd.read_csv(manifest_file, sep='\t', dtype=str, comment='#', keep_default_na=False)
+    missing = [col for col in MANIFEST_COLUMNS if col not in manifest.columns]
+    if missing:
+        raise ValueError(f"Manifest {manifest_file} has no column {', '.join(missing)}; "
+                         f"the columns are {MANIFEST_COLUMNS}.")
+    unknown = sorted(set(manifest['mode']) - set(BATCH_MODES))
+    if unknown:
+        raise ValueError(f"Unknown mode {', '.join(unknown)} in {manifest_file}, choose from {list(BATCH_MODES)}.")
+    duplicated = manifest['output_prefix'][manifest['output_prefix'].duplicated()].unique()
+    if len(duplicated):
+        raise ValueError(f"Output prefix {', '.join(duplicated)} is used by several datasets of {manifest_file}.")
+    return manifest[MANIFEST_COLUMNS].to_dict('records')
+
+def available_memory_mb():
+    """
+    Memory available to new processes (MemAvailable of /proc/meminfo), or None if unknown.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def dataset_memory_mb(entry):
+    """
+    Estimated peak memory of a dataset, from the size of its input file.
+    """
+    return MEMORY_PER_INPUT_MB * os.path.getsize(entry["input_file"]) / 2**20
+
+def run_dataset(entry, options):
+    """
+    Run one dataset of a batch with the options of its mode and write its run report (--profile).
+    Returns the run time in seconds.
+    """
+    pipeline, input_arg = BATCH_MODES[entry["mode"]]
+    parameters = inspect.signature(pipeline).parameters
+    kwargs = {name: value for name, value in options.items() if name in parameters}
+    start = time.monotonic()
+    try:
+        pipeline(output_prefix=entry["output_prefix"], **{input_arg: entry["input_file"]}, **kwargs)
+    finally:
+        finish_profiler()
+    return time.monotonic() - start
+
+def run_batch(entries, jobs=None, memory_mb=None, **options):
+    """
+    Run the datasets of a batch, starting them in manifest order. A dataset starts when fewer
+    than `jobs` datasets run and the estimated memory of the running ones and of the new one fits
+    in `memory_mb`; one dataset always runs, whatever its size.
+
+    Input:
+    entries: list of {mode, input_file, output_prefix}, see `read_manifest`
+    jobs: datasets run at a time (default: half the available CPUs)
+    memory_mb: memory budget (default: the available memory)
+    options: keyword arguments of SS_target / SS_compactor; each pipeline gets its own
+
+    Output:
+    list with the run time in seconds, or the exception of a failed dataset, per entry
+    """
+    # one executor for all datasets, set up before the dataset threads start; the pipelines take 
+    # it as their executor instead of configuring their own
+    options["executor"] = configure_executor(options.get("executor", "auto"), options.get("workers"), 
+                                             options.get("batch_size"), start_method=POOL_START_METHOD)
+    jobs = jobs or max(1, available_cpus() // 2)
+    memory_mb = memory_mb or available_memory_mb()
+    need = [dataset_memory_mb(entry) for entry in entries]
+    results = [None] * len(entries)
+    pending, running = list(range(len(entries))), {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            while pending and len(running) < jobs and (not running or memory_mb is None or
+                                                       sum(need[i] for i in running.values()) + need[pending[0]] <= memory_mb):
+                i = pending.pop(0)
+                running[pool.submit(run_dataset, entries[i], options)] = i
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    results[i] = future.result()
+                    print(f"Finished {entries[i]['output_prefix']} ({entries[i]['mode']} mode) "
+                          f"in {results[i]:.1f} s.")
+                # a failed dataset (also the sys.exit of the Julia backend) does not stop the others
+                except (Exception, SystemExit) as err:
+                    results[i] = err
+                    print(f"Failed {entries[i]['output_prefix']} ({entries[i]['mode']} mode): {err!r}")
+    return results
+
+def run_SS_batch():
+    arguments = argument_parser_batch()
+    manifest_file = arguments.pop("manifest")
+    # one stem index for all datasets, next to the manifest unless given
+    if arguments["stem_index_dir"] is None:
+        arguments["stem_index_dir"] = os.path.dirname(os.path.abspath(manifest_file))
+    try:
+        entries = read_manifest(manifest_file)
+        results = run_batch(entries, **arguments)
+    finally:
+        shutdown_executor()
+        close_stem_index(arguments["cache_max_age_days"])
+    failed = [entry["output_prefix"] for entry, result in zip(entries, results) if isinstance(result, BaseException)]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(entries)} datasets failed: {', '.join(failed)}.")
+
+if __name__ == "__main__":
+    run_SS_batch()
@@ -3,6 +3,15 @@ The script takes in two arguments:
 1. path to compactor files
 2. working folder name
 3. optional: -a to run element annotation on compactors
+4. optional: --preprocess_backend julia to split compactors with the original Julia script
+5. optional: --output_format {tsv,parquet,arrow} for the result table
+6. optional: --executor, --workers, --batch_size to choose how per-anchor work is parallelized
+7. optional: --checkpoint to write stage checkpoints, --resume, --start_at STAGE, --stop_after STAGE 
+   to rerun parts of the pipeline from them
+8. optional: --profile (and --cprofile) to write per-step timings and memory to run_report.json
+9. optional: --stem_index_dir DIR, --no_stem_index to control the persistent stem index
+10. optional: --annotation_backend {slurm,local}, --annotation_script, ... to choose how the element 
+    annotation job of -a runs
 """
 import sys
 import os
@@ -10,24 +19,28 @@ import argparse
 import pandas as pd
 import subprocess
 from statsmodels.stats.multitest import multipletests
-from pandarallel import pandarallel
 
 from splash_structure_py.src.parse_args import *
 from splash_structure_py.src.process_targets import *
 import splash_structure_py.src.find_comp_mut as find_comp_mut
 import splash_structure_py.src.get_pval as get_pval
 import splash_structure_py.src.elem_annas as elem_annas
+from splash_structure_py.src.process_compactors import process_compactors, lean_compactor_table, pairing_segments, \
+    add_segment_columns, anchor_split_column, drop_unused_categories, base_segment_stems
+from splash_structure_py.src.executor import configure_executor, shutdown_executor
+from splash_structure_py.src.stem_index import open_stem_index, close_stem_index, STEM_COLUMNS
+from splash_structure_py.src.result_cache import CACHE_MAX_AGE_DAYS
+from splash_structure_py.src.job_runner import configure_job_runner, POLL_INTERVAL, MAX_POLL_INTERVAL
+from splash_structure_py.src.checkpoints import Checkpoints, COMPACTOR_STAGES, COMPACTOR_PARAM_STAGES
+from splash_structure_py.src.table_io import read_table, write_table, table_path, with_output_dtypes
+from splash_structure_py.src.profiling import configure_profiler, finish_profiler
 
 
-def SS_compactor(output_prefix, compactor_file, element_annotation):
-    """ Step 0: Preparation """
-    # Initialize parallelization. Create folder to save results
-    pandarallel.initialize()
-    outfolder = f'{output_prefix}_results'
-    os.makedirs(outfolder, exist_ok=True)
+def julia_process_compactors(compactor_file, outfolder):
+    """
+    Step 1 with the Julia backend: run process_compactor_4_segments.jl and read its output back.
+    """
     os.makedirs(f'{outfolder}/interm_compactor', exist_ok=True)
-
-    """ Step 1: Read in compactors and process dataframe using Julia script """
     # Define the command to run the Julia script
     current_dir = os.path.dirname(os.path.abspath(__file__))
     julia_script_path = os.path.join(current_dir, 'src', 'process_compactor_4_segments.jl')
@@ -36,100 +49,245 @@ def SS_compactor(output_prefix, compactor_file, element_annotation):
     # Run the Julia script using subprocess and wait for it to finish
     completed_process = subprocess.run(julia_command, shell=True)
 
-    """ Step 2: Read in processed compactors & add number of compactors """
     # Check if the Julia script ran successfully (exit code 0)
     if completed_process.returncode == 0:
         df = pd.read_csv(f"{outfolder}/interm_compactor/processed_compactors.tsv", sep = '\t')
+        # S1 and S2 are derived from the compactor again when needed
+        return lean_compactor_table(df)
     else:
         print("Julia script encountered an error or did not finish successfully.")
         sys.exit(1)
 
-    # exit program if no compactor is left after abundance filtering
-    if len(df) == 0:
-        print("No structure is found for any anchor. Exiting..")
-        return
-
-    """ 
-    Step 3: Find parameters that are to be used in anchor-p computation, 
-    along with three types of notations
+def compactor_stems(df):
+    """
+    Step 3 (1): find stem loop index of base_S1 and base_S2 and drop compactors without stem.
     """
-    # find stem loop index
-    df[["stem_start_idx_1", "stem_end_idx_1", "rc_start_idx_1", "rc_end_idx_1", "stemL_1"]] = pd.DataFrame(df.parallel_apply(lambda x: find_stem_ind(x.base_S1, 5), axis=1).tolist())
-    df[["stem_start_idx_2", "stem_end_idx_2", "rc_start_idx_2", "rc_end_idx_2", "stemL_2"]] = pd.DataFrame(df.parallel_apply(lambda x: find_stem_ind(x.base_S2, 5), axis=1).tolist())
+    # base_S1 and base_S2 repeat on every compactor of an anchor_split, so both segments go 
+    # through one deduplicated search, with one pairing matrix per base compactor
+    stems_1, stems_2 = base_segment_stems(df.base_S1, df.base_S2, df.segment_index, 5)
+    df[[f"{col}_1" for col in STEM_COLUMNS]] = pd.DataFrame(stems_1, index=df.index)
+    df[[f"{col}_2" for col in STEM_COLUMNS]] = pd.DataFrame(stems_2, index=df.index)
 
     # Add a column of number of stem-loop structure found in the compactors
     df['num_stem_loop'] = (df['stemL_1'] != 0).astype(int) + (df['stemL_2'] != 0).astype(int)
 
     # drop anchors without stem using condition num_stem_loop == 0 
-    df = df[df.num_stem_loop != 0].reset_index(drop = True)
+    return drop_unused_categories(df[df.num_stem_loop != 0].reset_index(drop = True))
 
-    # exit program if no structure is found in any target
-    if len(df) == 0:
-        print("No structure is found for any anchor. Exiting...")
-        return
-
-    # find mutations in stem & addition two columns for structure notations
-    df[["totaMut_1", "stemMut_1", "compMut_1", "strucNotation_1"]] = pd.DataFrame(df.parallel_apply(lambda x: find_comp_mut.find_mutation(x.base_S1, \
-                                                    x.S1, x.stem_start_idx_1, x.stem_end_idx_1, x.rc_start_idx_1, x.rc_end_idx_1), axis=1).tolist())
-    df["db_strucNotation_1"] = df.parallel_apply(lambda x: find_comp_mut.db_notation_from_old_notaion(x.strucNotation_1), axis=1) 
-    df["symbol_strucNotation_1"]= df.parallel_apply(lambda x: find_comp_mut.symbol_notation_from_old_notaion(x.strucNotation_1, x.db_strucNotation_1), axis=1)
+def compactor_mutations(df, notation="all"):
+    """
+    Step 3 (2): find mutations in the stems of S1 and S2 and sum them over the two segments.
+    """
+    # S1 and S2 are built for this step only and stored in Step 8.
+    # three columns for structure notations are filled in Step 8
+    S1, S2 = pairing_segments(df.compactor, df.segment_index, len(df.anchor.iloc[0]))
+    df["totaMut_1"], df["stemMut_1"], df["compMut_1"], _ = find_comp_mut.find_mutation_batch(df.base_S1, \
+                                                    S1, df.stem_start_idx_1, df.stem_end_idx_1, df.rc_start_idx_1, df.rc_end_idx_1, 
+                                                    notation=False)
+    if notation != "none":
+        df = find_comp_mut.init_notation_columns(df, "_1")
 
-    df[["totaMut_2", "stemMut_2", "compMut_2", "strucNotation_2"]] = pd.DataFrame(df.parallel_apply(lambda x: find_comp_mut.find_mutation(x.base_S2, \
-                                                    x.S2, x.stem_start_idx_2, x.stem_end_idx_2, x.rc_start_idx_2, x.rc_end_idx_2), axis=1).tolist())
-    df["db_strucNotation_2"] = df.parallel_apply(lambda x: find_comp_mut.db_notation_from_old_notaion(x.strucNotation_2), axis=1) 
-    df["symbol_strucNotation_2"]= df.parallel_apply(lambda x: find_comp_mut.symbol_notation_from_old_notaion(x.strucNotation_2, x.db_strucNotation_2), axis=1)
+    df["totaMut_2"], df["stemMut_2"], df["compMut_2"], _ = find_comp_mut.find_mutation_batch(df.base_S2, \
+                                                    S2, df.stem_start_idx_2, df.stem_end_idx_2, df.rc_start_idx_2, df.rc_end_idx_2, 
+                                                    notation=False)
+    del S1, S2
+    if notation != "none":
+        df = find_comp_mut.init_notation_columns(df, "_2")
 
     # compute compactor_p (target_p in target mode) using summation of two segaments
     df['stemL'] = df['stemL_1'] + df['stemL_2'] 
     df['totaMut'] = df['totaMut_1'] + df['totaMut_2']
     df['stemMut'] = df['stemMut_1'] + df['stemMut_2']
     df['compMut'] = df['compMut_1'] + df['compMut_2']
+    # small integer dtypes for the indices and counts
+    return with_output_dtypes(df)
 
-    """ Step 4: Calculate structure target-p """
-    df["compactor_p"] = df.parallel_apply(lambda x: get_pval.target_p(2 * len(x['base_S1']), x['stemL'], x['totaMut'], x['stemMut'], x['compMut']), axis=1) 
+def add_compactor_p(df):
+    """
+    Step 4: Calculate structure target-p
+    """
+    df["compactor_p"] = get_pval.target_p_batch(2 * df['base_S1'].str.len(), df['stemL'], \
+                                                df['totaMut'], df['stemMut'], df['compMut'])
+    return df
 
-    """ Step 5: Calculate anchor_score_per_split """
+def add_anchor_score_per_split(df):
+    """
+    Step 5: Calculate anchor_score_per_split
+    """
+    anchor_split = anchor_split_column(df['anchor'], df['segment_index'])
     df["anchor_score_per_split"] = df["compactor_weight"] * df["compactor_p"]
-    df["anchor_score_per_split"] = df.groupby(["anchor", "segment_index"])["anchor_score_per_split"].transform("sum")
-    df['anchor_split'] = df.apply(lambda x: x['anchor'] + '_' + x['segment_index'], axis=1)
+    df["anchor_score_per_split"] = df.groupby(anchor_split.codes)["anchor_score_per_split"].transform("sum")
+    df['anchor_split'] = anchor_split
+    return df
 
-    """ Step 6: Calculate anchor_p """
-    df = get_pval.wrap_anchor_p_compactor(df)
+def add_compactor_notations(df, notation="all", notation_threshold=0.05):
+    """
+    Step 8: Structure notations for all rows, rows passing the BH threshold, or none
+    """
+    # the wide per-row columns are materialized from here on
+    df = add_segment_columns(df)
+    if notation != "none":
+        rows = None if notation == "all" else df.index[df.anchor_p_BH < notation_threshold]
+        for i in ["1", "2"]:
+            df = find_comp_mut.add_structure_notations(df, rows, f"_{i}", f"base_S{i}", f"S{i}")
+    return df
+
+def SS_compactor(output_prefix, compactor_file, element_annotation, anchor_p_method="conv", 
+                 notation="all", notation_threshold=0.05, preprocess_backend="python", output_format="tsv", 
+                 executor="auto", workers=None, batch_size=None, checkpoint=False, resume=False, start_at=None, 
+                 stop_after=None, profile=False, cprofile=False, stem_index_dir=None, no_stem_index=False, annotation_backend="slurm", 
+                 annotation_script=None, annotation_timeout=None, annotation_poll_interval=POLL_INTERVAL, 
+                 annotation_max_poll_interval=MAX_POLL_INTERVAL, sbatch_args=""):
+    """ Step 0: Preparation """
+    # Set up the executor (one pool for the whole run) and the runner of the element annotation job.
+    # Create folder to save results
+    configure_executor(executor, workers, batch_size)
+    configure_job_runner(annotation_backend, annotation_poll_interval, annotation_max_poll_interval, 
+                         annotation_timeout, sbatch_args)
+    if element_annotation:
+        annotation_script = elem_annas.annotation_script(annotation_script)
+    outfolder = f'{output_prefix}_results'
+    os.makedirs(outfolder, exist_ok=True)
+    # stems of sequences seen in previous runs, see --stem_index_dir
+    open_stem_index(None if no_stem_index else stem_index_dir or outfolder)
+    output_file = table_path(f'{outfolder}/structure_on_compactors', output_format)
+    # stage checkpoints, see --checkpoint, --resume, --start_at and --stop_after
+    params = {"anchor_p_method": anchor_p_method, "notation": notation, "notation_threshold": notation_threshold,
+              "preprocess_backend": preprocess_backend, "output_format": output_format}
+    ckpt = Checkpoints(outfolder, COMPACTOR_STAGES, compactor_file, params, resume, start_at, stop_after, 
+                       checkpoint, COMPACTOR_PARAM_STAGES)
+    # run report (--profile), written by finish_profiler
+    profiler = configure_profiler(outfolder, profile, cprofile, "compactor", params)
+    df = None
+
+    """ Step 1 & 2: Read in compactors and split them into segments (Python or Julia backend) """
+    if ckpt.run("preprocess"):
+        if preprocess_backend == "julia":
+            with profiler.step(1, "process compactors (julia)") as step:
+                df = julia_process_compactors(compactor_file, outfolder)
+                step["rows_out"] = len(df)
+        else:
+            with profiler.step(1, "read input") as step:
+                df = read_table(compactor_file)
+                step["rows_out"] = len(df)
+            with profiler.step(2, "process compactors", df) as step:
+                df = process_compactors(df, segments=False)
+                step["rows_out"] = len(df)
+
+        # exit program if no compactor is left after abundance filtering
+        if len(df) == 0:
+            print("No structure is found for any anchor. Exiting..")
+            return
+        ckpt.done("preprocess", df)
+
+    """ 
+    Step 3: Find parameters that are to be used in anchor-p computation, 
+    along with three types of notations
+    """
+    if ckpt.run("stems"):
+        df = ckpt.latest(df)
+        with profiler.step(3, "stem search and mutations", df) as step:
+            df = compactor_stems(df)
+
+            # exit program if no structure is found in any target
+            if len(df) == 0:
+                print("No structure is found for any anchor. Exiting...")
+                return
+
+            df = compactor_mutations(df, notation)
+            step["rows_out"] = len(df)
+        ckpt.done("stems", df)
+
+    if ckpt.run("stats"):
+        df = ckpt.latest(df)
+        """ Step 4: Calculate structure target-p """
+        with profiler.step(4, "compactor_p", df) as step:
+            df = add_compactor_p(df)
+            step["rows_out"] = len(df)
+
+        """ Step 5: Calculate anchor_score_per_split """
+        with profiler.step(5, "anchor_score_per_split", df) as step:
+            df = add_anchor_score_per_split(df)
+            step["rows_out"] = len(df)
+
+        """ Step 6: Calculate anchor_p """
+        with profiler.step(6, "anchor_p", df) as step:
+            df = get_pval.wrap_anchor_p_compactor(df, anchor_p_method)
+            step["rows_out"] = len(df)
+        ckpt.done("stats", df)
 
     """ Step 7: BH correction on anchors with number of compactor > 2 """
-    # Filter the DataFrame to keep rows with 'anchor_split' counts greater than 2
-    df = df[df.groupby('anchor_split')['compactor'].transform('count') > 2].reset_index(drop=True)
-    
-    # BH correction on anchors with number of num_compactor_split > 2 (this filter can be added before) 
-    df_temp = df[['anchor_split', 'anchor_p']].drop_duplicates()
-    correction = multipletests(df_temp['anchor_p'], alpha=0.05, method='fdr_bh')
-    df_temp['anchor_p_BH'] = correction[1]
-    
-    # Merge back
-    df_temp = df_temp.drop(columns=['anchor_p'])
-    df = df.merge(df_temp, on='anchor_split', how = 'left')
-
-    # Sort dataframe
-    df = df.sort_values(by = ['anchor_p_BH', 'anchor_split'], ascending=True).reset_index(drop=True)
-
-    """ Step 8: SAVE """
-    df.to_csv(f'{outfolder}/structure_on_compactors.tsv', index=False, sep='\t')
+    if ckpt.run("bh"):
+        df = ckpt.latest(df)
+        with profiler.step(7, "BH correction", df) as step:
+            # Filter the DataFrame to keep rows with 'anchor_split' counts greater than 2
+            df = df[df.groupby('anchor_split', observed=True)['compactor'].transform('count') > 2].reset_index(drop=True)
+            
+            # BH correction on anchors with number of num_compactor_split > 2 (this filter can be added before) 
+            df_temp = df[['anchor_split', 'anchor_p']].drop_duplicates()
+            correction = multipletests(df_temp['anchor_p'], alpha=0.05, method='fdr_bh')
+            df_temp['anchor_p_BH'] = correction[1]
+            
+            # Merge back
+            df_temp = df_temp.drop(columns=['anchor_p'])
+            df = df.merge(df_temp, on='anchor_split', how = 'left')
 
-    if element_annotation:
-        """ Step 9: elememt annotations (optional, toggle on by -a)  """
-        # run element annotations
-        elem_ann_folder = elem_annas.run_anns(outfolder, "compactor", 40)
+            # Sort dataframe
+            df = df.sort_values(by = ['anchor_p_BH', 'anchor_split'], ascending=True).reset_index(drop=True)
+            step["rows_out"] = len(df)
+        ckpt.done("bh", df)
 
-        """ Step 10: merge structure results with element annotations """
-        anns_file = f"{outfolder}/elem_anns/{elem_ann_folder}_work/{elem_ann_folder}/element_annotations/element_annotations_anchors.tsv"
-        df_anns = pd.read_csv(anns_file, sep='\t')
-        df = elem_annas.merge_anns_struc(df_anns, df, "compactor")
-        df.to_csv(f'{outfolder}/structure_on_compactors.tsv', index=False, sep='\t')
+    # Steps 8 and 9 keep all rows, so the element annotation job can start on the compactors of 
+    # the results now and run during them
+    annotation = None
+    if element_annotation and df is not None and ckpt.runs("annotation"):
+        annotation = elem_annas.submit_anns(outfolder, "compactor", 40, script=annotation_script, chunks=[df])
+
+    """ Step 8: Structure notations for all rows, rows passing the BH threshold, or none """
+    if ckpt.run("notation"):
+        df = ckpt.latest(df)
+        with profiler.step(8, "notations", df) as step:
+            df = add_compactor_notations(df, notation, notation_threshold)
+            step["rows_out"] = len(df)
+        ckpt.done("notation", df)
+
+    """ Step 9: SAVE """
+    if ckpt.run("save"):
+        df = ckpt.latest(df)
+        with profiler.step(9, "save", df) as step:
+            df = add_segment_columns(df)
+            write_table(df, output_file)
+            step["rows_out"] = len(df)
+        ckpt.done("save")
+
+    if element_annotation and ckpt.run("annotation"):
+        """ Step 10: elememt annotations (optional, toggle on by -a)  """
+        # wait for the job (local subprocess or SLURM, see --annotation_backend); if the BH 
+        # correction did not run in this run, start it on the saved results and load them while it runs
+        if annotation is None:
+            annotation = elem_annas.submit_anns(outfolder, "compactor", 40, structure_file=output_file, 
+                                                script=annotation_script)
+        job, elem_ann_folder = annotation
+        df = ckpt.latest(df)
+        with profiler.step(10, "element annotation", df):
+            anns_file = elem_annas.finish_anns(job, outfolder, elem_ann_folder)
+
+        """ Step 11: merge structure results with element annotations """
+        with profiler.step(11, "merge annotations", df) as step:
+            df_anns = elem_annas.read_annotations(anns_file)
+            df = elem_annas.merge_anns_struc(df_anns, df, "compactor")
+            write_table(df, output_file)
+            step["rows_out"] = len(df)
+        ckpt.done("annotation")
 
 def run_SS_compactor():
     arguments = argument_parser_compactor()
-    SS_compactor(**arguments)
+    try:
+        SS_compactor(**arguments)
+    finally:
+        shutdown_executor()
+        close_stem_index(CACHE_MAX_AGE_DAYS)
+        finish_profiler()
 
 if __name__ == "__main__":
-    arguments = argument_parser_compactor()
-    SS_compactor(**arguments)
+    run_SS_compactor()
@@ -5,86 +5,379 @@ Two arguments are required:
     1. SPLASH significant anchors output
     2. output folder name (does not need to exist)
     3. optional: -a to run element annotation on extendors
+    4. optional: --stream_chunk_size N to process the SPLASH output N anchors at a time
+    5. optional: --output_format {tsv,parquet,arrow} for the result table
+    6. optional: --executor, --workers, --batch_size to choose how per-anchor work is parallelized
+    7. optional: --no_cache, --cache_dir, ... to control the per-anchor result cache for reruns
+    8. optional: --checkpoint to write stage checkpoints, --resume, --start_at STAGE, 
+       --stop_after STAGE to rerun parts of the pipeline from them
+    9. optional: --profile (and --cprofile) to write per-step timings and memory to run_report.json
+    10. optional: --stem_index_dir DIR, --no_stem_index to control the persistent stem index
+    11. optional: --annotation_backend {slurm,local}, --annotation_script, ... to choose how the 
+        element annotation job of -a runs
 """
 import sys
 import os
+import shutil
 import argparse
+import itertools
 import pandas as pd
 from statsmodels.stats.multitest import multipletests
-from pandarallel import pandarallel
 
 from splash_structure_py.src.parse_args import *
 from splash_structure_py.src.process_targets import *
 import splash_structure_py.src.find_comp_mut as find_comp_mut
 import splash_structure_py.src.get_pval as get_pval
 import splash_structure_py.src.elem_annas as elem_annas
+from splash_structure_py.src.stream_utils import bh_by_chunk, merge_sorted_tsv
+from splash_structure_py.src.executor import configure_executor, shutdown_executor
+from splash_structure_py.src.stem_index import open_stem_index, close_stem_index
+from splash_structure_py.src.job_runner import configure_job_runner, POLL_INTERVAL, MAX_POLL_INTERVAL
+from splash_structure_py.src.table_io import read_table, iter_table, write_table, table_path, tsv_to_table
+from splash_structure_py.src.checkpoints import Checkpoints, TARGET_STAGES, TARGET_PARAM_STAGES
+from splash_structure_py.src.result_cache import ResultCache, cached_by_anchor, CACHE_MAX_SIZE_MB, CACHE_MAX_AGE_DAYS
+from splash_structure_py.src.profiling import configure_profiler, get_profiler, finish_profiler
 
-def SS_target(output_prefix, splash_output_file, element_annotation):
+def target_mutations(df, notation="all"):
+    """
+    Step 2: Find parameters that are to be used in anchor-p computation
+    """
+    df["totaMut"], df["stemMut"], df["compMut"], _ = find_comp_mut.find_mutation_batch(df.base_target, \
+                                                df.target, df.stem_start_idx, df.stem_end_idx, df.rc_start_idx, df.rc_end_idx, 
+                                                notation=False)
+    # three types of notations are filled in Step 7
+    if notation != "none":
+        df = find_comp_mut.init_notation_columns(df)
+    return df
 
-    """ Step 0: Preparation """
-    # Initialize parallelization. Create folder to save results
-    pandarallel.initialize()
-    outfolder = f'{output_prefix}_results'
-    os.makedirs(outfolder, exist_ok=True)
-    
-    """ Step 1: Read in the input file and process dataframe to get base targets and targets """
-    df = pd.read_csv(splash_output_file, sep = '\t')
-    df = process_df(df)
-    # exit program if no structure is found in any target
-    if len(df) == 0:
-        print("No structure is found for any anchor. Exiting..")
-        return
-
-    """ Step 2: Find parameters that are to be used in anchor-p computation, along with three types of notations"""
-    df[["totaMut", "stemMut", "compMut", "strucNotation"]] = pd.DataFrame(df.parallel_apply(lambda x: find_comp_mut.find_mutation(x.base_target, \
-                                                x.target, x.stem_start_idx, x.stem_end_idx, x.rc_start_idx, x.rc_end_idx), axis=1).tolist())
-    # dot bracket notation
-    df["db_strucNotation"] = df.parallel_apply(lambda x: find_comp_mut.db_notation_from_old_notaion(x.strucNotation), axis=1) 
-    # symbol notation
-    df["symbol_strucNotation"]= df.parallel_apply(lambda x: find_comp_mut.symbol_notation_from_old_notaion(x.strucNotation, x.db_strucNotation), axis=1)
-
-    """ Step 3: Calculate structure target-p """
+def add_target_p(df):
+    """
+    Step 3: Calculate structure target-p of the anchors with more than 2 targets
+    """
     # filter out anchors with number of target <= 2
     df['num_target'] = df.groupby('anchor')['target'].transform('count')
     df = df.loc[df.num_target > 2].reset_index(drop=True)
     # target_p
-    df["target_p"] = df.parallel_apply(lambda x: get_pval.target_p(len(x['base_target']), \
-                                       x['stemL'], x['totaMut'], x['stemMut'], x['compMut']), axis=1) 
-    
-    """ Step 4: Calculate anchor_score """
+    df["target_p"] = get_pval.target_p_batch(df['base_target'].str.len(), df['stemL'], \
+                                             df['totaMut'], df['stemMut'], df['compMut'])
+    return df
+
+def add_anchor_score(df):
+    """
+    Step 4: Calculate anchor_score
+    """
     df["anchor_score"] = df["tar_wgt_filtered"] * df["target_p"]
     df["anchor_score"] = df.groupby(["anchor"])["anchor_score"].transform("sum")
+    return df
+
+def target_stats(df, anchor_p_method="conv", notation="all"):
+    """
+    Steps 1 to 5 on SPLASH rows: process targets, find mutations, compute target_p and anchor_p.
+    Every anchor is handled independently of the other anchors, so this can run on any 
+    anchor-complete subset of the SPLASH output. Returns an empty dataframe if no structure is found.
+    """
+    profiler = get_profiler()
+    """ Step 1: Process dataframe to get base targets and targets """
+    with profiler.step(1, "process targets", df) as step:
+        df = process_df(df)
+        step["rows_out"] = len(df)
+    if len(df) == 0:
+        return df
+
+    """ Step 2: Find parameters that are to be used in anchor-p computation """
+    with profiler.step(2, "find mutations", df) as step:
+        df = target_mutations(df, notation)
+        step["rows_out"] = len(df)
+
+    """ Step 3: Calculate structure target-p """
+    with profiler.step(3, "target_p", df) as step:
+        df = add_target_p(df)
+        step["rows_out"] = len(df)
+    
+    """ Step 4: Calculate anchor_score """
+    with profiler.step(4, "anchor_score", df) as step:
+        df = add_anchor_score(df)
+        step["rows_out"] = len(df)
 
     """ Step 5: Calculate anchor_p """
-    df = get_pval.wrap_anchor_p_target(df)
+    with profiler.step(5, "anchor_p", df) as step:
+        df = get_pval.wrap_anchor_p_target(df, anchor_p_method)
+        step["rows_out"] = len(df)
+    return df
+
+def target_stats_cached(df, anchor_p_method="conv", notation="all", cache=None):
+    """
+    `target_stats` with per-anchor results read from / written to the result cache. Anchors are 
+    keyed by their SPLASH row (anchor, M, targets and counts) and the parameters of the run, so 
+    only new or changed anchors are recomputed.
+    """
+    if cache is None:
+        return target_stats(df, anchor_p_method, notation)
+    key_columns = ["anchor", "M"] + df.filter(regex="^(cnt_)?most_freq_target_").columns.to_list()
+    params = {"mode": "target", "anchor_p_method": anchor_p_method, "notation_columns": notation != "none"}
+    return cached_by_anchor(df, lambda sub_df: target_stats(sub_df, anchor_p_method, notation), 
+                            cache, key_columns, params)
+
+def open_result_cache(outfolder, no_cache=False, cache_dir=None):
+    """
+    Result cache in `cache_dir` (default: the output folder), or None with --no_cache.
+    """
+    return None if no_cache else ResultCache(cache_dir or outfolder)
+
+def close_result_cache(cache, cache_max_size_mb=CACHE_MAX_SIZE_MB, cache_max_age_days=CACHE_MAX_AGE_DAYS):
+    if cache is not None:
+        cache.evict(cache_max_size_mb, cache_max_age_days)
+        cache.close()
+
+def add_notations(df, notation="all", notation_threshold=0.05):
+    """
+    Step 7: Structure notations for all rows, rows passing the BH threshold, or none
+    """
+    if notation != "none":
+        rows = None if notation == "all" else df.index[df.anchor_p_BH < notation_threshold]
+        df = find_comp_mut.add_structure_notations(df, rows)
+    return df
+
+def element_annotation_target(outfolder, df, output_file, annotation):
+    """
+    Steps 9 and 10: wait for the element annotation job and merge its annotations with the 
+    structure results. `annotation` is the (job, folder) of `elem_annas.submit_anns`, started 
+    as soon as the sequences of the results were known.
+    """
+    profiler = get_profiler()
+    """ Step 9: elememt annotations (optional, toggle on by -a) """
+    # wait for the element annotation job (local subprocess or SLURM, see --annotation_backend)
+    with profiler.step(9, "element annotation", df):
+        anns_file = elem_annas.finish_anns(annotation[0], outfolder, annotation[1])
+
+    """ Step 10: merge structure results with element annotations """
+    with profiler.step(10, "merge annotations", df) as step:
+        df_anns = elem_annas.read_annotations(anns_file)
+        df = elem_annas.merge_anns_struc(df_anns, df)
+        write_table(df, output_file)
+        step["rows_out"] = len(df)
+
+def element_annotation_target_streaming(outfolder, structure_file, output_file, annotation, 
+                                        stream_chunk_size, output_format="tsv"):
+    """
+    Steps 9 and 10 of `SS_target_streaming`: `element_annotation_target` on the TSV structure 
+    results `structure_file`, merged with the annotations `stream_chunk_size` rows at a time.
+    """
+    profiler = get_profiler()
+    """ Step 9: elememt annotations (optional, toggle on by -a) """
+    with profiler.step(9, "element annotation"):
+        anns_file = elem_annas.finish_anns(annotation[0], outfolder, annotation[1])
+
+    """ Step 10: merge structure results with element annotations, chunk by chunk """
+    with profiler.step(10, "merge annotations") as step:
+        annotated_file = f'{os.path.dirname(structure_file)}/annotated.tsv'
+        step["rows_out"] = elem_annas.merge_anns_struc_chunks(anns_file, structure_file, annotated_file, 
+                                                              stream_chunk_size)
+        if output_format == "tsv":
+            shutil.move(annotated_file, output_file)
+        else:
+            tsv_to_table(annotated_file, output_file, output_format, stream_chunk_size)
+
+def SS_target(output_prefix, splash_output_file, element_annotation, anchor_p_method="conv", 
+              notation="all", notation_threshold=0.05, stream_chunk_size=None, output_format="tsv", 
+              executor="auto", workers=None, batch_size=None, no_cache=False, cache_dir=None, 
+              cache_max_size_mb=CACHE_MAX_SIZE_MB, cache_max_age_days=CACHE_MAX_AGE_DAYS, 
+              checkpoint=False, resume=False, start_at=None, stop_after=None, profile=False, cprofile=False, 
+              stem_index_dir=None, no_stem_index=False, annotation_backend="slurm", annotation_script=None, 
+              annotation_timeout=None, annotation_poll_interval=POLL_INTERVAL, 
+              annotation_max_poll_interval=MAX_POLL_INTERVAL, sbatch_args=""):
+
+    # runner of the element annotation jobs
+    configure_job_runner(annotation_backend, annotation_poll_interval, annotation_max_poll_interval, 
+                         annotation_timeout, sbatch_args)
+    if stream_chunk_size is not None:
+        if checkpoint or resume or start_at or stop_after:
+            raise ValueError("--checkpoint, --resume, --start_at and --stop_after are not available with "
+                             "--stream_chunk_size.")
+        return SS_target_streaming(output_prefix, splash_output_file, element_annotation, anchor_p_method, 
+                                   notation, notation_threshold, stream_chunk_size, output_format, 
+                                   executor, workers, batch_size, no_cache, cache_dir, 
+                                   cache_max_size_mb, cache_max_age_days, profile, cprofile, 
+                                   stem_index_dir, no_stem_index, annotation_script)
+
+    """ Step 0: Preparation """
+    # Set up the executor (one pool for the whole run). Create folder to save results
+    configure_executor(executor, workers, batch_size)
+    if element_annotation:
+        annotation_script = elem_annas.annotation_script(annotation_script)
+    outfolder = f'{output_prefix}_results'
+    os.makedirs(outfolder, exist_ok=True)
+    output_file = table_path(f'{outfolder}/structure_on_targets', output_format)
+    # stems of base targets seen in previous runs, see --stem_index_dir
+    open_stem_index(None if no_stem_index else stem_index_dir or outfolder)
+    # stage checkpoints, see --checkpoint, --resume, --start_at and --stop_after
+    params = {"anchor_p_method": anchor_p_method, "notation": notation, 
+              "notation_threshold": notation_threshold, "output_format": output_format}
+    ckpt = Checkpoints(outfolder, TARGET_STAGES, splash_output_file, params, resume, start_at, stop_after, 
+                       checkpoint, TARGET_PARAM_STAGES)
+    # run report (--profile), written by finish_profiler
+    profiler = configure_profiler(outfolder, profile, cprofile, "target", params)
+    df = None
+    
+    """ Step 1 - 5: Read in the input file, process targets and compute anchor_p (cached per anchor) """
+    if ckpt.run("stats"):
+        cache = open_result_cache(outfolder, no_cache, cache_dir)
+        with profiler.step(0, "read input") as step:
+            df = read_table(splash_output_file)
+            step["rows_out"] = len(df)
+        df = target_stats_cached(df, anchor_p_method, notation, cache)
+        close_result_cache(cache, cache_max_size_mb, cache_max_age_days)
+        # exit program if no structure is found in any target
+        if len(df) == 0:
+            print("No structure is found for any anchor. Exiting..")
+            return
+        ckpt.done("stats", df)
+
+    # Steps 6 to 8 keep all rows, so the element annotation job can start on the sequences of 
+    # the results now and run during them
+    annotation = None
+    if element_annotation and df is not None and ckpt.runs("annotation"):
+        annotation = elem_annas.submit_anns(outfolder, "extendor", script=annotation_script, chunks=[df])
 
     """ Step 6: BH correction on anchors with number of target > 2 """
-    df_temp = df[['anchor', 'anchor_p']].drop_duplicates()
-    correction = multipletests(df_temp['anchor_p'], alpha=0.05, method='fdr_bh')
-    df_temp['anchor_p_BH'] = correction[1]
-    df_temp = df_temp.drop(columns=['anchor_p']) 
-    df = df.merge(df_temp, on='anchor', how = 'left') # Merge back
-    df = df.sort_values(by=['anchor_p_BH', 'anchor'], ascending=True).reset_index(drop=True) #sort
+    if ckpt.run("bh"):
+        df = ckpt.latest(df)
+        with profiler.step(6, "BH correction", df) as step:
+            df_temp = df[['anchor', 'anchor_p']].drop_duplicates()
+            correction = multipletests(df_temp['anchor_p'], alpha=0.05, method='fdr_bh')
+            df_temp['anchor_p_BH'] = correction[1]
+            df_temp = df_temp.drop(columns=['anchor_p']) 
+            df = df.merge(df_temp, on='anchor', how = 'left') # Merge back
+            df = df.sort_values(by=['anchor_p_BH', 'anchor'], ascending=True).reset_index(drop=True) #sort
+            step["rows_out"] = len(df)
+        ckpt.done("bh", df)
 
-    """ Step 7: Save """
-    df.to_csv(f'{outfolder}/structure_on_targets.tsv', index=False, sep='\t')
+    """ Step 7: Structure notations for all rows, rows passing the BH threshold, or none """
+    if ckpt.run("notation"):
+        df = ckpt.latest(df)
+        with profiler.step(7, "notations", df) as step:
+            df = add_notations(df, notation, notation_threshold)
+            step["rows_out"] = len(df)
+        ckpt.done("notation", df)
 
+    """ Step 8: Save """
+    if ckpt.run("save"):
+        df = ckpt.latest(df)
+        with profiler.step(8, "save", df) as step:
+            write_table(df, output_file)
+            step["rows_out"] = len(df)
+        ckpt.done("save")
+
+    if element_annotation and ckpt.run("annotation"):
+        if annotation is None:
+            # stats were not computed in this run: start the annotation job on the saved results, 
+            # and load them while it runs
+            annotation = elem_annas.submit_anns(outfolder, "extendor", structure_file=output_file, 
+                                                script=annotation_script)
+        element_annotation_target(outfolder, ckpt.latest(df), output_file, annotation)
+        ckpt.done("annotation")
+
+def SS_target_streaming(output_prefix, splash_output_file, element_annotation, anchor_p_method="conv", 
+                        notation="all", notation_threshold=0.05, stream_chunk_size=100000, 
+                        output_format="tsv", executor="auto", workers=None, batch_size=None, 
+                        no_cache=False, cache_dir=None, cache_max_size_mb=CACHE_MAX_SIZE_MB, 
+                        cache_max_age_days=CACHE_MAX_AGE_DAYS, profile=False, cprofile=False, 
+                        stem_index_dir=None, no_stem_index=False, annotation_script=None):
+    """
+    Same results as `SS_target`, with peak memory bounded by `stream_chunk_size` SPLASH rows.
+    SPLASH outputs have one row per anchor, so every chunk of rows is anchor-complete.
+    Pass 1 computes anchor_p chunk by chunk and spills the results to disk. Pass 2 applies the 
+    global BH correction to each spilled chunk, sorts it, and merges the sorted chunks. Parquet and 
+    Arrow outputs are converted from the merged TSV chunk by chunk.
+    """
+    """ Step 0: Preparation """
+    configure_executor(executor, workers, batch_size)
     if element_annotation:
-        """ Step 8: elememt annotations (optional, toggle on by -a) """
-        # run element annotations
-        elem_ann_folder = elem_annas.run_anns(outfolder, "extendor")
+        annotation_script = elem_annas.annotation_script(annotation_script)
+    outfolder = f'{output_prefix}_results'
+    spill_folder = f'{outfolder}/stream_chunks'
+    os.makedirs(spill_folder, exist_ok=True)
+    output_file = table_path(f'{outfolder}/structure_on_targets', output_format)
+    cache = open_result_cache(outfolder, no_cache, cache_dir)
+    open_stem_index(None if no_stem_index else stem_index_dir or outfolder)
+    profiler = configure_profiler(outfolder, profile, cprofile, "target_streaming", 
+                                  {"anchor_p_method": anchor_p_method, "notation": notation, 
+                                   "stream_chunk_size": stream_chunk_size, "output_format": output_format})
 
-        """ Step 9: merge structure results with element annotations """
-        anns_file = f"{outfolder}/elem_anns/{elem_ann_folder}_work/{elem_ann_folder}/element_annotations/element_annotations_anchors.tsv"
-        df_anns = pd.read_csv(anns_file, sep='\t')
-        df = elem_annas.merge_anns_struc(df_anns, df)
-        df.to_csv(f'{outfolder}/structure_on_targets.tsv', index=False, sep='\t')
+    """ Step 1 - 5 (pass 1): anchor_p chunk by chunk (cached per anchor), spilled to disk """
+    chunk_files, pval_chunks = [], []
+    chunks = iter_table(splash_output_file, stream_chunk_size)
+    for i in itertools.count():
+        with profiler.step(0, "read input") as step:
+            chunk = next(chunks, None)
+            step["rows_out"] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        df = target_stats_cached(chunk, anchor_p_method, notation, cache)
+        if len(df) == 0:
+            continue
+        chunk_files.append(f'{spill_folder}/chunk_{i}.pkl')
+        df.to_pickle(chunk_files[-1])
+        # one p-value per anchor, in order of first appearance
+        pval_chunks.append(df.drop_duplicates('anchor')['anchor_p'].to_numpy())
+    del df
+    close_result_cache(cache, cache_max_size_mb, cache_max_age_days)
+
+    # exit program if no structure is found in any target
+    if len(chunk_files) == 0:
+        print("No structure is found for any anchor. Exiting..")
+        shutil.rmtree(spill_folder)
+        return
+
+    # the element annotation job runs during pass 2, on the sequences of the spilled chunks
+    if element_annotation:
+        annotation = elem_annas.submit_anns(outfolder, "extendor", script=annotation_script, 
+                                            chunks=(pd.read_pickle(f) for f in chunk_files))
+
+    """ Step 6 (pass 2): BH correction on anchors with number of target > 2 """
+    bh_chunks = bh_by_chunk(pval_chunks)
+    part_files = []
+    for chunk_file, anchor_p_BH in zip(chunk_files, bh_chunks):
+        with profiler.step(6, "BH correction") as step:
+            df = pd.read_pickle(chunk_file)
+            codes, _ = pd.factorize(df['anchor'])
+            df['anchor_p_BH'] = anchor_p_BH[codes]
+            df = df.sort_values(by=['anchor_p_BH', 'anchor'], ascending=True).reset_index(drop=True) #sort
+            step["rows_out"] = len(df)
+
+        """ Step 7: Structure notations for all rows, rows passing the BH threshold, or none """
+        with profiler.step(7, "notations", df) as step:
+            df = add_notations(df, notation, notation_threshold)
+            part_files.append(chunk_file.replace('.pkl', '.tsv'))
+            df.to_csv(part_files[-1], index=False, sep='\t')
+            step["rows_out"] = len(df)
+
+    """ Step 8: Merge the sorted chunks and save """
+    with profiler.step(8, "save"):
+        merged_file = table_path(f'{spill_folder}/merged', 'tsv')
+        merge_sorted_tsv(part_files, merged_file, ['anchor_p_BH', 'anchor'], [float, str])
+        if output_format == "tsv":
+            shutil.copyfile(merged_file, output_file)
+        else:
+            tsv_to_table(merged_file, output_file, output_format, stream_chunk_size)
+
+    try:
+        if element_annotation:
+            # the merged TSV is annotated chunk by chunk, like it was saved
+            element_annotation_target_streaming(outfolder, merged_file, output_file, annotation, 
+                                                stream_chunk_size, output_format)
+    finally:
+        shutil.rmtree(spill_folder)
 
 def run_SS_target():
     arguments = argument_parser_target()
-    SS_target(**arguments)
+    try:
+        SS_target(**arguments)
+    finally:
+        shutdown_executor()
+        close_stem_index(arguments["cache_max_age_days"])
+        finish_profiler()
 
 if __name__ == "__main__":
-    arguments = argument_parser_target()
-    SS_target(**arguments)
+    run_SS_target()
 
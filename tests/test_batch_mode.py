@@ -0,0 +1,66 @@
+import time
+import threading
+import pytest
+
+from splash_structure_py import structure_batch_mode as batch_mode
+from splash_structure_py.src import executor as executor_module
+from splash_structure_py.src.executor import Executor, configure_executor, get_executor
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """
+    Replace the target pipeline by one that records the datasets running with it and the executor
+    it gets; datasets whose output prefix starts with "fail" raise.
+    """
+    monkeypatch.setattr(executor_module, "_executor", Executor("serial"))
+    lock, running, record = threading.Lock(), set(), {"running": [], "executors": [], "results": []}
+    def pipeline(output_prefix, splash_output_file, executor="auto", workers=None, batch_size=None):
+        executor = configure_executor(executor, workers, batch_size)
+        with lock:
+            running.add(output_prefix)
+            record["running"].append(set(running))
+            record["executors"].append(executor)
+        try:
+            if output_prefix.startswith("fail"):
+                raise ValueError(output_prefix)
+            record["results"].append(get_executor().map(abs, range(-2500, 0)))
+            time.sleep(0.05)
+        finally:
+            with lock:
+                running.discard(output_prefix)
+    monkeypatch.setitem(batch_mode.BATCH_MODES, "target", (pipeline, "splash_output_file"))
+    yield record
+    get_executor().shutdown()
+
+def entries(names):
+    return [{"mode": "target", "input_file": f"{name}.tsv", "output_prefix": name} for name in names]
+
+def test_run_batch_limits_jobs(monkeypatch, fake_pipeline):
+    monkeypatch.setattr(batch_mode, "dataset_memory_mb", lambda entry: 1)
+    results = batch_mode.run_batch(entries("abcde"), jobs=2, memory_mb=100, executor="serial")
+    assert all(isinstance(result, float) for result in results)
+    assert max(len(running) for running in fake_pipeline["running"]) == 2
+
+def test_run_batch_memory_gating(monkeypatch, fake_pipeline):
+    need = {"a": 60, "b": 60, "c": 30, "d": 200, "e": 10}
+    monkeypatch.setattr(batch_mode, "dataset_memory_mb", lambda entry: need[entry["output_prefix"]])
+    results = batch_mode.run_batch(entries("abcde"), jobs=4, memory_mb=100, executor="serial")
+    assert all(isinstance(result, float) for result in results)
+    # the oversized dataset runs alone, the others within the budget
+    for running in fake_pipeline["running"]:
+        assert running == {"d"} or sum(need[name] for name in running) <= 100
+    assert {"d"} in fake_pipeline["running"]
+
+def test_run_batch_failed_dataset(monkeypatch, fake_pipeline):
+    monkeypatch.setattr(batch_mode, "dataset_memory_mb", lambda entry: 1)
+    results = batch_mode.run_batch(entries(["a", "fail_b", "c"]), jobs=2, memory_mb=100, executor="serial")
+    assert isinstance(results[0], float) and isinstance(results[2], float)
+    assert isinstance(results[1], ValueError)
+
+def test_run_batch_shares_one_executor(monkeypatch, fake_pipeline):
+    monkeypatch.setattr(batch_mode, "dataset_memory_mb", lambda entry: 1)
+    batch_mode.run_batch(entries("abcd"), jobs=4, memory_mb=100, executor="process", workers=2)
+    executor = get_executor()
+    assert executor.kind == "process" and executor.start_method == batch_mode.POOL_START_METHOD
+    assert all(used is executor for used in fake_pipeline["executors"])
+    assert fake_pipeline["results"] == [list(range(2500, 0, -1))] * 4
@@ -0,0 +1,73 @@
+import os
+import pandas as pd
+import pytest
+
+from splash_structure_py.src.checkpoints import Checkpoints
+
+STAGES = ["stats", "bh", "save"]
+PARAM_STAGES = {"method": "stats", "output_format": "save"}
+
+def run_stages(outfolder, input_file, params, ran=None, **options):
+    """
+    Run the three stages like a pipeline; return the stages that ran and the final frame.
+    """
+    ran = [] if ran is None else ran
+    ckpt = Checkpoints(outfolder, STAGES, input_file, params, param_stages=PARAM_STAGES, **options)
+    df = None
+    if ckpt.run("stats"):
+        ran.append("stats")
+        df = pd.DataFrame({"anchor_p": [0.1, 0.2], "method": params["method"]})
+        ckpt.done("stats", df)
+    if ckpt.run("bh"):
+        ran.append("bh")
+        df = ckpt.latest(df).assign(anchor_p_BH=lambda x: x.anchor_p * 2)
+        ckpt.done("bh", df)
+    if ckpt.run("save"):
+        ran.append("save")
+        df = ckpt.latest(df)
+        ckpt.done("save")
+    return ran, df
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "input.tsv"
+    path.write_text("anchor\nACGT\n")
+    return str(path)
+
+PARAMS = {"method": "conv", "output_format": "tsv"}
+
+def test_no_checkpoints_by_default(tmp_path, input_file):
+    ran, _ = run_stages(str(tmp_path), input_file, PARAMS)
+    assert ran == STAGES
+    assert not os.path.exists(tmp_path / "checkpoints")
+
+def test_resume_skips_completed_stages(tmp_path, input_file):
+    run_stages(str(tmp_path), input_file, PARAMS, enabled=True)
+    ran, _ = run_stages(str(tmp_path), input_file, PARAMS, resume=True)
+    assert ran == []
+    # an option of the save stage only reruns that stage, from the checkpoint of bh
+    ran, df = run_stages(str(tmp_path), input_file, dict(PARAMS, output_format="parquet"), resume=True)
+    assert ran == ["save"]
+    assert df.anchor_p_BH.tolist() == [0.2, 0.4]
+
+def test_start_at_loads_previous_checkpoint(tmp_path, input_file):
+    run_stages(str(tmp_path), input_file, PARAMS, stop_after="stats")
+    ran, df = run_stages(str(tmp_path), input_file, dict(PARAMS, output_format="parquet"), start_at="bh")
+    assert ran == ["bh", "save"]
+    assert df.method.tolist() == ["conv", "conv"]
+
+def test_start_at_rejects_checkpoint_with_other_options(tmp_path, input_file):
+    run_stages(str(tmp_path), input_file, dict(PARAMS, method="exhaustive"), enabled=True)
+    with pytest.raises(ValueError, match="other options \\(method\\)"):
+        run_stages(str(tmp_path), input_file, PARAMS, start_at="bh")
+
+def test_changed_input_invalidates_checkpoints(tmp_path, input_file):
+    run_stages(str(tmp_path), input_file, PARAMS, enabled=True)
+    with open(input_file, 'a') as f:
+        f.write("TTTT\n")
+    ran, _ = run_stages(str(tmp_path), input_file, PARAMS, resume=True)
+    assert ran == STAGES
+    with pytest.raises(ValueError, match="no checkpoint"):
+        with open(input_file, 'a') as f:
+            f.write("GGGG\n")
+        run_stages(str(tmp_path), input_file, PARAMS, start_at="bh")
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from splash_structure_py.src import elem_annas
+
+def per_row_hits(df_anns):
+    """
+    {sequence: {hits column: hits_pos}} built row by row, as the merge did before `annotation_hits`.
+    """
+    results = {}
+    for _, row in df_anns.iterrows():
+        hit_info = {}
+        for col in df_anns.columns:
+            if 'hits' in col and '_pos' not in col and row[col] != '*':
+                hit_info[col] = row[col.replace('hits', 'hits_pos')]
+        results[row['anchor']] = hit_info
+    return results
+
+def random_annotations(rng, seqs):
+    """
+    Annotation table of `seqs` with three hit databases, '*' for no hit, and a column that is
+    not a hit column.
+    """
+    df = pd.DataFrame({"anchor": seqs, "anchor_length": [str(len(seq)) for seq in seqs]})
+    for db in ["Rfam", "IS", "ECOLI"]:
+        found = rng.random(len(seqs)) < 0.4
+        df[f"{db}_hits"] = np.where(found, [f"{db}{i}" for i in range(len(seqs))], '*')
+        df[f"{db}_hits_pos"] = np.where(found, [f"{i}-{i + 20}" for i in range(len(seqs))], '*')
+    return df
+
+@pytest.mark.parametrize("seq_type", ["extendor", "compactor"])
+def test_merge_anns_struc_matches_per_row_merge(seq_type):
+    rng = np.random.default_rng(0)
+    seqs = [''.join(rng.choice(list("ACGT"), 12)) for _ in range(200)]
+    # some sequences are annotated twice (the last row is used), some not at all
+    df_anns = random_annotations(rng, seqs[:150] + seqs[:150:7])
+    rows = rng.integers(0, len(seqs), 500)
+    if seq_type == "compactor":
+        df_struc = pd.DataFrame({"compactor": [seqs[i] for i in rows]})
+    else:
+        df_struc = pd.DataFrame({"anchor": [seqs[i][:5] for i in rows], "base_target": [seqs[i][5:] for i in rows]})
+    keys = [seqs[i] for i in rows]
+    expected = per_row_hits(df_anns)
+    assert any(expected.get(key) == {} for key in keys) and any(key not in expected for key in keys)
+
+    nested = elem_annas.merge_anns_struc(df_anns, df_struc.copy(), seq_type, nested=True)
+    assert nested["EA"].tolist() == [expected.get(key, {}) for key in keys]
+    flat = elem_annas.merge_anns_struc(df_anns, df_struc.copy(), seq_type)
+    # the text of the dict, as written to TSV
+    assert flat["EA"].tolist() == [str(expected.get(key, {})) for key in keys]
+
+def test_annotation_hits_long_table():
+    df_anns = pd.DataFrame({"anchor": ["AC", "GT", "AC", "TT"],
+                            "Rfam_hits": ["R1", "*", "R2", "*"], "Rfam_hits_pos": ["1-5", "*", "2-6", "*"],
+                            "IS_hits": ["I1", "I2", "*", "*"], "IS_hits_pos": ["3-9", "4-8", "*", "*"]})
+    hits = elem_annas.annotation_hits(df_anns)
+    # the last row of AC is used; TT has no hit
+    assert hits.values.tolist() == [["AC", "Rfam_hits", "R2", "2-6"], ["GT", "IS_hits", "I2", "4-8"]]
+    empty = elem_annas.annotation_hits(df_anns[["anchor"]])
+    assert list(empty.columns) == ["anchor", "database", "hit", "hits_pos"] and len(empty) == 0
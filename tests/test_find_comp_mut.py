@@ -0,0 +1,84 @@
+import random
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src import find_comp_mut
+from splash_structure_py.src.stem_search import find_stem_ind
+from splash_structure_py.src.seq_array import SeqArray
+
+def random_rows(n_row, seq_len=27, max_mut=6, seed=0):
+    """
+    Base targets with a stem and mutated targets, as columns of a dataframe.
+    """
+    rng = random.Random(seed)
+    rows = []
+    while len(rows) < n_row:
+        base = ''.join(rng.choice('ACGT') for _ in range(seq_len))
+        stem = find_stem_ind(base, 5)
+        if stem[4] == 0:
+            continue
+        target = list(base)
+        for i in rng.sample(range(seq_len), rng.randint(0, max_mut)):
+            target[i] = rng.choice('ACGT'.replace(base[i], ''))
+        # add compensatory pairs in the stem
+        for t in range(stem[4]):
+            if rng.random() < 0.3:
+                target[stem[0] + t] = rng.choice('ACGT')
+                target[stem[3] - t] = find_comp_mut.rc(target[stem[0] + t])
+        rows.append((base, ''.join(target), *stem[:4]))
+    return pd.DataFrame(rows, columns=["base_target", "target", "stem_start_idx", "stem_end_idx",
+                                       "rc_start_idx", "rc_end_idx"])
+
+def test_structure_notations_match_old_chain():
+    df = random_rows(300)
+    # compactor segments without a stem
+    df.loc[:9, ["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx"]] = 0
+    struc, db, symbol = find_comp_mut.structure_notations(*[df[col] for col in df.columns])
+    for i, row in enumerate(df.itertuples(index=False)):
+        old_struc = find_comp_mut.find_mutation(*row)[3]
+        old_db = find_comp_mut.db_notation_from_old_notaion(old_struc)
+        old_symbol = find_comp_mut.symbol_notation_from_old_notaion(old_struc)
+        if pd.isna(old_struc):
+            assert pd.isna(struc[i]) and pd.isna(db[i]) and pd.isna(symbol[i])
+        else:
+            assert (struc[i], db[i], symbol[i]) == (old_struc, old_db, old_symbol)
+
+def test_add_structure_notations_on_some_rows():
+    df = find_comp_mut.init_notation_columns(random_rows(50, seed=1))
+    rows = df.index[::3]
+    df = find_comp_mut.add_structure_notations(df, rows)
+    filled = df[find_comp_mut.NOTATION_COLUMNS].notna().all(axis=1)
+    assert filled.index[filled].equals(rows)
+    expected = find_comp_mut.structure_notations(*[df.loc[rows, col] for col in df.columns[:6]])
+    for col, values in zip(find_comp_mut.NOTATION_COLUMNS, expected):
+        np.testing.assert_array_equal(df.loc[rows, col].to_numpy(), values)
+
+def with_n_bases(df, seed=0):
+    """
+    Put N at random positions of some base targets and targets, including stem positions.
+    """
+    rng = random.Random(seed)
+    df = df.copy()
+    for col in ["base_target", "target"]:
+        for i in rng.sample(range(len(df)), len(df) // 4):
+            seq = list(df.at[i, col])
+            for pos in rng.sample(range(len(seq)), rng.randint(1, 3)):
+                seq[pos] = 'N'
+            df.at[i, col] = ''.join(seq)
+    return df
+
+def test_mutation_counts_match_find_mutation():
+    # two sequence lengths, N bases and rows without stem
+    df = pd.concat([random_rows(200, seed=2), random_rows(100, seq_len=40, seed=3)], ignore_index=True)
+    df = with_n_bases(df)
+    df.loc[::11, ["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx"]] = 0
+    expected = np.array([find_comp_mut.find_mutation(*row)[:3] for row in df.itertuples(index=False)])
+    for notation in [False, True]:
+        counts = find_comp_mut.find_mutation_batch(*[df[col] for col in df.columns], notation=notation)[:3]
+        np.testing.assert_array_equal(np.column_stack(counts), expected)
+    # packed counting on its own, for one sequence length
+    rows = df[df.target.str.len() == 27]
+    packed = find_comp_mut.mutation_counts_packed(SeqArray.from_strings(rows.base_target), 
+                                                  SeqArray.from_strings(rows.target), 
+                                                  *[rows[col] for col in rows.columns[2:]])
+    np.testing.assert_array_equal(np.column_stack(packed), expected[rows.index])
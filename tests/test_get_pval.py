@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from splash_structure_py.src import get_pval
+from splash_structure_py.src.executor import Executor
+from splash_structure_py.src.profiling import configure_profiler
+
+def exact_anchor_p(wgt, k, stemL, totaMut, score, method):
+    outcome, pmf, err_bound = get_pval.anchor_score_pmf(len(wgt), wgt, k, stemL, totaMut, method)
+    return get_pval.anchor_p(outcome, pmf, score), err_bound
+
+def random_anchor(rng, num_target, k=27):
+    wgt = rng.random(num_target)
+    wgt = (wgt / wgt.sum()).tolist()
+    stemL = rng.integers(5, 8, num_target).tolist()
+    totaMut = rng.integers(0, 6, num_target).tolist()
+    return wgt, k, stemL, totaMut
+
+def test_target_p_caches():
+    get_pval.clear_caches()
+    params = [(27, 5, 3, 2, 1), (27, 5, 3, 2, 1), (40, 6, 4, 0, 0), (27, 5, 3, 2, 1)]
+    assert [get_pval.target_p(*p) for p in params] == [get_pval._target_p_uncached(*p) for p in params]
+    info = get_pval.cache_info()["target_p"]
+    assert (info["hits"], info["misses"], info["currsize"]) == (2, 2, 2)
+    for _ in range(2):
+        outcome, pmf = get_pval.target_p_outcome_pmf(27, 5, 3)
+        expected_outcome, expected_pmf = get_pval._target_p_outcome_uncached(27, 5, 3)
+        np.testing.assert_array_equal(outcome, expected_outcome)
+        np.testing.assert_array_equal(pmf, expected_pmf)
+    info = get_pval.cache_info()["target_p_outcome"]
+    assert (info["hits"], info["misses"]) == (1, 1)
+    # cached arrays are shared, so callers cannot change them
+    assert not outcome.flags.writeable and not pmf.flags.writeable
+
+@pytest.mark.parametrize("k_range, L_range", [((20, 40), (1, 10)), ((40, 100), (5, 20)), ((100, 200), (5, 25))])
+def test_target_p_batch_matches_target_p(k_range, L_range):
+    rng = np.random.default_rng(k_range[0])
+    n = 300
+    k = rng.integers(*k_range, n)
+    stemL = np.minimum(rng.integers(*L_range, n), k // 2)
+    totaMut = rng.integers(0, k + 1)
+    stemMut = rng.integers(0, np.minimum(totaMut, 2 * stemL) + 1)
+    compMut = rng.integers(0, stemMut // 2 + 1)
+    exact = [get_pval.target_p(*params) for params in zip(k, stemL, totaMut, stemMut, compMut)]
+    np.testing.assert_allclose(get_pval.target_p_batch(k, stemL, totaMut, stemMut, compMut), exact, 
+                               rtol=get_pval.TARGET_P_BATCH_RTOL, atol=get_pval.TARGET_P_BATCH_ATOL)
+
+@pytest.mark.parametrize("num_target", [2, 3, 4])
+def test_conv_matches_exhaustive(num_target):
+    rng = np.random.default_rng(num_target)
+    for _ in range(20):
+        wgt, k, stemL, totaMut = random_anchor(rng, num_target)
+        for score in rng.random(5):
+            p_conv, err_bound = exact_anchor_p(wgt, k, stemL, totaMut, score, "conv")
+            p_exhaustive, _ = exact_anchor_p(wgt, k, stemL, totaMut, score, "exhaustive")
+            assert err_bound == 0
+            assert p_conv == pytest.approx(p_exhaustive, abs=1e-12)
+
+def test_binned_conv_within_err_bound():
+    rng = np.random.default_rng(0)
+    wgt, k, stemL, totaMut = random_anchor(rng, 8)
+    outcomes, pmfs = get_pval.prep_for_conv(len(wgt), wgt, k, stemL, totaMut, max_targets=None)
+    exact, exact_pmf, exact_err = get_pval.anchor_pmf_conv(outcomes, pmfs, resolution=None)
+    binned, binned_pmf, err_bound = get_pval.anchor_pmf_conv(outcomes, pmfs, resolution=1e-4, max_support=100)
+    assert exact_err == 0
+    assert 0 < err_bound < 1e-4 * len(wgt)
+    assert binned_pmf.sum() == pytest.approx(1) and exact_pmf.sum() == pytest.approx(1)
+    # every outcome moved by at most err_bound, so the CDFs are within err_bound of each other
+    exact_cdf, binned_cdf = np.cumsum(exact_pmf), np.cumsum(binned_pmf)
+    for t in np.linspace(0, exact.max(), 200):
+        binned_at = binned_cdf[np.searchsorted(binned, t, side='right') - 1] if binned[0] <= t else 0
+        lower = np.searchsorted(exact, t - err_bound - 1e-12, side='right')
+        upper = np.searchsorted(exact, t + err_bound + 1e-12, side='right')
+        assert (exact_cdf[lower - 1] if lower else 0) - 1e-12 <= binned_at
+        assert binned_at <= (exact_cdf[upper - 1] if upper else 0) + 1e-12
+    assert np.dot(binned, binned_pmf) == pytest.approx(np.dot(exact, exact_pmf), abs=err_bound)
+
+def random_target_df(rng, n=300, num_anchor=40):
+    anchors = rng.integers(0, num_anchor, n) # groups interleaved, not sorted
+    df = pd.DataFrame({'anchor': [f"A{i}" for i in anchors], 'tar_wgt_filtered': rng.random(n),
+                       'stemL': rng.integers(5, 8, n), 'totaMut': rng.integers(0, 6, n),
+                       'base_target': ['ACGT' * 6 + 'ACG'] * n})
+    df['anchor_score'] = df.groupby('anchor')['tar_wgt_filtered'].transform('sum') * rng.random()
+    return df
+
+@pytest.mark.parametrize("method", ["conv", "exhaustive"])
+def test_batched_anchor_p_matches_per_anchor(method):
+    df = random_target_df(np.random.default_rng(1))
+    columns = list(df.columns)
+    batched = get_pval.wrap_anchor_p_target(df, method)
+    per_anchor = get_pval.wrap_anchor_p_target(df, method, batched=False).loc[batched.index]
+    assert list(df.columns) == columns # the input frame is left as is
+    np.testing.assert_allclose(batched['anchor_p'], per_anchor['anchor_p'], rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(batched['anchor_p_err'], per_anchor['anchor_p_err'])
+
+def test_grouped_anchor_p_of_many_draws():
+    rng = np.random.default_rng(2)
+    df = random_target_df(rng)
+    codes, _ = pd.factorize(df['anchor'])
+    k = np.full(len(df), 27)
+    scores = rng.random((codes.max() + 1, 3))
+    many, _ = get_pval.anchor_p_grouped(codes, df['tar_wgt_filtered'], k, df['stemL'], df['totaMut'], scores)
+    assert many.shape == scores.shape
+    for draw in range(scores.shape[1]):
+        p_val, _ = get_pval.anchor_p_grouped(codes, df['tar_wgt_filtered'], k, df['stemL'], df['totaMut'], 
+                                             scores[:, draw])
+        np.testing.assert_array_equal(p_val, many[:, draw])
+    for g, (_, rows) in enumerate(df.groupby(codes)):
+        if len(rows) > 1:
+            expected, _ = exact_anchor_p(rows['tar_wgt_filtered'].tolist(), 27, rows['stemL'].tolist(), 
+                                         rows['totaMut'].tolist(), scores[g, 0], "conv")
+            assert many[g, 0] == pytest.approx(expected, abs=1e-12)
+
+def test_grouped_anchor_p_on_process_pool():
+    df = random_target_df(np.random.default_rng(3))
+    codes, _ = pd.factorize(df['anchor'])
+    args = (codes, df['tar_wgt_filtered'], np.full(len(df), 27), df['stemL'], df['totaMut'], 
+            np.full(codes.max() + 1, 0.2))
+    executor = Executor("process", workers=2, serial_threshold=0)
+    try:
+        pooled = get_pval.anchor_p_grouped(*args, executor=executor)
+    finally:
+        executor.shutdown()
+    serial = get_pval.anchor_p_grouped(*args, executor=Executor("serial"))
+    np.testing.assert_array_equal(pooled[0], serial[0])
+
+def test_profiled_cache_counts_from_workers():
+    df = random_target_df(np.random.default_rng(4))
+    codes, _ = pd.factorize(df['anchor'])
+    group_size = np.bincount(codes)
+    get_pval.clear_caches()
+    profiler = configure_profiler(enabled=True)
+    executor = Executor("process", workers=2, serial_threshold=0)
+    try:
+        get_pval.anchor_p_grouped(codes, df['tar_wgt_filtered'], np.full(len(df), 27), df['stemL'], 
+                                  df['totaMut'], np.full(len(group_size), 0.2), executor=executor)
+    finally:
+        executor.shutdown()
+        configure_profiler()
+    # one outcome lookup per target of every anchor with more than one target
+    outcome = profiler.counters["target_p_outcome"]
+    assert outcome["hits"] + outcome["misses"] == group_size[group_size > 1].sum()
+    assert profiler.counters["target_p"]["misses"] > 0
@@ -0,0 +1,31 @@
+import subprocess
+import pytest
+
+from splash_structure_py.src import job_runner
+from splash_structure_py.src.job_runner import JobRunner, JobError
+
+def fake_slurm(monkeypatch, sacct_rows):
+    """
+    sbatch returns job 42, sacct returns the next of `sacct_rows` ("" for no row), scontrol fails.
+    """
+    rows = iter(sacct_rows)
+    def run(command):
+        if command[0] == "sbatch":
+            return subprocess.CompletedProcess(command, 0, "42\n", "")
+        if command[0] == "sacct":
+            return subprocess.CompletedProcess(command, 0, next(rows), "")
+        return subprocess.CompletedProcess(command, 1, "", "slurm_load_jobs error: Invalid job id specified")
+    monkeypatch.setattr(job_runner, "_run", run)
+
+def test_job_unknown_to_slurm_is_lost(monkeypatch):
+    fake_slurm(monkeypatch, [""] * 10)
+    job = JobRunner("slurm", poll_interval=0, max_poll_interval=0, lost_after_polls=3).submit("anns", "run.sh")
+    assert job.poll() is None and job.state == "UNKNOWN"
+    assert job.poll() is None
+    with pytest.raises(JobError, match="unknown to sacct and scontrol"):
+        job.wait()
+
+def test_job_unknown_right_after_submission(monkeypatch):
+    fake_slurm(monkeypatch, ["", "", "PENDING|0:0\n", "", "RUNNING|0:0\n", "COMPLETED|0:0\n"])
+    job = JobRunner("slurm", poll_interval=0, max_poll_interval=0, lost_after_polls=3).submit("anns", "run.sh")
+    assert job.wait().exit_code == 0
@@ -0,0 +1,26 @@
+import inspect
+import pytest
+
+from splash_structure_py.src import parse_args
+from splash_structure_py.structure_target_mode import SS_target
+from splash_structure_py.structure_compactor_mode import SS_compactor
+
+@pytest.mark.parametrize("parser, pipeline, argv", [
+    (parse_args.argument_parser_target, SS_target, ["out", "scores.tsv"]),
+    (parse_args.argument_parser_compactor, SS_compactor, ["out", "compactors.tsv"])])
+def test_parser_defaults_match_pipeline(monkeypatch, parser, pipeline, argv):
+    monkeypatch.setattr("sys.argv", ["ss"] + argv)
+    arguments = parser()
+    params = inspect.signature(pipeline).parameters
+    assert set(arguments) == set(params)
+    # every option has the default of the pipeline
+    defaults = {name: param.default for name, param in params.items() if param.default is not inspect.Parameter.empty}
+    assert {name: arguments[name] for name in defaults} == defaults
+
+def test_batch_parser_options_are_pipeline_options(monkeypatch):
+    monkeypatch.setattr("sys.argv", ["ss-batch", "manifest.tsv", "--checkpoint", "--jobs", "2"])
+    arguments = parse_args.argument_parser_batch()
+    assert arguments["checkpoint"] and arguments["jobs"] == 2
+    dataset_options = set(arguments) - {"manifest", "jobs", "memory_mb"}
+    pipeline_options = set(inspect.signature(SS_target).parameters) | set(inspect.signature(SS_compactor).parameters)
+    assert dataset_options <= pipeline_options
@@ -0,0 +1,109 @@
+import os
+import shutil
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+
+from splash_structure_py.src.process_compactors import process_compactors, base_segment_stems, join_segments, \
+    split_compactors, SEGMENT_PAIRINGS
+from splash_structure_py.src.stem_index import find_stems, open_stem_index, close_stem_index
+from splash_structure_py.src.synthetic import synthetic_compactors
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "test_data")
+COMPACTOR_FILE = os.path.join(TEST_DATA, "test.compactor.tsv")
+JULIA_SCRIPT = os.path.join(os.path.dirname(__file__), "..", "splash_structure_py", "src", 
+                            "process_compactor_4_segments.jl")
+
+def julia_reference(df):
+    """
+    Row by row transcription of `main` of process_compactor_4_segments.jl.
+    """
+    df = df.copy()
+    anchor_len = len(df.iloc[0, 0])
+    # support_rank: sortperm(support, rev=true) of each anchor, assigned to its rows in order
+    rank = {}
+    for _, rows in df.groupby("anchor", sort=False).groups.items():
+        support = df.loc[rows, "support"].tolist()
+        perm = sorted(range(len(support)), key=lambda i: -support[i])
+        rank.update({row: p + 1 for row, p in zip(rows, perm)})
+    df["support_rank"] = [rank[row] for row in df.index]
+    removed = set(df.anchor[(df.support_rank == 2) & (df.support < 2)])
+    df = df[~df.anchor.isin(removed)]
+
+    records = []
+    for name, (a, b, c, d) in [("D1", (0, 1, 2, 3)), ("D2", (0, 2, 1, 3)), ("D3", (0, 3, 1, 2))]:
+        for _, row in df.iterrows():
+            trimmed = row.compactor[anchor_len:]
+            base_len, extra = divmod(len(trimmed), 4)
+            bounds = np.cumsum([0] + [base_len + (i < extra) for i in range(4)])
+            seg = [trimmed[bounds[i]:bounds[i+1]] for i in range(4)]
+            records.append({**row.to_dict(), "segment_index": name, "segment": (seg[a] + seg[b], seg[c] + seg[d])})
+    stacked = pd.DataFrame(records)
+    groups = [stacked.anchor, stacked.segment_index]
+    stacked["compactor_weight"] = stacked.support / stacked.groupby(groups).support.transform("sum")
+    stacked = stacked[stacked.compactor_weight >= 0.05].reset_index(drop=True)
+    groups = [stacked.anchor, stacked.segment_index]
+    base = stacked.groupby(groups).support_rank.transform(lambda rank: rank.idxmin())
+    stacked["base_target"] = stacked.segment[base].to_numpy()
+    stacked = stacked[stacked.base_target != stacked.segment].reset_index(drop=True)
+    groups = [stacked.anchor, stacked.segment_index]
+    stacked["compactor_weight"] = stacked.support / stacked.groupby(groups).support.transform("sum")
+    stacked["S1"], stacked["S2"] = stacked.segment.str[0], stacked.segment.str[1]
+    stacked["base_S1"], stacked["base_S2"] = stacked.base_target.str[0], stacked.base_target.str[1]
+    return stacked.drop(columns=["segment", "base_target"])
+
+def assert_same_table(df, expected):
+    df = df[expected.columns]
+    df = df.astype({col: str for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+@pytest.mark.parametrize("source", ["test_data", "synthetic"])
+def test_process_compactors_matches_julia_script(source):
+    if source == "test_data":
+        compactors = pd.read_csv(COMPACTOR_FILE, sep='\t')
+    else:
+        # unsorted anchors, support ties and anchors dropped by the support filter
+        compactors = synthetic_compactors(200, seq_len=30, max_support=4, seed=11)
+    expected = julia_reference(compactors)
+    assert len(expected) > 0
+    assert_same_table(process_compactors(compactors), expected)
+
+@pytest.mark.skipif(shutil.which("julia") is None, reason="needs julia")
+def test_process_compactors_matches_julia_output(tmp_path):
+    completed = subprocess.run(["julia", JULIA_SCRIPT, COMPACTOR_FILE, str(tmp_path)])
+    if completed.returncode != 0:
+        pytest.skip("the Julia script needs Combinatorics, DataFrames and CSV")
+    expected = pd.read_csv(tmp_path / "processed_compactors.tsv", sep='\t')
+    assert_same_table(process_compactors(pd.read_csv(COMPACTOR_FILE, sep='\t')), expected)
+
+def test_join_segments_inverts_split():
+    compactors = ["ACGTACGTTGCAAGGTCCA", "TTGACCANGTAC"]
+    segments = split_compactors(compactors, 0)
+    S1 = np.concatenate([segments[name][0] for name in SEGMENT_PAIRINGS])
+    S2 = np.concatenate([segments[name][1] for name in SEGMENT_PAIRINGS])
+    segment_index = np.repeat(list(SEGMENT_PAIRINGS), len(compactors))
+    assert join_segments(S1, S2, segment_index).tolist() == compactors * len(SEGMENT_PAIRINGS)
+
+@pytest.mark.parametrize("seq_len", [27, 53])
+def test_base_segment_stems_match_per_segment_search(seq_len):
+    compactors = synthetic_compactors(300, seq_len=seq_len, seed=seq_len)
+    # some compactors with an N base
+    compactors.loc[::7, "compactor"] = [seq[:30] + 'N' + seq[31:] for seq in compactors.compactor[::7]]
+    df = process_compactors(compactors, segments=False)
+    expected = find_stems([df.base_S1, df.base_S2], 5)
+    for stems, expected_stems in zip(base_segment_stems(df.base_S1, df.base_S2, df.segment_index, 5), expected):
+        np.testing.assert_array_equal(stems, expected_stems)
+
+def test_base_segment_stems_with_store(tmp_path):
+    df = process_compactors(synthetic_compactors(100, seed=3), segments=False)
+    expected = find_stems([df.base_S1, df.base_S2], 5)
+    open_stem_index(str(tmp_path))
+    try:
+        # first run fills the store, the second one reads it
+        for _ in range(2):
+            for stems, expected_stems in zip(base_segment_stems(df.base_S1, df.base_S2, df.segment_index, 5), 
+                                             expected):
+                np.testing.assert_array_equal(stems, expected_stems)
+    finally:
+        close_stem_index()
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.process_targets import expand_targets, process_df
+from splash_structure_py.src.stem_search import find_stem_ind
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "test_data")
+STEM_COLUMNS = ["stem_start_idx", "stem_end_idx", "rc_start_idx", "rc_end_idx", "stemL"]
+
+def splash_df():
+    """
+    The test SPLASH output, with some missing targets ('-') and zero counts.
+    """
+    df = pd.read_csv(os.path.join(TEST_DATA, "test.after_correction.scores.tsv"), sep='\t')
+    target_cols = df.filter(regex="^most_freq_target_").columns[1:]
+    for i in range(0, len(df), 3):
+        df.loc[i, target_cols[-2:]] = '-'
+        df.loc[i, ["cnt_" + col for col in target_cols[-2:]]] = 0
+    return df
+
+def process_row(row):
+    """
+    Per-anchor reshaping of one SPLASH row, as expand_targets replaced it.
+    """
+    target_list = [row[tar] for tar in row.filter(regex=("^most_freq_target_")).index.to_list()[1:] if row[tar] != '-']
+    cnt_list = np.array([row[cnt] for cnt in row.filter(regex=("^cnt_most_freq_target_")).index.to_list()[1:] if row[cnt] != 0])
+    return pd.DataFrame({"anchor": row["anchor"], "M": row["M"],
+                         **{col: row[col] for col in STEM_COLUMNS},
+                         "base_target": row["most_freq_target_1"], "target": target_list,
+                         "target_count": cnt_list,
+                         "target_wgt": np.array(cnt_list)/(sum(cnt_list) + row["cnt_most_freq_target_1"])})
+
+def test_expand_targets_matches_per_row():
+    df = splash_df()
+    df[STEM_COLUMNS] = pd.DataFrame([list(find_stem_ind(seq, 5)) for seq in df.most_freq_target_1], index=df.index)
+    expected = pd.concat([process_row(row) for _, row in df.iterrows()], ignore_index=True)
+    pd.testing.assert_frame_equal(expand_targets(df), expected, check_dtype=False)
+
+def test_process_df_filters_and_reweights():
+    df = process_df(splash_df())
+    assert (df.stemL > 0).all() and (df.target_wgt > 0.05).all()
+    np.testing.assert_allclose(df.groupby("anchor")["tar_wgt_filtered"].sum(), 1)
@@ -0,0 +1,17 @@
+import os
+
+from splash_structure_py.src.result_cache import ResultCache
+
+def test_evict_only_vacuums_after_large_deletes(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put_many({f"key{i}": [("x" * 2000,)] for i in range(500)})
+    size = os.path.getsize(cache.path)
+    mtime = os.stat(cache.path).st_mtime_ns
+    # nothing to delete: the file is not rewritten
+    cache.evict(max_size_mb=None, max_age_days=None)
+    assert os.stat(cache.path).st_mtime_ns == mtime
+    # most entries deleted: the file is compacted
+    cache.evict(max_size_mb=0.1, max_age_days=None)
+    assert os.path.getsize(cache.path) < size / 2
+    assert len(cache.get_many([f"key{i}" for i in range(500)])) < 100
+    cache.close()
@@ -0,0 +1,50 @@
+import gzip
+import numpy as np
+import pandas as pd
+
+from splash_structure_py.src.prep_query_for_rfam import export_queries, query_id, query_sequences
+from splash_structure_py.src.merge_structure_rfam import merge_rfam
+
+def read_fasta(path):
+    with gzip.open(path, "rt") as f:
+        lines = f.read().split()
+    return dict(zip([line[1:] for line in lines[::2]], lines[1::2]))
+
+def test_query_sequences_non_contiguous_index():
+    chunk = pd.DataFrame({"anchor": ["AA", "CC", "GG"], "target": ["TT", "GG", "AA"]}, index=[7, 2, 40])
+    assert query_sequences(chunk.iloc[[2, 0]]).tolist() == ["GGAA", "AATT"]
+
+def test_rfam_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    targets = [''.join(rng.choice(list("ACGT"), 10)) for _ in range(30)]
+    # repeated sequences within and across chunks; rows above the threshold are dropped
+    n = 400
+    results = pd.DataFrame({"anchor": rng.choice(["ACGTACGT", "TTGGCCAA"], n),
+                            "target": rng.choice(targets, n), "anchor_p_BH": rng.random(n) * 0.2,
+                            "row": np.arange(n)})
+    results.to_csv(tmp_path / "results.tsv", sep='\t', index=False)
+    significant = results[results.anchor_p_BH < 0.1]
+    seqs = (significant.anchor + significant.target).tolist()
+
+    fasta = tmp_path / "queries.fasta.gz"
+    assert export_queries(tmp_path / "results.tsv", fasta, "extendor", 0.1, chunksize=64) == len(set(seqs))
+    queries = read_fasta(fasta)
+    assert sorted(queries.values()) == sorted(set(seqs))
+    assert all(query_id(seq) == seq_id for seq_id, seq in queries.items())
+
+    # hits for every other query, some with a second (dropped) hit
+    hit_ids = sorted(queries)[::2]
+    rfam = pd.DataFrame({"target name": [f"RF{i:05d}" for i in range(len(hit_ids))], "query name": hit_ids})
+    rfam = pd.concat([rfam, rfam.iloc[::3].assign(**{"target name": "second"})], ignore_index=True)
+    rfam.to_csv(tmp_path / "rfam.tsv", sep='\t', index=False)
+
+    merged_file = tmp_path / "merged.tsv.gz"
+    assert merge_rfam(tmp_path / "results.tsv", tmp_path / "rfam.tsv", merged_file, "extendor", 0.1,
+                      chunksize=64) == len(significant)
+    merged = pd.read_csv(merged_file, sep='\t')
+    # the significant rows in order, each with the first hit of its sequence
+    assert merged["row"].tolist() == significant["row"].tolist()
+    first_hit = dict(zip(rfam["query name"][::-1], rfam["target name"][::-1]))
+    expected = [first_hit.get(query_id(seq), np.nan) for seq in seqs]
+    pd.testing.assert_series_equal(merged["target name"], pd.Series(expected, name="target name"))
+    assert merged["target name"].notna().any() and merged["target name"].isna().any()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from splash_structure_py.src.seq_array import SeqArray, pack_codes, unpack_codes, pack_bits
+
+def random_strings(rng, n, seq_len, alphabet="ACGT"):
+    return [''.join(rng.choice(list(alphabet), seq_len)) for _ in range(n)]
+
+@pytest.mark.parametrize("seq_len", [1, 3, 4, 5, 27, 81])
+def test_pack_unpack_codes(seq_len):
+    codes = np.random.default_rng(seq_len).integers(0, 4, (20, seq_len), dtype=np.uint8)
+    packed = pack_codes(codes)
+    assert packed.shape == (20, -(-seq_len // 4))
+    np.testing.assert_array_equal(unpack_codes(packed, seq_len), codes)
+    mask = codes == 2
+    np.testing.assert_array_equal(unpack_codes(pack_bits(mask), seq_len).astype(bool), mask)
+
+@pytest.mark.parametrize("seq_len", [1, 6, 27, 81])
+@pytest.mark.parametrize("alphabet", ["ACGT", "ACGTN", "N"])
+def test_strings_round_trip(seq_len, alphabet):
+    rng = np.random.default_rng(seq_len)
+    seqs = random_strings(rng, 30, seq_len, alphabet)
+    arr = SeqArray.from_strings(seqs)
+    assert arr.to_strings() == seqs
+    assert (arr.n_bits is None) == ('N' not in ''.join(seqs))
+    ascii_mat = np.array([list(seq.encode('ascii')) for seq in seqs], dtype=np.uint8)
+    np.testing.assert_array_equal(arr.ambiguous(), ascii_mat == ord('N'))
+    rows, cols = np.arange(30)[:, None], rng.integers(0, seq_len, (30, 4))
+    np.testing.assert_array_equal(arr.ambiguous_at(rows, cols), (ascii_mat == ord('N'))[rows, cols])
+    np.testing.assert_array_equal(arr.codes_at(rows, cols), arr.codes()[rows, cols])
+    cols = rng.permutation(seq_len)[:max(1, seq_len // 2)]
+    assert arr.take_columns(cols).to_strings() == [''.join(seq[c] for c in cols) for seq in seqs]
+    assert arr.take([3, 1]).to_strings() == [seqs[3], seqs[1]]
+
+def test_from_strings_rejects_other_input():
+    with pytest.raises(ValueError):
+        SeqArray.from_strings(["ACGT", "ACG"])
+    with pytest.raises(ValueError):
+        SeqArray.from_strings(["ACGT", "ACGR"])
+
+@pytest.mark.parametrize("seq_len", [5, 27, 42])
+def test_mismatch_count_matches_hamming(seq_len):
+    rng = np.random.default_rng(seq_len)
+    seqs = random_strings(rng, 200, seq_len, "ACGTN")
+    others = [''.join(c if rng.random() < 0.7 else rng.choice(list("ACGTN")) for c in seq) for seq in seqs]
+    mask = rng.random((200, seq_len)) < 0.5
+    a, b = SeqArray.from_strings(seqs), SeqArray.from_strings(others)
+    # N matches only N
+    hamming = [sum(x != y for x, y in zip(seq, other)) for seq, other in zip(seqs, others)]
+    masked = [sum(x != y for x, y, m in zip(seq, other, row) if m) for seq, other, row in zip(seqs, others, mask)]
+    assert a.mismatch_count(b).tolist() == hamming
+    assert a.mismatch_count(b, mask).tolist() == masked
+    assert a.mismatches(b).sum(axis=1).tolist() == hamming
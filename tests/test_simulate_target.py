@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from splash_structure_py.structure_target_mode import target_stats
+from splash_structure_py.src import executor, simulate_target
+from splash_structure_py.src.simulate_target import random_mutate_codes, simulate_anchor_p
+from splash_structure_py.src.executor import Executor
+from splash_structure_py.src.synthetic import synthetic_splash
+
+def test_random_mutate_codes_mutates_each_row():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 4, (500, 27), dtype=np.uint8)
+    totaMul = rng.integers(0, 28, len(codes))
+    mutants = random_mutate_codes(codes, totaMul, rng)
+    assert mutants.shape == codes.shape and mutants.max() <= 3
+    # exactly totaMul[i] positions changed, each to one of the other bases
+    np.testing.assert_array_equal((mutants != codes).sum(axis=1), totaMul)
+    # the input is left as is
+    assert not np.shares_memory(mutants, codes)
+    # every other base is reached
+    changed = mutants != codes
+    shifts = (mutants[changed].astype(int) - codes[changed]) % 4
+    assert set(shifts.tolist()) == {1, 2, 3}
+
+@pytest.fixture(scope="module")
+def target_results():
+    return target_stats(synthetic_splash(60, seed=4))
+
+def test_simulate_anchor_p_is_reproducible(target_results, monkeypatch):
+    # several batches, each with its own stream
+    monkeypatch.setattr(simulate_target, "BATCH_ELEMENTS", 20000)
+    summary, draws = simulate_anchor_p(target_results, "target", n_iter=20, seed=7)
+    assert draws.shape == (len(summary), 20) and np.all((draws >= 0) & (draws <= 1 + 1e-9))
+    again_summary, again = simulate_anchor_p(target_results, "target", n_iter=20, seed=7)
+    np.testing.assert_array_equal(again, draws)
+    pd.testing.assert_frame_equal(again_summary, summary)
+    _, other_seed = simulate_anchor_p(target_results, "target", n_iter=20, seed=8)
+    assert not np.array_equal(other_seed, draws)
+    # the results do not depend on the executor
+    monkeypatch.setattr(executor, "_executor", Executor("thread", workers=3, batch_size=1, serial_threshold=2))
+    _, threaded = simulate_anchor_p(target_results, "target", n_iter=20, seed=7)
+    executor.shutdown_executor()
+    np.testing.assert_array_equal(threaded, draws)
@@ -0,0 +1,69 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+from splash_structure_py.src import stem_index
+from splash_structure_py.src.stem_index import StemIndexStore, find_stems, open_stem_index, close_stem_index
+from splash_structure_py.src.stem_search import find_stem_ind
+from splash_structure_py.src.synthetic import synthetic_compactors
+
+@pytest.fixture
+def seqs():
+    return synthetic_compactors(50, seed=5)["compactor"].str[27:]
+
+def counting_search(searched):
+    def search(seqs, stem_L):
+        searched.extend(seqs)
+        return [find_stem_ind(seq, stem_L) for seq in seqs]
+    return search
+
+def test_find_stems_store_hit_and_miss(tmp_path, seqs):
+    expected = np.array([find_stem_ind(seq, 5) for seq in seqs])
+    open_stem_index(str(tmp_path))
+    try:
+        searched = []
+        # duplicated sequences are searched once
+        np.testing.assert_array_equal(find_stems(pd.concat([seqs[:30], seqs[:5]]), 5, counting_search(searched)),
+                                      np.r_[expected[:30], expected[:5]])
+        assert sorted(searched) == sorted(set(seqs[:30]))
+        # hits come from the store, only the new sequences are searched
+        searched.clear()
+        np.testing.assert_array_equal(find_stems(seqs, 5, counting_search(searched)), expected)
+        assert sorted(searched) == sorted(set(seqs[30:]) - set(seqs[:30]))
+        # stems of another stem length are other entries
+        searched.clear()
+        find_stems(seqs[:3], 6, counting_search(searched))
+        assert len(searched) == len(set(seqs[:3]))
+    finally:
+        close_stem_index()
+    # the store persists across runs
+    reopened = open_stem_index(str(tmp_path))
+    try:
+        assert open_stem_index(str(tmp_path)) is reopened
+        searched = []
+        np.testing.assert_array_equal(find_stems(seqs, 5, counting_search(searched)), expected)
+        assert searched == []
+    finally:
+        close_stem_index()
+
+def test_store_eviction(tmp_path):
+    store = StemIndexStore(str(tmp_path))
+    store.put_many({"ACGT": [0, 1, 2, 3, 2], "GGCC": [1, 2, 3, 4, 2], "TTAA": [2, 3, 4, 5, 2]}, 5)
+    # GGCC and TTAA were last used 10 days ago, TTAA by an older version of the stem search
+    store.conn.execute("UPDATE stems SET accessed = ? WHERE seq != 'ACGT'", (time.time() - 10 * 86400,))
+    store.conn.execute("UPDATE stems SET version = ? WHERE seq = 'TTAA'", (stem_index.STEM_INDEX_VERSION - 1,))
+    store.conn.commit()
+    assert set(store.get_many(["ACGT", "GGCC", "TTAA"], 5)) == {"ACGT", "GGCC"}
+    # reading GGCC refreshed it, so only the old version goes
+    store.evict(max_age_days=5)
+    assert store.conn.execute("SELECT seq FROM stems ORDER BY seq").fetchall() == [("ACGT",), ("GGCC",)]
+    store.conn.execute("UPDATE stems SET accessed = ? WHERE seq = 'GGCC'", (time.time() - 10 * 86400,))
+    store.conn.commit()
+    store.close()
+    # closing the shared store evicts entries older than max_age_days
+    open_stem_index(str(tmp_path))
+    close_stem_index(max_age_days=5)
+    store = StemIndexStore(str(tmp_path))
+    assert store.get_many(["ACGT", "GGCC"], 5) == {"ACGT": [0, 1, 2, 3, 2]}
+    store.close()
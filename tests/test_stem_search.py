@@ -0,0 +1,74 @@
+import random
+import numpy as np
+import pytest
+
+from splash_structure_py.src.process_targets import find_stem_ind_bruteforce
+from splash_structure_py.src.stem_search import find_stem_ind, rc, enumerate_hairpins, segment_hairpins, HAIRPIN_COLUMNS
+
+def random_seqs(n_seq, seq_len, alphabet='ACGT', seed=0):
+    """
+    Random sequences, half of them with an inserted inverted repeat.
+    """
+    rng = random.Random(seed)
+    seqs = []
+    for _ in range(n_seq):
+        seq = ''.join(rng.choice(alphabet) for _ in range(seq_len))
+        if rng.random() < 0.5 and seq_len >= 10:
+            stem_len = rng.randint(5, seq_len // 2)
+            start = rng.randint(0, seq_len - 2 * stem_len)
+            rc_start = rng.randint(start + stem_len, seq_len - stem_len)
+            seq = seq[:rc_start] + rc(seq[start:start + stem_len]) + seq[rc_start + stem_len:]
+        seqs.append(seq)
+    return seqs
+
+@pytest.mark.parametrize("seq_len", [4, 9, 10, 27, 80])
+@pytest.mark.parametrize("alphabet", ["ACGT", "ACGTN", "AC"])
+def test_indexed_matches_bruteforce(seq_len, alphabet):
+    for seq in random_seqs(100, seq_len, alphabet, seed=seq_len):
+        for stem_L in (3, 5):
+            assert list(find_stem_ind(seq, stem_L)) == list(find_stem_ind_bruteforce(seq, stem_L)), seq
+
+def maximal_stems_bruteforce(seq, stem_L):
+    """
+    Runs of at least stem_L complementary pairs (a, b), a < b, along every anti-diagonal a + b.
+    """
+    n, stems = len(seq), set()
+    for s in range(2 * n - 1):
+        run = []
+        for a in range(n + 1):
+            b = s - a
+            if a < b < n and rc(seq[a]) == seq[b]:
+                run.append(a)
+                continue
+            if len(run) >= stem_L:
+                start, length = run[0], len(run)
+                rc_start = s - start - length + 1
+                stems.add((start, start + length - 1, rc_start, rc_start + length - 1, length, 
+                           rc_start - start - length))
+            run = []
+    return stems
+
+@pytest.mark.parametrize("seq_len", [9, 27, 60])
+@pytest.mark.parametrize("alphabet", ["ACGT", "ACGTN"])
+def test_enumerate_hairpins(seq_len, alphabet):
+    for seq in random_seqs(50, seq_len, alphabet, seed=seq_len):
+        hairpins = enumerate_hairpins(seq, 5)
+        assert set(map(tuple, hairpins.tolist())) == maximal_stems_bruteforce(seq, 5)
+        assert len(hairpins) == len(set(map(tuple, hairpins.tolist())))
+        # longest first, then by stem start and rc start
+        assert hairpins.tolist() == sorted(hairpins.tolist(), key=lambda h: (-h[4], h[0], h[2]))
+        first = enumerate_hairpins(seq, 5, top_k=1)
+        assert (first[0, :5].tolist() if len(first) else [0, 0, 0, 0, 0]) == list(find_stem_ind(seq, 5))
+
+def test_segment_hairpins_match_enumeration():
+    seqs = random_seqs(40, 40, seed=1)
+    segments = [np.arange(0, 20), np.arange(40)[::2], np.r_[0:10, 25:40]]
+    hairpins = segment_hairpins(seqs, segments, 5, top_k=3)
+    for (i, segment), part in hairpins.groupby(["sequence", "segment"]):
+        sub_seq = ''.join(seqs[i][c] for c in segments[segment])
+        np.testing.assert_array_equal(part[HAIRPIN_COLUMNS].to_numpy(), enumerate_hairpins(sub_seq, 5, top_k=3))
+    found = set(zip(hairpins["sequence"], hairpins["segment"]))
+    for i, seq in enumerate(seqs):
+        for j, cols in enumerate(segments):
+            if (i, j) not in found:
+                assert len(enumerate_hairpins(''.join(seq[c] for c in cols), 5)) == 0
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from splash_structure_py.src.table_io import iter_table, read_table, tsv_to_table
+
+pytest.importorskip("pyarrow")
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_iter_table_chunks(tmp_path, fmt):
+    df = pd.DataFrame({"anchor": [f"A{i % 7}" for i in range(1000)], "M": np.arange(1000)})
+    df.to_csv(tmp_path / "table.tsv", sep='\t', index=False)
+    path = tmp_path / f"table.{fmt}"
+    # written in batches of 256 rows
+    tsv_to_table(tmp_path / "table.tsv", path, fmt, chunksize=256)
+    chunks = list(iter_table(path, 100, columns=["M"]))
+    assert max(len(chunk) for chunk in chunks) <= 100
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), read_table(path, columns=["M"]),
+                                  check_dtype=False)
+    np.testing.assert_array_equal(pd.concat(chunks)["M"], df["M"])
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_tsv_to_table_more_categories_in_later_chunk(tmp_path, fmt):
+    # the first chunk has one anchor (int8 codes), the second 200 distinct anchors
+    df = pd.DataFrame({"anchor": ["A"] * 200 + [f"A{i}" for i in range(200)], "M": np.arange(400)})
+    df.to_csv(tmp_path / "table.tsv", sep='\t', index=False)
+    path = tmp_path / f"table.{fmt}"
+    tsv_to_table(tmp_path / "table.tsv", path, fmt, chunksize=200)
+    out = read_table(path)
+    assert out["anchor"].astype(str).tolist() == df["anchor"].tolist()
+    np.testing.assert_array_equal(out["M"], df["M"])
@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+import pytest
+
+from splash_structure_py import structure_target_mode, structure_compactor_mode
+from splash_structure_py.structure_target_mode import SS_target
+from splash_structure_py.structure_compactor_mode import SS_compactor
+from splash_structure_py.src import elem_annas
+from splash_structure_py.src.table_io import read_table
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "test_data")
+SPLASH_OUTPUT = os.path.join(TEST_DATA, "test.after_correction.scores.tsv")
+COMPACTOR_FILE = os.path.join(TEST_DATA, "test.compactor.tsv")
+
+# element annotation pipeline stand-in: sequences containing CCAT or AGGA get an Rfam hit
+ANNOTATION_SCRIPT = """#!/bin/sh
+out="$2/elem_anns/$3_work/$3/element_annotations"
+mkdir -p "$out"
+awk 'NR == 1 {print "anchor\\tRfam_hits\\tRfam_hits_pos"; next}
+     /CCAT|AGGA/ {print $1 "\\tRF00001\\t1-10"; next}
+     {print $1 "\\t*\\t*"}' "$1" > "$out/element_annotations_anchors.tsv"
+"""
+
+def annotation_options(tmp_path):
+    script = tmp_path / "elem_anns.sh"
+    script.write_text(ANNOTATION_SCRIPT)
+    script.chmod(0o755)
+    return dict(executor="serial", no_stem_index=True, annotation_backend="local", annotation_script=str(script), 
+                annotation_poll_interval=0.05, annotation_max_poll_interval=0.05)
+
+@pytest.mark.parametrize("fmt", ["tsv", "parquet"])
+def test_streaming_annotations_match_in_memory(tmp_path, fmt):
+    if fmt != "tsv":
+        pytest.importorskip("pyarrow")
+    options = dict(output_format=fmt, no_cache=True, **annotation_options(tmp_path))
+    SS_target(str(tmp_path / "memory"), SPLASH_OUTPUT, True, **options)
+    SS_target(str(tmp_path / "stream"), SPLASH_OUTPUT, True, stream_chunk_size=3, **options)
+    expected = read_table(tmp_path / f"memory_results/structure_on_targets.{fmt}")
+    out = read_table(tmp_path / f"stream_results/structure_on_targets.{fmt}")
+    assert (expected["EA"] == "{'Rfam_hits': '1-10'}").any() and (expected["EA"] == "{}").any()
+    # string columns of converted tables use NaN for missing values
+    pd.testing.assert_frame_equal(out, expected, check_dtype=False)
+    assert not os.path.exists(tmp_path / "stream_results/stream_chunks")
+
+@pytest.mark.parametrize("mode", ["target", "compactor"])
+def test_annotation_job_runs_during_notations(tmp_path, monkeypatch, mode):
+    module, pipeline, input_file, notations = {
+        "target": (structure_target_mode, SS_target, SPLASH_OUTPUT, "add_notations"),
+        "compactor": (structure_compactor_mode, SS_compactor, COMPACTOR_FILE, "add_compactor_notations")}[mode]
+    events = []
+    def record(name, func):
+        def wrapper(*args, **kwargs):
+            events.append(name)
+            return func(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(elem_annas, "submit_anns", record("submit", elem_annas.submit_anns))
+    monkeypatch.setattr(module, notations, record("notations", getattr(module, notations)))
+    pipeline(str(tmp_path / mode), input_file, True, **annotation_options(tmp_path))
+    assert events == ["submit", "notations"]
+    output = read_table(tmp_path / f"{mode}_results/structure_on_{mode}s.tsv")
+    assert (output["EA"] == "{'Rfam_hits': '1-10'}").any()
+
+def test_annotation_from_saved_results(tmp_path):
+    options = annotation_options(tmp_path)
+    SS_target(str(tmp_path / "run"), SPLASH_OUTPUT, False, checkpoint=True, **options)
+    SS_target(str(tmp_path / "run"), SPLASH_OUTPUT, True, start_at="annotation", **options)
+    SS_target(str(tmp_path / "expected"), SPLASH_OUTPUT, True, **options)
+    pd.testing.assert_frame_equal(read_table(tmp_path / "run_results/structure_on_targets.tsv"), 
+                                  read_table(tmp_path / "expected_results/structure_on_targets.tsv"))
+
+def test_annotation_script_is_required(monkeypatch, tmp_path):
+    monkeypatch.delenv(elem_annas.ELEM_ANNS_SCRIPT_ENV, raising=False)
+    with pytest.raises(ValueError, match="--annotation_script"):
+        elem_annas.annotation_script()
+    with pytest.raises(ValueError, match="--annotation_script"):
+        SS_target(str(tmp_path / "run"), SPLASH_OUTPUT, True, executor="serial", annotation_backend="local")
+    assert not os.path.exists(tmp_path / "run_results")
+    script = tmp_path / "elem_anns.sh"
+    script.write_text(ANNOTATION_SCRIPT)
+    monkeypatch.setenv(elem_annas.ELEM_ANNS_SCRIPT_ENV, str(script))
+    assert elem_annas.annotation_script() == str(script)